@@ -0,0 +1,121 @@
+"""
+Throughput of the offline collector over compressed captures, against the same capture uncompressed.
+
+    python benchmarks/bench_decompress.py -i capture.pcap [-n RUNS] [--decoded]
+
+gzip, bz2 and xz copies of the capture are written to a temporary directory, then each is read through
+TCPDumpFileCollector on a runtime.Runtime, as trtop -i does, with an analyzer that only counts packets.
+With --decoded the input is tcpdump text output, read with cat instead of tcpdump, eg. the test dumps.
+"""
+import os
+import sys
+import bz2
+import gzip
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trtop"))
+
+from analyzer import BaseAnalyser
+from runtime import Runtime
+from tcpdump.offlinecollector import TCPDumpFileCollector
+from tcpdump.parser import is_valid_line
+
+__author__ = 'Thomas Kountis'
+
+
+class CountingAnalyzer(BaseAnalyser):
+    """
+    Counts packets, stopping @runtime once @expected are seen.
+    """
+
+    def __init__(self, runtime, expected):
+        self.runtime = runtime
+        self.expected = expected
+        self.packets = 0
+
+    def analyse(self, packet):
+        self.packets += 1
+        if self.packets == self.expected:
+            self.runtime.stop()
+
+
+class DecodedFileCollector(TCPDumpFileCollector):
+
+    def _cap_reader_cmd(self):
+        return ["cat", self._cap_reader_input()]
+
+
+def _compress(file_name, directory):
+    with open(file_name, 'rb') as capture:
+        content = capture.read()
+
+    copies = [("plain", file_name)]
+    for name, module in [("gzip", gzip.GzipFile), ("bz2", bz2.BZ2File)]:
+        copy = os.path.join(directory, os.path.basename(file_name) + "." + name)
+        compressed = module(copy, 'wb')
+        compressed.write(content)
+        compressed.close()
+        copies.append((name, copy))
+
+    copy = os.path.join(directory, os.path.basename(file_name) + ".xz")
+    with open(copy, 'wb') as compressed:
+        if subprocess.call(["xz", "-c", file_name], stdout=compressed) == 0:
+            copies.append(("xz", copy))
+
+    return copies
+
+
+def _count(file_name, collector_class):
+    """
+    Packets of @file_name, read once up-front so each run knows when the capture is over.
+    """
+    collector = collector_class(None, file_name)
+    process = subprocess.Popen(" ".join(collector._cap_reader_cmd()), stdout=subprocess.PIPE, shell=True)
+    packets = sum(1 for line in process.stdout if is_valid_line(line))
+    process.wait()
+    return packets
+
+
+def _run_once(file_name, collector_class, packets):
+    runtime = Runtime()
+    analyzer = CountingAnalyzer(runtime, packets)
+    collector = collector_class(analyzer, file_name)
+    started = time.time()
+    collector.attach(runtime)
+    try:
+        runtime.run()
+    finally:
+        collector.stop()
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trtop compressed capture benchmark')
+    parser.add_argument('-i', '--input', required=True, help='Uncompressed capture to benchmark with.')
+    parser.add_argument('-n', '--runs', type=int, default=5, help='Runs per compression. (default: 5)')
+    parser.add_argument('--decoded', action='store_true', help='The input is tcpdump text output.')
+    args = parser.parse_args()
+
+    collector_class = DecodedFileCollector if args.decoded else TCPDumpFileCollector
+    packets = _count(args.input, collector_class)
+    size = os.path.getsize(args.input)
+    directory = tempfile.mkdtemp()
+    try:
+        print("{0:<8} {1:>10} {2:>10} {3:>12} {4:>10}".format("input", "size %", "best secs", "packets/s",
+                                                               "vs plain"))
+        plain = None
+        for name, file_name in _compress(args.input, directory):
+            best = min(_run_once(file_name, collector_class, packets) for _ in range(args.runs))
+            plain = plain or best
+            print("{0:<8} {1:>10.1f} {2:>10.3f} {3:>12.0f} {4:>9.2f}x".format(
+                name, 100.0 * os.path.getsize(file_name) / size, best, packets / best, plain / best))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
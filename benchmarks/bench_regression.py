@@ -0,0 +1,251 @@
+"""
+Regression guard of the parse, analyse and render stages, comparing each run with a stored baseline.
+
+    python benchmarks/bench_regression.py [-s SCALE] [-n RUNS] [-t PERCENT] [--history FILE] [--baseline REV]
+                                          [--dry_run]
+
+The reference input is the test dumps, repeated SCALE times with their timestamps shifted so each copy follows
+the previous one. Each stage runs in a fresh interpreter, measuring its best packets/sec over RUNS and the growth
+of peak memory it caused:
+
+    parse    tcpdump text lines into packets (tcpdump.parser.parse_line)
+    analyse  the packets through an OutgoingTCPAnalyzer
+    render   the text exposition of every tracked remote (exporter.render_text), every 5 secs of capture
+
+Results are appended to the JSON history with their environment. The baseline is the latest run of the same
+environment (python, machine, host) that did not regress, or the latest run of revision --baseline. The exit
+status is 1 when any stage is slower, or grows its peak memory by more, than the tolerance.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+__author__ = 'Thomas Kountis'
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DUMPS = sorted(glob.glob(os.path.join(ROOT, "tests", "*.dump")))
+STAGES = ["parse", "analyse", "render"]
+HISTORY_FILENAME = os.path.join(ROOT, "benchmarks", "history.json")
+MIN_MEMORY_GROWTH_MB = 1.0  # Below which peak memory differences are noise
+RENDER_INTERVAL = 5  # Secs of capture, the default of PrometheusExporterReporter
+
+
+def _reference_lines(scale):
+    """
+    The test dumps one after the other, repeated @scale times, their timestamps shifted so that each dump starts a
+    second after the end of the previous one.
+    """
+    dumps = []
+    for file_name in DUMPS:
+        with open(file_name) as dump:
+            dumps.append([line.split(" ", 1) for line in dump if line.strip()])
+
+    lines = []
+    started = float(dumps[0][0][0])
+    elapsed = 0.0
+    for _ in range(scale):
+        for dump in dumps:
+            first = float(dump[0][0])
+            for timestamp, rest in dump:
+                lines.append("{0:.6f} {1}".format(started + elapsed + float(timestamp) - first, rest))
+            elapsed += max(float(timestamp) for timestamp, _ in dump) - first + 1
+
+    return lines
+
+
+def _peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KB on Linux
+
+
+def _analyzer():
+    from analyzer import OutgoingTCPAnalyzer
+    from whitelisting import DefaultWhitelist
+    from resolver import DefaultDNSResolver
+    from appmetrics import metrics
+
+    [metrics.delete_metric(metric) for metric in metrics.metrics()]
+    return OutgoingTCPAnalyzer(DefaultWhitelist(), DefaultDNSResolver())
+
+
+def _parse(lines):
+    from tcpdump.parser import parse_line
+
+    return [packet for packet in (parse_line(line) for line in lines) if packet is not None]
+
+
+def _analyse(packets):
+    analyzer = _analyzer()
+    for packet in packets:
+        analyzer.analyse(packet)
+
+    return analyzer
+
+
+def _render(analyzer, refreshes):
+    from exporter import render_text
+    from state import snapshot
+
+    for _ in range(refreshes):
+        render_text([snapshot(remote) for remote in analyzer.tracked_remotes.values()])
+
+
+def _run_stage(stage, scale, runs):
+    """
+    Runs @stage @runs times in this interpreter, its inputs prepared beforehand. Each run returns the number of
+    packets it covered.
+    """
+    sys.path.insert(0, os.path.join(ROOT, "trtop"))
+    logging.disable(logging.CRITICAL)  # The invalid packets of the loopback dump are logged as warnings
+    lines = _reference_lines(scale)
+    if stage == "parse":
+        run = lambda: len(_parse(lines))
+    else:
+        packets = _parse(lines)
+        if stage == "analyse":
+            run = lambda: _analyse(packets) and len(packets)
+        else:
+            analyzer = _analyse(packets)
+            timestamps = [float(packet.timestamp) for packet in packets]
+            refreshes = int(max(timestamps) - min(timestamps)) / RENDER_INTERVAL + 1
+            run = lambda: _render(analyzer, refreshes) or len(packets)
+
+    peak_before = _peak_mb()
+    timings = []
+    for _ in range(runs):
+        started = time.time()
+        count = run()
+        timings.append(time.time() - started)
+
+    return dict(packets=count, packets_per_sec=count / min(timings), peak_mb=_peak_mb() - peak_before)
+
+
+def _environment():
+    try:
+        revision = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                                           stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return dict(revision=revision, python=platform.python_version(),
+                implementation=platform.python_implementation(), platform=platform.platform(),
+                machine=platform.machine(), cpus=multiprocessing.cpu_count(), host=socket.gethostname())
+
+
+def _same_environment(run, environment):
+    return all(run['environment'].get(key) == environment[key]
+               for key in ["python", "implementation", "machine", "host"])
+
+
+def _baseline(history, current, revision=None):
+    for run in reversed(history):
+        if run.get('scale') != current['scale']:
+            continue
+        if revision is not None:
+            if (run['environment'].get('revision') or "").startswith(revision):
+                return run
+        elif not run.get('regressed') and _same_environment(run, current['environment']):
+            return run
+
+    return None
+
+
+def _compare(baseline, current, tolerance):
+    """
+    The (stage, metric, baseline, current, change %, regressed) of every metric of every stage.
+    """
+    rows = []
+    for stage in STAGES:
+        before, after = baseline['stages'].get(stage), current['stages'][stage]
+        if before is None:
+            continue
+
+        change = 100.0 * (after['packets_per_sec'] - before['packets_per_sec']) / before['packets_per_sec']
+        rows.append((stage, "packets/sec", before['packets_per_sec'], after['packets_per_sec'], change,
+                     change < -tolerance))
+        growth = after['peak_mb'] - before['peak_mb']
+        change = 100.0 * growth / before['peak_mb'] if before['peak_mb'] > 0 else 0.0
+        rows.append((stage, "peak MB", before['peak_mb'], after['peak_mb'], change,
+                     change > tolerance and growth > MIN_MEMORY_GROWTH_MB))
+
+    return rows
+
+
+def _load_history(file_name):
+    if not os.path.exists(file_name):
+        return []
+
+    with open(file_name) as history:
+        return json.load(history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trtop per stage regression guard')
+    parser.add_argument('-s', '--scale', type=int, default=10, help='Copies of the test dumps. (default: 10)')
+    parser.add_argument('-n', '--runs', type=int, default=3, help='Runs per stage, the best kept. (default: 3)')
+    parser.add_argument('-t', '--tolerance', type=float, default=10.0,
+                        help='Regression tolerance, in percent. (default: 10)')
+    parser.add_argument('--history', default=HISTORY_FILENAME, help='JSON history. (default: {0})'
+                        .format(os.path.relpath(HISTORY_FILENAME, ROOT)))
+    parser.add_argument('--baseline', help='Revision to compare with, instead of the latest run.')
+    parser.add_argument('--dry_run', action='store_true', help='Compare without storing the run.')
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)  # In the child interpreters
+    args = parser.parse_args()
+
+    if args.stage is not None:
+        sys.stdout.write(json.dumps(_run_stage(args.stage, args.scale, args.runs)))
+        return 0
+
+    current = dict(timestamp=time.time(), environment=_environment(), scale=args.scale, runs=args.runs, stages={})
+    for stage in STAGES:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--stage", stage,
+                                          "-s", str(args.scale), "-n", str(args.runs)])
+        current['stages'][stage] = json.loads(output)
+
+    history = _load_history(args.history)
+    baseline = _baseline(history, current, args.baseline)
+    if baseline is None and args.baseline is not None:
+        print("No run of revision {0} at scale {1} in {2}".format(args.baseline, args.scale, args.history))
+        return 1
+
+    print("{0:<8} {1:<12} {2:>12} {3:>12} {4:>9}".format("stage", "metric", "baseline", "current", "change"))
+    if baseline is None:
+        for stage in STAGES:
+            result = current['stages'][stage]
+            print("{0:<8} {1:<12} {2:>12} {3:>12.1f}".format(stage, "packets/sec", "-", result['packets_per_sec']))
+            print("{0:<8} {1:<12} {2:>12} {3:>12.1f}".format(stage, "peak MB", "-", result['peak_mb']))
+        print("No baseline yet{0}.".format(", nothing stored with --dry_run" if args.dry_run else
+                                           ", this run becomes one"))
+        regressions = []
+    else:
+        rows = _compare(baseline, current, args.tolerance)
+        for stage, metric, before, after, change, regressed in rows:
+            print("{0:<8} {1:<12} {2:>12.1f} {3:>12.1f} {4:>+8.1f}%{5}".format(
+                stage, metric, before, after, change, "  REGRESSED" if regressed else ""))
+        print("Baseline: {0} of {1}".format(baseline['environment'].get('revision'),
+                                            time.strftime("%Y-%m-%d %H:%M", time.localtime(baseline['timestamp']))))
+        regressions = [(stage, metric) for stage, metric, _, _, _, regressed in rows if regressed]
+        if regressions:
+            print("{0} regression(s) beyond {1}%: {2}".format(
+                len(regressions), args.tolerance, ", ".join(" ".join(regression) for regression in regressions)))
+
+    current['regressed'] = bool(regressions)
+    if not args.dry_run:
+        history.append(current)
+        with open(args.history, 'w') as history_file:
+            json.dump(history, history_file, indent=1, sort_keys=True)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Start-up time of trtop, each scenario timed in a fresh interpreter.
+
+    python benchmarks/bench_startup.py [-n RUNS]
+
+Reports the best and median wall time of each scenario, and which heavy modules it pulled in.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+__author__ = 'Thomas Kountis'
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["curses", "appmetrics.metrics", "argparse", "BaseHTTPServer", "SocketServer"]
+
+SCENARIOS = [
+    ("import trtop", "import trtop"),
+    ("build headless pipeline",
+     "import trtop\n"
+     "from trtop.collector import BaseCollector\n"
+     "trtop.build(collector=BaseCollector)"),
+    ("cli --help", None),
+]
+
+PROBE = """
+import sys, time, json
+started = time.time()
+{code}
+elapsed = time.time() - started
+sys.stdout.write(json.dumps(dict(elapsed=elapsed, modules=[m for m in {modules!r} if m in sys.modules])))
+"""
+
+
+def _run_once(code):
+    environment = dict(os.environ, PYTHONPATH=ROOT)
+    if code is None:
+        # The whole process, argument parsing included
+        started = time.time()
+        subprocess.check_call([sys.executable, os.path.join(ROOT, "trtop", "trtop.py"), "--help"],
+                              stdout=open(os.devnull, 'w'), env=environment)
+        return time.time() - started, []
+
+    output = subprocess.check_output([sys.executable, "-c", PROBE.format(code=code, modules=HEAVY_MODULES)],
+                                     env=environment)
+    result = json.loads(output)
+    return result['elapsed'], result['modules']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trtop start-up benchmark')
+    parser.add_argument('-n', '--runs', type=int, default=20, help='Runs per scenario. (default: 20)')
+    args = parser.parse_args()
+
+    print("{0:<26} {1:>10} {2:>10}  {3}".format("scenario", "best ms", "median ms", "heavy modules"))
+    for name, code in SCENARIOS:
+        timings = []
+        modules = []
+        for _ in range(args.runs):
+            elapsed, modules = _run_once(code)
+            timings.append(elapsed * 1000)
+
+        timings.sort()
+        print("{0:<26} {1:>10.2f} {2:>10.2f}  {3}".format(name, timings[0], timings[len(timings) / 2],
+                                                         ", ".join(modules) or "-"))
+
+
+if __name__ == "__main__":
+    main()
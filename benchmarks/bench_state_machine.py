@@ -0,0 +1,123 @@
+"""
+Cost per packet of the TCP session state machine, over the test dumps or any tcpdump text output.
+
+    python benchmarks/bench_state_machine.py [-i capture.dump ...] [-n RUNS] [--root CHECKOUT]
+
+Packets are parsed once, then analyzed by a fresh OutgoingTCPAnalyzer in each run. Besides packets/sec, a traced
+run counts the lines of trtop executed and the session lookups made per packet. With --root another checkout is
+measured instead, eg. the previous version with `git worktree add /tmp/previous HEAD~1`.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+__author__ = 'Thomas Kountis'
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CountingDict(dict):
+    """
+    Sessions of a remote, counting their lookups.
+    """
+    lookups = 0
+
+    def get(self, key, default=None):
+        CountingDict.lookups += 1
+        return dict.get(self, key, default)
+
+    def __getitem__(self, key):
+        CountingDict.lookups += 1
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        CountingDict.lookups += 1
+        return dict.__contains__(self, key)
+
+
+def _analyzer():
+    from analyzer import OutgoingTCPAnalyzer
+    from whitelisting import DefaultWhitelist
+    from resolver import DefaultDNSResolver
+    from appmetrics import metrics
+
+    [metrics.delete_metric(metric) for metric in metrics.metrics()]
+    return OutgoingTCPAnalyzer(DefaultWhitelist(), DefaultDNSResolver())
+
+
+def _read(file_names):
+    from tcpdump.parser import is_valid_line, build_packet
+
+    packets = []
+    for file_name in file_names:
+        with open(file_name) as dump:
+            packets.extend(build_packet(line) for line in dump if is_valid_line(line))
+
+    return packets
+
+
+def _time(packets, runs):
+    timings = []
+    for _ in range(runs):
+        analyzer = _analyzer()
+        started = time.time()
+        for packet in packets:
+            analyzer.analyse(packet)
+        timings.append(time.time() - started)
+
+    timings.sort()
+    return timings
+
+
+def _trace(packets, trtop_dir):
+    """
+    The lines of trtop executed and the session lookups made, analyzing @packets once.
+    """
+    counts = dict(lines=0)
+
+    def tracer(frame, event, arg):
+        if not frame.f_code.co_filename.startswith(trtop_dir):
+            return None
+        if event == 'line':
+            counts['lines'] += 1
+        return tracer
+
+    analyzer = _analyzer()
+    CountingDict.lookups = 0
+    for packet in packets:
+        sys.settrace(tracer)
+        analyzer.analyse(packet)
+        sys.settrace(None)
+        for tcp_remote in analyzer.tracked_remotes.values():
+            if not isinstance(tcp_remote.states, CountingDict):
+                tcp_remote.states = CountingDict(tcp_remote.states)
+
+    return counts['lines'], CountingDict.lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trtop state machine benchmark')
+    parser.add_argument('-i', '--input', nargs='+', default=sorted(glob.glob(os.path.join(ROOT, "tests", "*.dump"))),
+                        help='tcpdump text output to analyze. (default: the test dumps)')
+    parser.add_argument('-n', '--runs', type=int, default=20, help='Runs. (default: 20)')
+    parser.add_argument('--root', default=ROOT, help='Checkout of trtop to measure. (default: this one)')
+    args = parser.parse_args()
+
+    trtop_dir = os.path.join(os.path.abspath(args.root), "trtop")
+    sys.path.insert(0, trtop_dir)
+    packets = _read(args.input)
+
+    timings = _time(packets, args.runs)
+    lines, lookups = _trace(packets, trtop_dir)
+    print("{0} packets, {1}".format(len(packets), trtop_dir))
+    print("{0:<24} {1:>12.0f}".format("best packets/sec", len(packets) / timings[0]))
+    print("{0:<24} {1:>12.0f}".format("median packets/sec", len(packets) / timings[len(timings) / 2]))
+    print("{0:<24} {1:>12.2f}".format("lines/packet", float(lines) / len(packets)))
+    print("{0:<24} {1:>12.2f}".format("session lookups/packet", float(lookups) / len(packets)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Soak test of the whole pipeline, for memory growth and leak regressions.
+
+    python benchmarks/soak.py [--packets N] [--sample_every N] [--max_rss_slope KB] [--max_objects_slope N]
+
+A synthetic, endlessly varying capture is driven through trtop.build(): a hot set of remotes mixed with a
+stream of fresh addresses, and connections that complete, reset, or are abandoned after the SYN or half way
+through a request. RSS and the per-type live object counts are sampled every --sample_every packets, and the
+growth past the warm-up is fitted with least squares. Exits 1 when the RSS slope (KB per million packets) or
+the slope of any object type (objects per million packets) exceeds its limit, so it can gate releases.
+"""
+import os
+import gc
+import sys
+import json
+import random
+import logging
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trtop"))
+
+from pipeline import build
+from collector import BaseCollector
+from reporter import BaseReporter
+from ordering import IncrementalOrdering
+from packet import MIN_EPHEMERAL_PORT
+from tcpdump.parser import parse_line
+
+__author__ = 'Thomas Kountis'
+
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+LOCAL_ADDR = "10.0.0.1"
+START_TIMESTAMP = 1444821267.0
+PACKET_INTERVAL = 0.001  # Secs of capture time between packets
+REPORTER_TICK = 1000  # Packets between reporter refreshes
+
+OUTCOMES = [("complete", 0.7), ("reset", 0.1), ("abandoned_syn", 0.1), ("abandoned_request", 0.1)]
+
+
+def _line(timestamp, src, src_port, dst, dst_port, flags, seq=None, ack=None, length=0):
+    """
+    A packet as printed by tcpdump -nn -tt -S.
+    """
+    fields = ["Flags [{0}]".format(flags)]
+    if seq is not None:
+        fields.append("seq {0}:{1}".format(seq, seq + length) if length else "seq {0}".format(seq))
+    if ack is not None:
+        fields.append("ack {0}".format(ack))
+    fields.append("win 115")
+    fields.append("options [nop,nop,TS val 1 ecr 1]")
+    return "{0:.6f} IP {1}.{2} > {3}.{4}: {5}, length {6}".format(timestamp, src, src_port, dst, dst_port,
+                                                                 ", ".join(fields), length)
+
+
+def _connection(rng, remote, port, outcome):
+    """
+    Packets of one connection from @port to @remote, as (outgoing, flags, seq, ack, length) tuples.
+    """
+    local_seq = rng.randint(0, 1 << 31)
+    remote_seq = rng.randint(0, 1 << 31)
+    yield True, "S", local_seq, None, 0
+    if outcome == "abandoned_syn":
+        return
+
+    yield False, "S.", remote_seq, local_seq + 1, 0
+    yield True, ".", None, remote_seq + 1, 0
+    local_seq += 1
+    remote_seq += 1
+    for request in range(rng.randint(1, 4)):
+        request_length = rng.randint(100, 1000)
+        response_length = rng.randint(50, 1400)
+        yield True, "P.", local_seq, remote_seq, request_length
+        local_seq += request_length
+        if outcome == "abandoned_request":
+            return
+
+        yield False, ".", None, local_seq, 0
+        yield False, "P.", remote_seq, local_seq, response_length
+        remote_seq += response_length
+        yield True, ".", None, remote_seq, 0
+
+    if outcome == "reset":
+        yield True, "R.", local_seq, remote_seq, 0
+        return
+
+    yield True, "F.", local_seq, remote_seq, 0
+    yield False, "F.", remote_seq, local_seq + 1, 0
+    yield True, ".", None, remote_seq + 1, 0
+
+
+class SyntheticCollector(BaseCollector):
+    """
+    Feeds the analyzer @packets tcpdump lines of @concurrency interleaved connections, @hot_ratio of them to
+    one of @hot_remotes remotes and the rest to fresh addresses. @on_packet(count) is called after each packet.
+    """
+
+    def __init__(self, analyzer, packets, on_packet, concurrency=64, hot_remotes=50, hot_ratio=0.8, seed=1):
+        BaseCollector.__init__(self, analyzer)
+        self.analyzer = analyzer
+        self.packets = packets
+        self.on_packet = on_packet
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        self.hot_remotes = ["172.16.{0}.{1}".format(index / 250, index % 250 + 1) for index in range(hot_remotes)]
+        self.hot_ratio = hot_ratio
+        self._running = False
+        self._next_port = MIN_EPHEMERAL_PORT
+
+    def _remote(self):
+        if self.rng.random() < self.hot_ratio:
+            return self.rng.choice(self.hot_remotes)
+
+        value = self.rng.randint(0, 1 << 24)
+        return "10.{0}.{1}.{2}".format(value >> 16 & 0xff, value >> 8 & 0xff, value & 0xff)
+
+    def _outcome(self):
+        point = self.rng.random()
+        for outcome, weight in OUTCOMES:
+            point -= weight
+            if point < 0:
+                return outcome
+
+        return OUTCOMES[0][0]
+
+    def _port(self):
+        port = self._next_port
+        self._next_port = port + 1 if port < 65535 else MIN_EPHEMERAL_PORT
+        return port
+
+    def _open(self):
+        remote = self._remote()
+        port = self._port()
+        return remote, port, _connection(self.rng, remote, port, self._outcome())
+
+    def start(self):
+        self._running = True
+        connections = [self._open() for _ in range(self.concurrency)]
+        timestamp = START_TIMESTAMP
+        analyse = self.analyzer.analyse
+        for count in xrange(1, self.packets + 1):
+            if not self._running:
+                break
+
+            index = self.rng.randrange(len(connections))
+            remote, port, packets = connections[index]
+            packet = next(packets, None)
+            while packet is None:
+                connections[index] = self._open()
+                remote, port, packets = connections[index]
+                packet = next(packets, None)
+
+            outgoing, flags, seq, ack, length = packet
+            timestamp += PACKET_INTERVAL
+            if outgoing:
+                line = _line(timestamp, LOCAL_ADDR, port, remote, 80, flags, seq, ack, length)
+            else:
+                line = _line(timestamp, remote, 80, LOCAL_ADDR, port, flags, seq, ack, length)
+
+            packet = parse_line(line)
+            if packet is not None:
+                analyse(packet)
+            self.on_packet(count)
+
+    def stop(self):
+        self._running = False
+
+
+class HeadlessReporter(BaseReporter):
+    """
+    The bookkeeping of the curses reporter without a screen: every remote by hostname, kept in order.
+    """
+
+    def __init__(self, analyzer):
+        BaseReporter.__init__(self)
+        self.analyzer = analyzer
+        self.tcpstates = {}
+        self.ordering = IncrementalOrdering(lambda remote: remote.get_syn_count(), reverse=True)
+
+    def handle_remote_event(self, remote):
+        self.tcpstates[remote.hostname] = remote
+        self.ordering.mark_dirty(remote.hostname)
+
+    def handle_remote_evicted(self, remote):
+        self.tcpstates.pop(remote.hostname, None)
+        self.ordering.remove(remote.hostname)
+
+    def tick(self):
+        self.ordering.update(self.tcpstates)
+        self.ordering.page(0, 40)
+
+
+def rss_kb():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE / 1024
+
+
+def object_counts():
+    """
+    Live objects tracked by the garbage collector per class name, old-style classes included.
+    """
+    return Counter(getattr(obj, '__class__', type(obj)).__name__ for obj in gc.get_objects())
+
+
+def slope(points):
+    """
+    Least squares slope of @points, (x, y) tuples.
+    """
+    if len(points) < 2:
+        return 0.0
+
+    mean_x = sum(x for x, _ in points) / float(len(points))
+    mean_y = sum(y for _, y in points) / float(len(points))
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return 0.0
+
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trtop soak test')
+    parser.add_argument('-n', '--packets', type=int, default=3000000, help='Packets to analyze. (default: 3000000)')
+    parser.add_argument('-se', '--sample_every', type=int, default=50000,
+                        help='Packets between memory samples. (default: 50000)')
+    parser.add_argument('-w', '--warmup', type=float, default=0.5,
+                        help='Fraction of the run excluded from the growth fit, while the sliding windows and the '
+                             'histogram reservoirs fill up. (default: 0.5)')
+    parser.add_argument('-mtr', '--max_tracked_remotes', type=int, default=100,
+                        help='Remotes fully tracked by the analyzer. (default: 100)')
+    parser.add_argument('-st', '--session_timeout', type=int, default=30,
+                        help='Secs of capture time after which idle connections are forgotten. (default: 30)')
+    parser.add_argument('--max_rss_slope', type=float, default=1024,
+                        help='Allowed RSS growth, in KB per million packets. (default: 1024)')
+    parser.add_argument('--max_objects_slope', type=float, default=1000,
+                        help='Allowed growth of any object type, in objects per million packets. (default: 1000)')
+    parser.add_argument('--json', action='store_true', help='Prints the samples and slopes as JSON.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    samples = []
+
+    def on_packet(count):
+        if count % REPORTER_TICK == 0:
+            reporter.tick()
+        if count % args.sample_every == 0:
+            gc.collect()
+            samples.append((count, rss_kb(), object_counts()))
+            if not args.json:
+                sys.stderr.write("{0:>10} packets {1:>8} KB rss {2:>6} remotes\n".format(
+                    count, samples[-1][1], len(pipeline.analyzer.tracked_remotes)))
+
+    from analyzer import OutgoingTCPAnalyzer
+    from whitelisting import DefaultWhitelist
+    from resolver import DefaultDNSResolver
+    from clock import CaptureClock
+
+    analyzer = OutgoingTCPAnalyzer(DefaultWhitelist(), DefaultDNSResolver(),
+                                   max_tracked_remotes=args.max_tracked_remotes, clock=CaptureClock(),
+                                   session_timeout=args.session_timeout)
+    reporter = HeadlessReporter(analyzer)
+    pipeline = build(collector=lambda analyzer: SyntheticCollector(analyzer, args.packets, on_packet),
+                     analyzer=analyzer, reporters=[lambda analyzer: reporter])
+    pipeline.start()
+    pipeline.stop()
+
+    measured = [sample for sample in samples if sample[0] > args.packets * args.warmup]
+    rss_slope = slope([(count / 1e6, rss) for count, rss, _ in measured])
+    types = set()
+    for _, _, counts in measured:
+        types.update(counts)
+    object_slopes = dict((name, slope([(count / 1e6, counts.get(name, 0)) for count, _, counts in measured]))
+                         for name in types)
+    growing = sorted(((value, name) for name, value in object_slopes.items() if value > args.max_objects_slope),
+                     reverse=True)
+
+    if args.json:
+        print(json.dumps(dict(samples=[dict(packets=count, rss_kb=rss) for count, rss, _ in samples],
+                              rss_slope=rss_slope,
+                              object_slopes=dict((name, value) for name, value in object_slopes.items() if value),
+                              passed=rss_slope <= args.max_rss_slope and not growing)))
+    else:
+        print("rss slope {0:.1f} KB/Mpkt (max {1})".format(rss_slope, args.max_rss_slope))
+        for value, name in sorted(((value, name) for name, value in object_slopes.items()), reverse=True)[:10]:
+            print("{0:<28} {1:>10.1f} objects/Mpkt".format(name, value))
+
+    if rss_slope > args.max_rss_slope or growing:
+        print("FAILED: growth over the allowed slope {0}".format(
+            ", ".join(["rss"] * (rss_slope > args.max_rss_slope) + [name for _, name in growing])))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.aggregation import RemoteSummary, SummaryAgent, SummaryAggregator, encode_summaries, decode_summaries
+from trtop.reporter import BaseReporter
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+
+
+AGENTS = 3
+
+
+def _run_agent(address, agent_id):
+    analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("fleet"))
+    MockFileReaderCollector(analyzer, "healthy_remote_test.dump").start()
+    agent = SummaryAgent(analyzer, address, agent_id=agent_id)
+    os._exit(0 if agent.send() else 1)
+
+
+class RecordingReporter(BaseReporter):
+
+    def __init__(self):
+        BaseReporter.__init__(self)
+        self.events = []
+
+    def handle_remote_event(self, remote):
+        self.events.append(remote)
+
+    def handle_remote_evicted(self, remote):
+        self.events.append(("evicted", remote.hostname))
+
+
+class MockClock(object):
+
+    def __init__(self):
+        self.timestamp = 0.0
+
+    def now(self):
+        return self.timestamp
+
+
+class SummaryCodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        summary = RemoteSummary("fleet")
+        summary.counters["syn"] = 3
+        summary.rates["est_rate"] = 1.5
+        summary.sketches["_conn_time_histo"].notify(10.0)
+
+        frame = encode_summaries("agent", 7, "1443817535.993749", [summary])
+        agent_id, sequence, capture_ts, summaries = decode_summaries(frame[4:])
+
+        self.assertEquals((agent_id, sequence, capture_ts), ("agent", 7, "1443817535.993749"))
+        self.assertEquals(summaries[0].get_syn_count(), 3)
+        self.assertEquals(summaries[0].get_est_mean_rate(), 1.5)
+        self.assertEquals(summaries[0].sketches["_conn_time_histo"].count, 1)
+        self.assertEquals(summaries[0].get_rt_per_conn_95th(), '*')
+
+
+class MultiProcessAggregationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="trtop-")
+        self.address = "unix:" + os.path.join(self.directory, "aggregator.sock")
+        self.aggregator = SummaryAggregator(self.address)
+        self.reporter = RecordingReporter()
+        self.aggregator.set_observer(self.reporter)
+        self.aggregator.bind()
+        self.thread = threading.Thread(target=self.aggregator.start)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.aggregator.stop()
+        shutil.rmtree(self.directory)
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _wait_for(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+
+    def test_fleet_merge(self):
+        agents = [multiprocessing.Process(target=_run_agent, args=(self.address, "agent-{0}".format(i)))
+                  for i in range(AGENTS)]
+        [agent.start() for agent in agents]
+        [agent.join() for agent in agents]
+        self.assertEquals([agent.exitcode for agent in agents], [0] * AGENTS)
+
+        self._wait_for(lambda: "fleet" in self.aggregator.tracked_remotes and
+                       self.aggregator.tracked_remotes["fleet"].get_syn_count() == AGENTS)
+        fleet = self.aggregator.tracked_remotes.get("fleet")
+        self.assertEquals(fleet.get_syn_count(), AGENTS)
+        self.assertEquals(fleet.get_outgoing_count(), 2 * AGENTS)
+        self.assertEquals(fleet.get_incoming_count(), 2 * AGENTS)
+        self.assertEquals(fleet.sketches["_conn_time_histo"].count, AGENTS)
+        self.assertTrue(fleet.get_conn_latency_95th() > 0)
+        self.assertEquals(self.reporter.events[-1].hostname, "fleet")
+
+    def test_latest_summary_supersedes(self):
+        summary = RemoteSummary("fleet")
+        summary.counters["syn"] = 1
+        self.aggregator.merge("agent", None, [summary])
+        summary.counters["syn"] = 5
+        self.aggregator.merge("agent", None, [summary])
+
+        self.assertEquals(self.aggregator.tracked_remotes["fleet"].get_syn_count(), 5)
+
+
+class AgentExpiryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = MockClock()
+        self.aggregator = SummaryAggregator("127.0.0.1:0", agent_ttl=60, clock=self.clock)
+        self.reporter = RecordingReporter()
+        self.aggregator.set_observer(self.reporter)
+
+    def _summary(self, hostname, syn):
+        summary = RemoteSummary(hostname)
+        summary.counters["syn"] = syn
+        return summary
+
+    def test_restarted_agent(self):
+        self.aggregator.merge("host:100", None, [self._summary("fleet", 3), self._summary("legacy", 1)])
+        self.clock.timestamp = 30
+        self.aggregator.merge("host:101", None, [self._summary("fleet", 1)])  # Restarted, counting from scratch
+        self.assertEquals(self.aggregator.tracked_remotes["fleet"].get_syn_count(), 4)
+
+        self.clock.timestamp = 61
+        self.aggregator.merge("host:101", None, [self._summary("fleet", 2)])
+        self.assertEquals(self.aggregator.agents.keys(), ["host:101"])
+        self.assertEquals(self.aggregator.tracked_remotes["fleet"].get_syn_count(), 2)
+        self.assertEquals(self.aggregator.tracked_remotes.keys(), ["fleet"])
+        self.assertTrue(("evicted", "legacy") in self.reporter.events)
+
+    def test_silent_fleet(self):
+        self.aggregator.merge("host:100", None, [self._summary("fleet", 3)])
+        self.clock.timestamp = 120
+        self.aggregator.expire()
+        self.assertEquals(self.aggregator.agents, {})
+        self.assertEquals(self.aggregator.tracked_remotes, {})
@@ -5,8 +5,10 @@ from trtop.whitelisting import BaseWhitelist
 from trtop.resolver import BaseResolver
 from trtop.collector import BaseCollector
 from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.address import parse
 from appmetrics import metrics
 from tcpdump.parser import is_valid_line, build_packet
+from tcpdump.offlinecollector import TCPDumpFileCollector
 
 
 #######################################
@@ -17,7 +19,7 @@ class MockWhitelist(BaseWhitelist):
 
     def __init__(self, hosts):
         BaseWhitelist.__init__(self)
-        self.hosts = hosts
+        self.hosts = [parse(host) for host in hosts]
 
     def allow(self, host, port):
         return host in self.hosts
@@ -50,6 +52,16 @@ class MockFileReaderCollector(BaseCollector):
         pass
 
 
+class MockTCPDumpFileCollector(TCPDumpFileCollector):
+    """
+    Reads an already decoded dump, from the decompressing or indexing feeder if any, as tcpdump is not required
+    by the tests.
+    """
+
+    def _cap_reader_cmd(self):
+        return ["cat", self._cap_reader_input()]
+
+
 class HealthyRemoteAnalyzerTest(unittest.TestCase):
 
     @classmethod
@@ -202,4 +214,39 @@ class LoopbackRemoteAnalyzerTest(unittest.TestCase):
 
     def test_err(self):
         state = self.__class__.analyzer.tracked_remotes.get('test')
-        self.assertEquals(state.get_pkt_err_count(), 0)
\ No newline at end of file
+        self.assertEquals(state.get_pkt_err_count(), 0)
+
+
+class SessionExpiryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"),
+                                            session_timeout=10)
+        with open("healthy_remote_test.dump") as dump:
+            self.lines = dump.readlines()
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_idle_session_expired(self):
+        for line in self.lines[:5]:
+            self.analyzer.analyse(build_packet(line))
+
+        # A new connection past the sweep interval, the first one idle since
+        syn = self.lines[0].replace("1443817535.972240", "1443817635.972240").replace(".53678 ", ".53679 ")
+        self.analyzer.analyse(build_packet(syn))
+
+        state = self.analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.states.keys(), [53679])
+        self.assertEquals(state.get_syn_count(), 2)
+
+    def test_active_session_kept(self):
+        # Spread over more than the sweep interval, never idle for the timeout
+        for index, line in enumerate(self.lines):
+            packet = build_packet(line)
+            packet.timestamp = str(float(packet.timestamp) + index * 5)
+            self.analyzer.analyse(packet)
+
+        state = self.analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        self.assertEquals(state.get_fin_in_count(), 1)
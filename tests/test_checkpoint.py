@@ -0,0 +1,81 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import tempfile
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.checkpoint import dump, load, save, restore
+from trtop.clock import CaptureClock
+from appmetrics import metrics
+from tcpdump.parser import is_valid_line, build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = self._new_analyzer()
+        with open("healthy_remote_test.dump") as tcpdump:
+            lines = [line for line in tcpdump if is_valid_line(line)]
+
+        # Leave the connection open, half way through the first request
+        for line in lines[:4]:
+            self.analyzer.analyse(build_packet(line))
+
+        self.remaining = lines[4:]
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _new_analyzer(self):
+        return OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"), clock=CaptureClock())
+
+    def _reload(self, data):
+        for remote in self.analyzer.tracked_remotes.values():
+            remote.release()
+
+        restored = self._new_analyzer()
+        self.assertEquals(load(restored, data), 1)
+        return restored
+
+    def test_round_trip(self):
+        original = self.analyzer.tracked_remotes.get('test')
+        syn, est, out = original.get_syn_count(), original.get_est_count(), original.get_outgoing_count()
+        latency = original.get_conn_latency_95th()
+
+        restored = self._reload(dump(self.analyzer))
+        state = restored.tracked_remotes.get('test')
+        self.assertEquals(state.get_syn_count(), syn)
+        self.assertEquals(state.get_est_count(), est)
+        self.assertEquals(state.get_outgoing_count(), out)
+        self.assertEquals(state.get_conn_latency_95th(), latency)
+        self.assertEquals(state.get_syn_mean_rate(), original.get_syn_mean_rate())
+        self.assertEquals(state.window_view("1m", restored.last_timestamp).get_syn_count(), syn)
+        self.assertEquals(len(state.states), 1)
+        self.assertEquals(restored.last_timestamp, self.analyzer.last_timestamp)
+
+    def test_resume(self):
+        restored = self._reload(dump(self.analyzer))
+        for line in self.remaining:
+            restored.analyse(build_packet(line))
+
+        state = restored.tracked_remotes.get('test')
+        self.assertEquals(state.get_incoming_count(), 2)
+        self.assertEquals(state.get_fin_in_count(), 1)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+
+    def test_corrupted(self):
+        data = dump(self.analyzer)
+        self.assertRaises(ValueError, load, self._new_analyzer(), data[:-1] + chr(ord(data[-1]) ^ 0xff))
+        self.assertRaises(ValueError, load, self._new_analyzer(), "garbage")
+
+    def test_atomic_file(self):
+        filename = tempfile.mktemp(".ckpt", "trtop-")
+        try:
+            save(self.analyzer, filename)
+            self.assertFalse(os.path.exists(filename + ".tmp"))
+            for remote in self.analyzer.tracked_remotes.values():
+                remote.release()
+            self.assertEquals(restore(self._new_analyzer(), filename), 1)
+        finally:
+            os.remove(filename)
@@ -0,0 +1,53 @@
+__author__ = 'Thomas Kountis'
+
+import time
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.clock import CaptureClock, PacedCaptureClock
+from trtop.runtime import Runtime
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector, MockTCPDumpFileCollector
+
+
+CAPTURE_SPAN = 1443817536.119788 - 1443817535.972240
+
+
+class CaptureClockTest(unittest.TestCase):
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _replay(self, clock):
+        analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"), clock=clock)
+        MockFileReaderCollector(analyzer, "healthy_remote_test.dump").start()
+        return analyzer.tracked_remotes.get('test')
+
+    def test_monotonic(self):
+        clock = CaptureClock()
+        clock.advance("1443817536.1")
+        clock.advance("1443817535.9")
+        self.assertEquals(clock.now(), 1443817536.1)
+
+    def test_rates_per_capture_second(self):
+        state = self._replay(CaptureClock())
+        self.assertAlmostEquals(state.get_syn_mean_rate(), 1 / CAPTURE_SPAN, places=3)
+        self.assertAlmostEquals(state.get_est_mean_rate(), 1 / CAPTURE_SPAN, places=3)
+
+    def test_paced(self):
+        runtime = Runtime()
+        analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"),
+                                       clock=PacedCaptureClock(speed=0.5))
+        ticks = []
+        runtime.every(0.01, lambda: ticks.append(analyzer.last_timestamp))
+        runtime.call_later(CAPTURE_SPAN * 2 + 0.2, runtime.stop)
+        started = time.time()
+        MockTCPDumpFileCollector(analyzer, "healthy_remote_test.dump").attach(runtime)
+        runtime.run()
+
+        # Packets held back until due, while the loop kept ticking
+        self.assertTrue(time.time() - started >= CAPTURE_SPAN * 2)
+        self.assertEquals(analyzer.last_timestamp, "1443817536.119788")
+        self.assertTrue(len(ticks) > 20)
+        self.assertTrue(len(set(ticks)) > 3)
+        state = analyzer.tracked_remotes.get('test')
+        self.assertAlmostEquals(state.get_syn_mean_rate(), 1 / CAPTURE_SPAN, places=3)
@@ -0,0 +1,70 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import bz2
+import gzip
+import shutil
+import tempfile
+import unittest
+import subprocess
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.pipeline import Pipeline
+from trtop.reporter import BaseReporter
+from trtop.runtime import Runtime
+from tcpdump.offlinecollector import detect_compression
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockTCPDumpFileCollector
+
+
+def _has_xz():
+    return subprocess.call("xz --version", shell=True, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT) == 0
+
+
+class DecompressTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.plain = os.path.join(cls.directory, "healthy.dump")
+        shutil.copy("healthy_remote_test.dump", cls.plain)
+        with open(cls.plain, 'rb') as plain:
+            content = plain.read()
+
+        compressed = gzip.GzipFile(cls.plain + ".gz", 'wb')
+        compressed.write(content)
+        compressed.close()
+        compressed = bz2.BZ2File(cls.plain + ".bz2", 'wb')
+        compressed.write(content)
+        compressed.close()
+        if _has_xz():
+            subprocess.check_call(["xz", "-k", cls.plain])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyze(self, file_name):
+        runtime = Runtime()
+        analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        pipeline = Pipeline(MockTCPDumpFileCollector(analyzer, file_name), analyzer, BaseReporter())
+        runtime.call_later(0.5, runtime.stop)
+        pipeline.run(runtime)
+        return analyzer
+
+    def test_detect(self):
+        self.assertEquals(detect_compression(self.plain), None)
+        self.assertEquals(detect_compression(self.plain + ".gz"), "gzip")
+        self.assertEquals(detect_compression(self.plain + ".bz2"), "bz2")
+
+    def test_streams_as_plain(self):
+        files = [self.plain + ".gz", self.plain + ".bz2"] + ([self.plain + ".xz"] if _has_xz() else [])
+        for file_name in files:
+            state = self._analyze(file_name).tracked_remotes.get('test')
+            self.assertEquals(state.get_outgoing_count(), 2)
+            self.assertEquals(state.get_incoming_count(), 2)
+            self.assertEquals(state.get_fin_in_count(), 1)
+            self.assertEquals(state.get_pkt_err_count(), 0)
+            [metrics.delete_metric(metric) for metric in metrics.metrics()]
@@ -0,0 +1,78 @@
+__author__ = 'Thomas Kountis'
+
+import gzip
+import json
+import urllib2
+import unittest
+from StringIO import StringIO
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.exporter import PrometheusExporterReporter
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+
+
+class PrometheusExporterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        MockFileReaderCollector(cls.analyzer, "healthy_remote_test.dump").start()
+        cls.exporter = PrometheusExporterReporter(cls.analyzer, port=0, interval=60)
+        cls.exporter.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.exporter.stop()
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _get(self, path, headers=None):
+        request = urllib2.Request("http://{0}:{1}{2}".format(self.__class__.exporter.address[0],
+                                                              self.__class__.exporter.address[1], path),
+                                  headers=headers or {})
+        return urllib2.urlopen(request, timeout=5)
+
+    def test_text(self):
+        body = self._get("/metrics").read()
+        self.assertTrue('trtop_syn_total{host="test"} 1.0' in body)
+        self.assertTrue('# TYPE trtop_responses_total counter' in body)
+
+    def test_json(self):
+        entries = json.loads(self._get("/metrics.json").read())
+        self.assertEquals(entries[0]['host'], 'test')
+        self.assertEquals(entries[0]['out'], 2)
+
+    def test_gzip(self):
+        response = self._get("/metrics", {"Accept-Encoding": "gzip"})
+        self.assertEquals(response.info().get("Content-Encoding"), "gzip")
+        body = gzip.GzipFile(fileobj=StringIO(response.read())).read()
+        self.assertTrue('trtop_established_total{host="test"} 1.0' in body)
+        self.assertEquals(response.info().get("Vary"), "Accept-Encoding")
+
+    def test_etag_per_encoding(self):
+        etag = self._get("/metrics").info().get("ETag")
+        gzipped_etag = self._get("/metrics", {"Accept-Encoding": "gzip"}).info().get("ETag")
+        self.assertEquals(gzipped_etag, etag[:-1] + '-gz"')
+
+        # The plain body validates only a plain request
+        response = self._get("/metrics", {"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEquals(response.info().get("Content-Encoding"), "gzip")
+        try:
+            self._get("/metrics", {"Accept-Encoding": "gzip", "If-None-Match": gzipped_etag})
+            self.fail("Expected 304")
+        except urllib2.HTTPError, e:
+            self.assertEquals(e.code, 304)
+
+    def test_conditional(self):
+        etag = self._get("/metrics").info().get("ETag")
+        try:
+            self._get("/metrics", {"If-None-Match": etag})
+            self.fail("Expected 304")
+        except urllib2.HTTPError, e:
+            self.assertEquals(e.code, 304)
+
+    def test_not_found(self):
+        try:
+            self._get("/other")
+            self.fail("Expected 404")
+        except urllib2.HTTPError, e:
+            self.assertEquals(e.code, 404)
@@ -0,0 +1,121 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop.whitelisting import DefaultWhitelist
+from trtop.resolver import DefaultDNSResolver
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.heavyhitters import SpaceSaving, OTHER_BUCKET, subnet_bucket
+from trtop.address import parse, display_name
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist
+
+
+SYN_LINE = "1443817535.972240 IP 127.0.0.1.{0} > {1}.80: Flags [S], seq 4173560241, win 14600, " \
+           "options [mss 1460,sackOK,TS val 2472289776 ecr 0,nop,wscale 7], length 0"
+
+
+def syn_packets(remote, count, first_port=40000):
+    return [build_packet(SYN_LINE.format(first_port + i, remote)) for i in range(count)]
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_counts_within_capacity(self):
+        summary = SpaceSaving(3)
+        for key in ['a', 'b', 'a', 'c', 'a']:
+            summary.offer(key)
+
+        self.assertEquals(summary.estimate('a'), 3)
+        self.assertEquals(summary.guaranteed('b'), 1)
+        self.assertEquals(len(summary), 3)
+
+    def test_replaces_min(self):
+        summary = SpaceSaving(2)
+        for key in ['a', 'a', 'b']:
+            summary.offer(key)
+
+        self.assertEquals(summary.offer('c'), 'b')
+        self.assertEquals(summary.estimate('c'), 2)
+        self.assertEquals(summary.guaranteed('c'), 1)
+        self.assertTrue('b' not in summary)
+
+    def test_bounded(self):
+        summary = SpaceSaving(10)
+        for i in range(1000):
+            summary.offer('heavy')
+            summary.offer(i)
+
+        self.assertEquals(len(summary), 10)
+        self.assertEquals(summary.top(1)[0][0], 'heavy')
+        self.assertTrue(summary.guaranteed('heavy') >= 1000 - summary.min_count)
+
+
+class HeavyHittersAnalyzerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = OutgoingTCPAnalyzer(DefaultWhitelist(), DefaultDNSResolver(), max_tracked_remotes=3)
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyse(self, packets):
+        for packet in packets:
+            self.analyzer.analyse(packet)
+
+    def _full_remotes(self):
+        return set(display_name(hostname) for hostname in self.analyzer.tracked_remotes
+                   if hostname not in self.analyzer.overflow_remotes)
+
+    def test_long_tail_folded(self):
+        for remote in ['10.0.0.1', '10.0.0.2', '10.0.0.3']:
+            self._analyse(syn_packets(remote, 10))
+
+        for i in range(50):
+            self._analyse(syn_packets('10.0.1.{0}'.format(i), 1, first_port=50000 + i))
+
+        self.assertEquals(self._full_remotes(), set(['10.0.0.1', '10.0.0.2', '10.0.0.3']))
+        self.assertEquals(self.analyzer.tracked_remotes[OTHER_BUCKET].get_syn_count(), 50)
+
+    def test_heavier_remote_promoted(self):
+        for remote in ['10.0.0.1', '10.0.0.2', '10.0.0.3']:
+            self._analyse(syn_packets(remote, 1))
+
+        self._analyse(syn_packets('10.0.0.4', 5))
+
+        self.assertTrue('10.0.0.4' in self._full_remotes())
+        self.assertEquals(len(self._full_remotes()), 3)
+        self.assertEquals(self.analyzer.tracked_remotes[parse('10.0.0.4')].get_syn_count(), 4)
+
+    def test_only_whitelisted_counted(self):
+        self.analyzer.whitelist = MockWhitelist(['10.0.0.1', '10.0.0.2'])
+        for i in range(100):
+            self._analyse(syn_packets('10.0.2.{0}'.format(i), 1))
+            self._analyse(syn_packets('10.0.0.{0}'.format(1 + i % 2), 1, first_port=40000 + i))
+
+        self.assertEquals(len(self.analyzer.heavy_hitters), 2)
+        self.assertEquals(self.analyzer.heavy_hitters.guaranteed(parse('10.0.0.1')), 50)
+        self.assertEquals(self._full_remotes(), set(['10.0.0.1', '10.0.0.2']))
+
+    def test_weakest_remote_grown(self):
+        self._analyse(syn_packets('10.0.0.1', 1))
+        for remote in ['10.0.0.2', '10.0.0.3']:
+            self._analyse(syn_packets(remote, 2))
+
+        self._analyse(syn_packets('10.0.0.5', 1))  # Caches 10.0.0.1 as the weakest
+        self._analyse(syn_packets('10.0.0.1', 10, first_port=41000))
+        self._analyse(syn_packets('10.0.0.4', 3))
+
+        self.assertTrue('10.0.0.1' in self._full_remotes())
+        self.assertTrue('10.0.0.4' in self._full_remotes())  # Outweighs 10.0.0.2 or 10.0.0.3, now the weakest
+        self.assertEquals(len(self._full_remotes()), 3)
+
+    def test_subnet_bucket(self):
+        self.analyzer.overflow_bucket = subnet_bucket
+        for remote in ['10.0.0.1', '10.0.0.2', '10.0.0.3']:
+            self._analyse(syn_packets(remote, 10))
+
+        self._analyse(syn_packets('10.0.1.1', 1))
+        self._analyse(syn_packets('10.0.2.1', 1))
+
+        self.assertEquals(self.analyzer.overflow_remotes, set(['10.0.1.0/24', '10.0.2.0/24']))
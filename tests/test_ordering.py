@@ -0,0 +1,87 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop.ordering import IncrementalOrdering
+
+
+class MockRemote(object):
+
+    def __init__(self, hostname, rate):
+        self.hostname = hostname
+        self.rate = rate
+
+
+class IncrementalOrderingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.remotes = dict((name, MockRemote(name, rate)) for name, rate in [('a', 3), ('b', 1), ('c', 2)])
+        self.ordering = IncrementalOrdering(lambda remote: remote.rate)
+        for hostname in self.remotes:
+            self.ordering.mark_dirty(hostname)
+        self.ordering.update(self.remotes)
+
+    def test_ordered(self):
+        self.assertEquals(self.ordering.page(0, 10), ['b', 'c', 'a'])
+
+    def test_reverse(self):
+        self.ordering.reverse = True
+        self.assertEquals(self.ordering.page(0, 2), ['a', 'c'])
+        self.assertEquals(self.ordering.page(2, 2), ['b'])
+
+    def test_page(self):
+        self.assertEquals(self.ordering.page(1, 1), ['c'])
+        self.assertEquals(self.ordering.page(3, 1), [])
+
+    def test_only_dirty_repositioned(self):
+        self.remotes['b'].rate = 5
+        self.remotes['c'].rate = 0
+        self.ordering.mark_dirty('b')
+        self.ordering.update(self.remotes)
+        self.assertEquals(self.ordering.page(0, 10), ['c', 'a', 'b'])
+
+    def test_remove(self):
+        self.ordering.remove('c')
+        self.assertEquals(self.ordering.page(0, 10), ['b', 'a'])
+        self.assertEquals(len(self.ordering), 2)
+
+    def test_resort(self):
+        self.ordering.resort(lambda remote: remote.hostname, self.remotes)
+        self.assertEquals(self.ordering.page(0, 10), ['a', 'b', 'c'])
+
+    def test_idle_rate_decays(self):
+        clock = [10.0]
+        remotes = dict(busy=MeanRateRemote('busy', clock), idle=MeanRateRemote('idle', clock))
+        remotes['busy'].count, remotes['idle'].count = 10, 50
+        ordering = IncrementalOrdering(lambda remote: remote.mean_rate(), reverse=True, volatile=True)
+        ordering.mark_dirty('busy')
+        ordering.mark_dirty('idle')
+        ordering.update(remotes)
+        self.assertEquals(ordering.page(0, 10), ['idle', 'busy'])
+
+        # Only the busy remote sees events, the idle one is never marked dirty again
+        clock[0] = 100.0
+        remotes['busy'].count = 200
+        ordering.mark_dirty('busy')
+        ordering.update(remotes)
+        self.assertEquals(ordering.page(0, 10), ['busy', 'idle'])
+
+    def test_volatile_keyed_once(self):
+        calls = []
+        ordering = IncrementalOrdering(lambda remote: calls.append(remote.hostname) or remote.rate, volatile=True)
+        ordering.update(self.remotes)
+        self.assertEquals(sorted(calls), ['a', 'b', 'c'])
+        self.assertEquals(ordering.page(0, 10), ['b', 'c', 'a'])
+
+        ordering.remove('c')
+        self.assertEquals(ordering.page(0, 10), ['b', 'a'])
+
+
+class MeanRateRemote(object):
+
+    def __init__(self, hostname, clock):
+        self.hostname = hostname
+        self.clock = clock
+        self.count = 0
+
+    def mean_rate(self):
+        return self.count / self.clock[0]
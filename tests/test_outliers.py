@@ -0,0 +1,86 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.outliers import OutlierRecorder, PacketRing, RING_SIZE
+from trtop.state import TcpSessionState
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+
+class PacketRingTest(unittest.TestCase):
+
+    def test_wraps_around(self):
+        with open("healthy_remote_test.dump") as dump:
+            packets = [build_packet(line) for line in dump]
+
+        ring = PacketRing(4)
+        slots = [id(slot) for slot in ring.slots]
+        for packet in packets[:6]:
+            ring.record(packet)
+
+        self.assertEquals([record[0] for record in ring.records()], [packet.timestamp for packet in packets[2:6]])
+        self.assertEquals([id(slot) for slot in ring.slots], slots)
+        ring.clear()
+        self.assertEquals(ring.records(), [])
+
+
+class OutlierRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "outliers.jsonl")
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyze(self, recorder):
+        recorder.start()
+        with open("healthy_remote_test.dump") as dump:
+            for line in dump:
+                self.analyzer.analyse(build_packet(line))
+        recorder.stop()
+
+        with open(self.filename) as outliers:
+            return [json.loads(line) for line in outliers]
+
+    def test_dumps_slow_transport(self):
+        # Handshake of 9.6 ms, transports of 11.7, 14.4 and 2.8 ms
+        dumps = self._analyze(OutlierRecorder(self.analyzer, self.filename, threshold=10))
+
+        self.assertEquals([dump['kind'] for dump in dumps], ["transport", "transport"])
+        self.assertEquals(dumps[0]['remote'], "test")
+        self.assertEquals(dumps[0]['port'], 53678)
+        self.assertEquals([packet['flags'] for packet in dumps[0]['packets']], ["S", "S.", ".", "P.", ".", "P."])
+        self.assertEquals(dumps[0]['packets'][-1]['timestamp'], dumps[0]['timestamp'])
+        # The ring is emptied by a dump
+        self.assertEquals([packet['flags'] for packet in dumps[1]['packets']], [".", "P.", ".", "P."])
+
+    def test_percentile_needs_samples(self):
+        recorder = OutlierRecorder(self.analyzer, self.filename, percentile=99)
+        self.assertEquals(self._analyze(recorder), [])
+        self.assertEquals(recorder.rings, 1)
+
+    def test_budget(self):
+        recorder = OutlierRecorder(self.analyzer, self.filename, threshold=0, budget_mb=0)
+        self.assertEquals(self._analyze(recorder), [])
+        self.assertEquals(recorder.unrecorded, 1)
+
+    def test_ring_reused_once_forgotten(self):
+        recorder = OutlierRecorder(self.analyzer, self.filename, threshold=10)
+        session = TcpSessionState("255.255.255.255")
+        ring = recorder._acquire(session)
+        self.assertEquals(recorder.free_rings, [])
+
+        del session
+        self.assertEquals(recorder.free_rings, [ring])
+        self.assertTrue(recorder._acquire(TcpSessionState("255.255.255.255")) is ring)
+        self.assertEquals(recorder.rings, 1)
+        self.assertEquals(len(ring.slots), RING_SIZE)
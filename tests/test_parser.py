@@ -0,0 +1,162 @@
+__author__ = 'Thomas Kountis'
+
+import random
+import socket
+import unittest
+from tcpdump.parser import parse_line, is_valid_line, build_packet
+from trtop.address import to_text, parse, is_v6
+
+CORPUS_SIZE = 20000
+FIELDS = ["timestamp", "src", "src_port", "dst", "dst_port", "flags", "ack", "sequence", "length", "mss"]
+
+
+# Reference copy of the split/find based parser the single pass parser replaced, IPv4 only and with text addresses
+
+def _reference_is_valid_line(line):
+    parts = line.split(" ")
+    return len(parts) >= 9 and parts[1] == "IP" and parts[5] == "Flags"
+
+
+def _reference_number(line, index):
+    index_of_end = index
+    while index_of_end < len(line) and line[index_of_end].isdigit():
+        index_of_end += 1
+    return int(line[index:index_of_end]) if index_of_end > index else None
+
+
+def _reference_fields(line):
+    parts = line.split(" ")
+    index_of_seq = line.find(' seq ')
+    seq = line[index_of_seq + 5: line.index(',', index_of_seq)] if index_of_seq > 0 else "0"
+    seq = seq.split(":")[1] if seq.find(":") > 0 else seq
+    index_of_ack = line.find(' ack ')
+    index_of_len = line.find(' length ')
+    index_of_mss = line.find('mss ')
+    return dict(src=parts[2].rpartition(".")[0],
+                src_port=int(parts[2].rpartition(".")[2]),
+                dst=parts[4].rpartition(".")[0],
+                dst_port=int(parts[4].rpartition(".")[2][:-1]),
+                flags=parts[6].replace("[", "").replace("]", "").replace(",", ""),
+                timestamp=parts[0],
+                ack=int(line[index_of_ack + 5: line.index(',', index_of_ack)]) if index_of_ack > 0 else 0,
+                sequence=int(seq),
+                length=_reference_number(line, index_of_len + 8) or 0 if index_of_len > 0 else 0,
+                mss=_reference_number(line, index_of_mss + 4) if index_of_mss > 0 else None)
+
+
+def _corpus(size, seed=7):
+    """
+    tcpdump -n lines of every TCP shape trtop handles, mixed with lines of other protocols.
+    """
+    rand = random.Random(seed)
+
+    def addr():
+        return "{0}.{1}.{2}.{3}".format(rand.randint(1, 254), rand.randint(0, 255), rand.randint(0, 255),
+                                        rand.randint(1, 254))
+
+    def options(mss=False):
+        timestamps = "TS val {0} ecr {1}".format(rand.randint(0, 1 << 32), rand.randint(0, 1 << 32))
+        if mss:
+            return ", options [{0}mss {1},sackOK,{2},nop,wscale 7]".format(
+                rand.choice(["", "nop,"]), rand.choice([536, 1380, 1440, 1460, 8960]), timestamps)
+        return rand.choice(["", ", options [nop,nop,{0}]".format(timestamps)])
+
+    lines = []
+    for _ in range(size):
+        ts = "{0}.{1:06d}".format(rand.randint(1400000000, 1500000000), rand.randint(0, 999999))
+        local = "{0}.{1}".format(addr(), rand.randint(32768, 65535))
+        remote = "{0}.{1}".format(addr(), rand.choice([80, 443, 3306, 6379, 11211]))
+        src, dst = (local, remote) if rand.random() < 0.5 else (remote, local)
+        prefix = "{0} IP {1} > {2}: ".format(ts, src, dst)
+        seq = rand.randint(0, (1 << 32) - 1)
+        ack = rand.randint(0, (1 << 32) - 1)
+        win = rand.randint(0, 65535)
+        length = rand.choice([0, 1, 91, 802, 1448, 1460, 2896, 65160])
+        shape = rand.randint(0, 11)
+        if shape == 0:
+            line = prefix + "Flags [S], seq {0}, win {1}{2}, length 0".format(seq, win, options(True))
+        elif shape == 1:
+            line = prefix + "Flags [S.], seq {0}, ack {1}, win {2}{3}, length 0".format(seq, ack, win, options(True))
+        elif shape == 2:
+            line = prefix + "Flags [.], ack {0}, win {1}{2}, length 0".format(ack, win, options())
+        elif shape == 3:
+            line = prefix + "Flags [{0}], seq {1}:{2}, ack {3}, win {4}{5}, length {6}".format(
+                rand.choice(["P.", ".", "FP."]), seq, seq + length, ack, win, options(), length)
+        elif shape == 4:
+            line = prefix + "Flags [P.], seq {0}:{1}, ack {2}, win {3}{4}, length {5}: HTTP: GET / HTTP/1.1".format(
+                seq, seq + length, ack, win, options(), length)
+        elif shape == 5:
+            line = prefix + "Flags [F.], seq {0}, ack {1}, win {2}{3}, length 0".format(seq, ack, win, options())
+        elif shape == 6:
+            line = prefix + "Flags [{0}], seq {1}, win 0, length 0".format(rand.choice(["R", "R."]), seq)
+        elif shape == 7:
+            line = prefix + "Flags [P.U], seq {0}:{1}, ack {2}, win {3}, urg 1{4}, length {5}".format(
+                seq, seq + length, ack, win, options(), length)
+        elif shape == 8:
+            line = prefix + "Flags [S], seq {0}, win {1},".format(seq, win)  # Truncated
+        elif shape == 9:
+            v6_local = socket.inet_ntop(socket.AF_INET6, "".join(chr(rand.randint(0, 255)) for _ in range(16)))
+            v6_remote = rand.choice(["::1", "2001:db8::1", "fe80::1:2"])
+            line = "{0} IP6 {1}.{2} > {3}.80: Flags [S], seq {4}, win {5}{6}, length 0".format(
+                ts, v6_local, rand.randint(32768, 65535), v6_remote, seq, win, options(True))
+        elif shape == 10:
+            line = "{0} IP {1}.53 > {2}: {3}+ A? example.com. (29)".format(ts, addr(), dst, rand.randint(0, 65535))
+        else:
+            line = "{0} ARP, Request who-has {1} tell {2}, length 28".format(ts, addr(), addr())
+        lines.append(line + rand.choice(["", "\n"]))
+
+    return lines
+
+
+def _fields(packet):
+    fields = dict((field, getattr(packet, field)) for field in FIELDS)
+    fields['src'] = to_text(packet.src)
+    fields['dst'] = to_text(packet.dst)
+    return fields
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_differential(self):
+        valid = 0
+        for line in _corpus(CORPUS_SIZE):
+            # IPv6 lines only differ by their IP6 protocol, the reference parser splitting their addresses alike
+            expected = _reference_is_valid_line(line.replace(" IP6 ", " IP ", 1))
+            self.assertEquals(is_valid_line(line), expected, line)
+            packet = parse_line(line)
+            if not expected:
+                self.assertEquals(packet, None, line)
+                continue
+
+            valid += 1
+            fields = _fields(packet)
+            reference = _reference_fields(line)
+            for field in FIELDS:
+                self.assertEquals(fields[field], reference[field], "{0} of {1}".format(field, line))
+
+        self.assertTrue(valid > CORPUS_SIZE / 2)
+
+    def test_addresses(self):
+        packet = build_packet("1443817535.972240 IP6 2001:db8::2.53678 > 2001:db8::1.443: Flags [S], seq 1, "
+                              "win 14600, length 0")
+        self.assertEquals((packet.remote_ip(), packet.remote_port()), (parse("2001:db8::1"), 443))
+        self.assertTrue(is_v6(packet.src))
+        self.assertTrue(parse("::1") != parse("0.0.0.1"))
+        self.assertEquals(parse("10.0.0.1"), 167772161)
+        self.assertEquals(to_text(parse("10.0.0.1")), "10.0.0.1")
+
+    def test_rejects(self):
+        self.assertEquals(parse_line(""), None)
+        self.assertEquals(parse_line("tcpdump: verbose output suppressed, use -v or -vv"), None)
+        self.assertRaises(ValueError, build_packet, "1443817535.972240 ARP, Reply 10.0.0.1 is-at 00:00:00:00:00:01")
+
+    def test_dumps(self):
+        for dump_name in ["healthy_remote_test.dump", "loopback_test.dump", "reordered_remote_test.dump"]:
+            with open(dump_name) as dump:
+                for line in dump:
+                    self.assertEquals(is_valid_line(line), _reference_is_valid_line(line), line)
+                    if is_valid_line(line):
+                        fields = _fields(build_packet(line))
+                        reference = _reference_fields(line)
+                        self.assertEquals([fields[field] for field in FIELDS],
+                                          [reference[field] for field in FIELDS], line)
@@ -0,0 +1,111 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+from trtop import pcap
+from trtop.pcap import PcapFormat, CaptureIndex, IndexingCapture, RestrictedCapture, walk, load_index
+from trtop.analyzer import BaseAnalyser
+from trtop.runtime import Runtime
+from test_analyzer import MockTCPDumpFileCollector
+
+
+def _record(index, src, src_port, dst, dst_port, protocol=pcap.PROTOCOL_TCP):
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 40, index, 0, 64, protocol, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    tcp = struct.pack("!HHIIBBHHH", src_port, dst_port, index, 0, 0x50, 0x10, 1024, 0, 0)
+    frame = "\x00" * 12 + struct.pack("!H", pcap.ETHERTYPE_IPV4) + ip + tcp
+    return struct.pack("<IIII", 1444821267, index, len(frame), len(frame)) + frame
+
+
+def write_capture(file_name, packets):
+    with open(file_name, 'wb') as capture:
+        capture.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for index, packet in enumerate(packets):
+            capture.write(_record(index, *packet))
+
+
+def _remotes(data):
+    return [remote for _, _, remote in walk(data, PcapFormat(data[:pcap.GLOBAL_HEADER_LENGTH]))]
+
+
+def _read(capture):
+    try:
+        return "".join(iter(lambda: capture.read(64), ''))
+    finally:
+        capture.close()
+
+
+class CaptureIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.capture = os.path.join(self.directory, "capture.pcap")
+        packets = []
+        for port in range(50000, 50010):
+            packets.append(("10.0.0.1", port, "10.0.0.2", 80))
+            packets.append(("10.0.0.3", 443, "10.0.0.1", port))
+        packets.append(("10.0.0.1", 50000, "10.0.0.4", 53, 17))  # UDP
+        write_capture(self.capture, packets)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_walk(self):
+        with open(self.capture, 'rb') as capture:
+            remotes = _remotes(capture.read())
+
+        self.assertEquals(remotes[:2], ["10.0.0.2:80", "10.0.0.3:443"])
+        self.assertEquals(remotes[-1], None)
+        self.assertEquals(len(remotes), 21)
+
+    def test_indexing_reads_as_is(self):
+        data = _read(IndexingCapture(self.capture))
+        with open(self.capture, 'rb') as capture:
+            self.assertEquals(data, capture.read())
+
+        index = load_index(self.capture)
+        self.assertEquals(sorted(index.ranges.keys()), ["10.0.0.2:80", "10.0.0.3:443"])
+
+    def test_restricted(self):
+        _read(IndexingCapture(self.capture))
+        index = load_index(self.capture)
+
+        self.assertEquals(_remotes(_read(RestrictedCapture(self.capture, index, ["10.0.0.3:443"]))),
+                          ["10.0.0.3:443"] * 10)
+        self.assertEquals(_remotes(_read(RestrictedCapture(self.capture, index, ["10.0.0.2"]))),
+                          ["10.0.0.2:80"] * 10)
+        self.assertEquals(_read(RestrictedCapture(self.capture, index, ["10.0.0.9"])),
+                          open(self.capture, 'rb').read(pcap.GLOBAL_HEADER_LENGTH))
+
+    def test_ranges_round_trip(self):
+        index = CaptureIndex(1 << 40, 1444821267.5)
+        for offset in [24, 100, 200000, 200100, 1 << 39]:
+            index.add("10.0.0.2:80", offset, 60)
+        index.add("10.0.0.3:443", 160, 60)
+
+        loaded = CaptureIndex.loads(index.dumps())
+        self.assertEquals(loaded.ranges, index.ranges)
+        self.assertEquals((loaded.size, loaded.mtime), (1 << 40, 1444821267.5))
+        self.assertEquals(index.ranges["10.0.0.2:80"], [[24, 160], [200000, 200160], [1 << 39, (1 << 39) + 60]])
+        self.assertEquals(index.select(["10.0.0.2:80", "10.0.0.3"])[0], [24, 220])
+
+    def test_stale_index(self):
+        _read(IndexingCapture(self.capture))
+        os.utime(self.capture, (0, 0))
+        self.assertEquals(load_index(self.capture), None)
+
+    def test_collector_builds_index(self):
+        self.assertRaises(ValueError, MockTCPDumpFileCollector, BaseAnalyser(), self.capture, remotes=["10.0.0.2"])
+
+        runtime = Runtime()
+        collector = MockTCPDumpFileCollector(BaseAnalyser(), self.capture, build_index=True)
+        collector.attach(runtime)
+        runtime.call_later(0.2, runtime.stop)
+        runtime.run()
+        collector.stop()
+
+        self.assertEquals(len(load_index(self.capture).ranges), 2)
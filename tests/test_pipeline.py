@@ -0,0 +1,58 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import sys
+import unittest
+import subprocess
+import trtop
+from trtop.trtop import parse_args
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+from test_aggregation import RecordingReporter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only the repository root on the path, as an application embedding trtop. Without tcpdump at hand the capture
+# lines go through the parser of the built collector.
+EMBEDDED = """
+import sys
+import trtop
+from trtop.tcpdump.parser import parse_line
+pipeline = trtop.build(input_filename="healthy_remote_test.dump")
+with open("healthy_remote_test.dump") as dump:
+    for packet in (parse_line(line) for line in dump):
+        if packet is not None:
+            pipeline.analyzer.analyse(packet)
+print type(pipeline.collector).__module__, len(pipeline.analyzer.tracked_remotes), 'packet' in sys.modules
+"""
+
+
+class PipelineBuildTest(unittest.TestCase):
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_headless(self):
+        reporters = [RecordingReporter(), RecordingReporter()]
+        pipeline = trtop.build(collector=lambda analyzer: MockFileReaderCollector(analyzer, "healthy_remote_test.dump"),
+                               reporters=reporters, whitelist=MockWhitelist(["255.255.255.255"]),
+                               resolver=MockResolver("test"))
+        pipeline.start()
+        pipeline.stop()
+
+        self.assertEquals(pipeline.analyzer.tracked_remotes.get('test').get_outgoing_count(), 2)
+        self.assertEquals([len(reporter.events) for reporter in reporters], [len(reporters[0].events)] * 2)
+        self.assertTrue(len(reporters[0].events) > 0)
+        self.assertTrue(sys.modules['trtop.reporter'].curses is None)  # Headless, curses never set up
+
+    def test_embedded(self):
+        output = subprocess.check_output([sys.executable, "-c", EMBEDDED], env=dict(os.environ, PYTHONPATH=ROOT),
+                                         stderr=subprocess.STDOUT)
+        self.assertEquals(output.split(), ["trtop.tcpdump.offlinecollector", "1", "False"])
+
+    def test_collector_required(self):
+        self.assertRaises(ValueError, trtop.build)
+
+    def test_parse_args(self):
+        args = parse_args(["-i", "sample.pcap", "-k", "10", "-rs", "2"])
+        self.assertEquals((args.input, args.top_remotes, args.replay_speed), ("sample.pcap", 10, 2.0))
@@ -0,0 +1,61 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.state import REORDER_WINDOW_PACKETS
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+
+
+class ReorderedRemoteAnalyzerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        MockFileReaderCollector(cls.analyzer, "reordered_remote_test.dump").start()
+
+    @classmethod
+    def tearDownClass(cls):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_same_as_in_order(self):
+        state = self.__class__.analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.get_syn_count(), 1)
+        self.assertEquals(state.get_est_count(), 1)
+        self.assertEquals(state.get_fin_in_count(), 1)
+        self.assertEquals(state.get_outgoing_count(), 2)
+        self.assertEquals(state.get_incoming_count(), 2)
+
+    def test_err(self):
+        state = self.__class__.analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.get_pkt_err_count(), 0)
+
+    def test_reordered(self):
+        state = self.__class__.analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.get_reordered_count(), 2)
+
+
+class ReorderWindowOverflowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        with open("healthy_remote_test.dump") as dump:
+            self.lines = dump.readlines()
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_overflow(self):
+        for line in self.lines[:5]:
+            self.analyzer.analyse(build_packet(line))
+
+        # ACKs of data never seen: held until the window overflows and the session is dropped
+        ack = self.lines[6]
+        for _ in range(REORDER_WINDOW_PACKETS + 1):
+            self.analyzer.analyse(build_packet(ack))
+
+        state = self.analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.get_pkt_err_count(), 1)
+        self.assertEquals(state.get_reordered_count(), 0)
+        self.assertEquals(len(state.states), 0)
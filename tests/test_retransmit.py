@@ -0,0 +1,62 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+
+class RetransmitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        with open("healthy_remote_test.dump") as dump:
+            self.lines = dump.readlines()
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyze(self, repeated):
+        for index, line in enumerate(self.lines):
+            self.analyzer.analyse(build_packet(line))
+            if index == repeated:
+                self.analyzer.analyse(build_packet(line))
+
+        return self.analyzer.tracked_remotes.get('test')
+
+    def test_syn(self):
+        state = self._analyze(0)
+        self.assertEquals(state.get_retransmit_counter(), 1)
+        self.assertEquals(state.get_syn_count(), 1)
+        self.assertEquals(state.get_est_count(), 1)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        # Ambiguous handshake time
+        self.assertEquals(state.sketches['_conn_time_histo'].count, 0)
+
+    def test_syn_ack(self):
+        state = self._analyze(1)
+        self.assertEquals(state.get_retransmit_counter(), 1)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+
+    def test_request(self):
+        state = self._analyze(3)
+        self.assertEquals(state.get_retransmit_counter(), 1)
+        self.assertEquals(state.get_outgoing_count(), 2)
+        self.assertEquals(state.get_incoming_count(), 2)
+        self.assertEquals(state.get_fin_in_count(), 1)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        # Only the round trip without retransmits is sampled
+        self.assertEquals(state.sketches['_transport_time_histo'].count, 1)
+
+    def test_response(self):
+        state = self._analyze(5)
+        self.assertEquals(state.get_retransmit_counter(), 1)
+        self.assertEquals(state.get_incoming_count(), 2)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        self.assertEquals(state.sketches['_transport_time_histo'].count, 2)
+
+    def test_none(self):
+        state = self._analyze(None)
+        self.assertEquals(state.get_retransmit_counter(), 0)
+        self.assertEquals(state.sketches['_transport_time_histo'].count, 2)
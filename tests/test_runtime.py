@@ -0,0 +1,77 @@
+__author__ = 'Thomas Kountis'
+
+import time
+import thread
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.pipeline import Pipeline
+from trtop.resolver import BaseResolver, AsyncResolver
+from trtop.runtime import Runtime
+from trtop.address import parse
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockTCPDumpFileCollector
+from test_aggregation import RecordingReporter
+
+
+class SlowResolver(BaseResolver):
+
+    def __init__(self):
+        BaseResolver.__init__(self)
+        self.threads = set()
+
+    def resolve(self, addr, port):
+        self.threads.add(thread.get_ident())
+        time.sleep(0.05)
+        return "test"
+
+
+class RuntimeTest(unittest.TestCase):
+
+    def test_timers(self):
+        runtime = Runtime()
+        ticks = []
+        runtime.every(0.01, lambda: ticks.append(time.time()))
+        runtime.call_later(0.1, runtime.stop)
+        runtime.run()
+        self.assertTrue(5 <= len(ticks) <= 11)
+
+    def test_executor_calls_back_on_loop(self):
+        runtime = Runtime(workers=2)
+        results = []
+
+        def _done(result):
+            results.append((result, thread.get_ident()))
+            if len(results) == 3:
+                runtime.stop()
+
+        for value in range(3):
+            runtime.run_in_executor(lambda value: value * 2, (value,), _done)
+        runtime.run()
+
+        self.assertEquals(sorted(result for result, _ in results), [0, 2, 4])
+        self.assertEquals(set(ident for _, ident in results), set([thread.get_ident()]))
+
+
+class RuntimePipelineTest(unittest.TestCase):
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_attached_collector_and_async_resolver(self):
+        runtime = Runtime()
+        resolver = SlowResolver()
+        analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), AsyncResolver(resolver, runtime))
+        reporter = RecordingReporter()
+        analyzer.set_observer(reporter)
+        pipeline = Pipeline(MockTCPDumpFileCollector(analyzer, "healthy_remote_test.dump"), analyzer, reporter)
+        runtime.call_later(0.5, runtime.stop)
+        pipeline.run(runtime)
+
+        # Tracked by address without waiting for DNS, renamed once resolved off the analysis thread
+        state = analyzer.tracked_remotes.get(parse('255.255.255.255'))
+        self.assertEquals(state.get_outgoing_count(), 2)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        self.assertEquals(analyzer.last_timestamp, "1443817536.119788")
+        self.assertEquals(state.hostname, "test")
+        self.assertEquals(reporter.events[-1].hostname, "test")
+        self.assertFalse(thread.get_ident() in resolver.threads)
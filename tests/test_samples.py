@@ -0,0 +1,69 @@
+__author__ = 'Thomas Kountis'
+
+import shutil
+import tempfile
+import unittest
+from trtop import samples
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.samples import SampleSink, RECORD_BYTES
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SampleSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyze(self, sink):
+        sink.start()
+        with open("healthy_remote_test.dump") as dump:
+            for line in dump:
+                self.analyzer.analyse(build_packet(line))
+        sink.stop()
+        return samples.segments(self.directory)
+
+    def test_columns(self):
+        segments = self._analyze(SampleSink(self.analyzer, self.directory))
+
+        self.assertEquals(len(segments), 1)
+        segment_dir, manifest = segments[0]
+        self.assertEquals(manifest['rows'], 5)
+        self.assertEquals(manifest['remotes'], ["test"])
+
+        columns = samples.read(segment_dir, manifest)
+        self.assertEquals([manifest['kinds'][kind] for kind in columns['kind']],
+                          ["handshake", "ttfb", "ttlb", "ttfb", "ttlb"])
+        self.assertEquals(list(columns['port']), [53678] * 5)
+        self.assertEquals(list(columns['remote']), [0] * 5)
+        self.assertEquals(columns['ts'][0], 1443817535.981882)
+        self.assertAlmostEquals(columns['duration'][1], 11.68, places=3)
+
+    def test_rotation(self):
+        sink = SampleSink(self.analyzer, self.directory, buffer_mb=0)
+        sink.segment_rows = 2
+        segments = self._analyze(sink)
+
+        self.assertEquals([manifest['rows'] for _, manifest in segments], [2, 2, 1])
+        self.assertEquals(sum(len(samples.read(*segment)['ts']) for segment in segments), 5)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_load(self):
+        self._analyze(SampleSink(self.analyzer, self.directory))
+
+        columns = samples.load(self.directory)[0]
+        self.assertTrue(isinstance(columns['duration'], numpy.memmap))
+        self.assertEquals(columns['port'].tolist(), [53678] * 5)
+        self.assertEquals(columns['ts'].nbytes + columns['duration'].nbytes + columns['remote'].nbytes +
+                          columns['port'].nbytes + columns['kind'].nbytes, 5 * RECORD_BYTES)
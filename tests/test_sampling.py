@@ -0,0 +1,67 @@
+__author__ = 'Thomas Kountis'
+
+import time
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.sampling import AdaptiveFlowSampler, ScaledRemoteView, flow_hash
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+
+
+SYN = "1443817535.972240 IP 127.0.0.1.{0} > 255.255.255.255.80: Flags [S], seq 4173560241, win 14600, " \
+      "options [mss 1460,sackOK,TS val 2472289776 ecr 0,nop,wscale 7], length 0"
+
+
+class AdaptiveFlowSamplerTest(unittest.TestCase):
+
+    def test_flow_hash_both_directions(self):
+        with open("healthy_remote_test.dump") as dump:
+            lines = dump.readlines()
+        self.assertEquals(flow_hash(build_packet(lines[0])), flow_hash(build_packet(lines[1])))
+
+    def test_sampled_flows(self):
+        sampler = AdaptiveFlowSampler()
+        sampler._set_rate(0.25)
+        packets = [build_packet(SYN.format(port)) for port in range(40000, 44000)]
+        admitted = [packet for packet in packets if sampler.admit(packet, False)]
+
+        self.assertAlmostEquals(len(admitted) / float(len(packets)), 0.25, delta=0.05)
+        self.assertAlmostEquals(sampler.scale(), 4, delta=1)
+        # Stable decisions, and tracked flows are always admitted
+        self.assertEquals([packet for packet in packets if sampler.admit(packet, False)], admitted)
+        self.assertTrue(all(sampler.admit(packet, True) for packet in packets))
+
+    def test_ecn_syn_counted(self):
+        sampler = AdaptiveFlowSampler()
+        for port, flags in [(40000, "S"), (40001, "SEW"), (40001, "S.E"), (40002, ".")]:
+            sampler.admit(build_packet(SYN.format(port).replace("[S]", "[{0}]".format(flags))), False)
+
+        self.assertEquals(sampler.seen_flows, 2)
+        self.assertEquals(sampler.admitted_flows, 2)
+
+    def test_rate_follows_lag(self):
+        sampler = AdaptiveFlowSampler(max_lag=2.0, interval=0)
+        sampler._origin = (time.time() - 10, 1000.0)
+        sampler._last_check = 0
+        sampler._check_lag(1005.0)  # 5 secs behind
+        self.assertEquals(sampler.rate, 0.5)
+        sampler._check_lag(1009.5)  # Caught up
+        self.assertEquals(sampler.rate, 0.55)
+
+
+class SampledAnalyzerTest(unittest.TestCase):
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_whole_flows(self):
+        sampler = AdaptiveFlowSampler()
+        analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"), sampler=sampler)
+        MockFileReaderCollector(analyzer, "healthy_remote_test.dump").start()
+
+        state = analyzer.tracked_remotes.get('test')
+        self.assertEquals(state.get_outgoing_count(), 2)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        self.assertEquals(ScaledRemoteView(state, 3).get_syn_count(), 3)
+        self.assertEquals(ScaledRemoteView(state, 3).get_conn_latency_max(), state.get_conn_latency_max())
@@ -0,0 +1,97 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+HANDSHAKE = [
+    "1443817535.972240 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [S], seq 4173560241, win 14600, "
+    "options [mss 1460,sackOK,TS val 2472289776 ecr 0,nop,wscale 7], length 0",
+    "1443817535.981865 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [S.], seq 2963972603, ack 4173560242, "
+    "win 4380, options [mss 1460,sackOK,TS val 2770592028 ecr 2472289776,wscale 4,eol], length 0",
+    "1443817535.981882 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [.], ack 2963972604, win 115, "
+    "options [nop,nop,TS val 2472289786 ecr 2770592028], length 0"]
+REQUEST = [
+    "1443817535.982069 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [.], seq 4173560242:4173561702, "
+    "ack 2963972604, win 115, length 1460",
+    "1443817535.983069 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [P.], seq 4173561702:4173562044, "
+    "ack 2963972604, win 115, length 342"]
+RESPONSE = [
+    "1443817535.992069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [.], seq 2963972604:2963974064, "
+    "ack 4173562044, win 323, length 1460",
+    "1443817535.995069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [.], seq 2963974064:2963975524, "
+    "ack 4173562044, win 323, length 1460",
+    "1443817535.998069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [P.], seq 2963975524:2963975615, "
+    "ack 4173562044, win 323, length 91"]
+TS_OPTIONS = "options [nop,nop,TS val 2770592040 ecr 2472289786]"
+# Full segments of 1448 bytes, the MSS of 1460 less the 12 bytes of the timestamps option
+TIMESTAMPED_RESPONSE = [
+    "1443817535.992069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [.], seq 2963972604:2963974052, "
+    "ack 4173562044, win 323, " + TS_OPTIONS + ", length 1448",
+    "1443817535.995069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [.], seq 2963974052:2963975500, "
+    "ack 4173562044, win 323, " + TS_OPTIONS + ", length 1448",
+    "1443817535.998069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [P.], seq 2963975500:2963975591, "
+    "ack 4173562044, win 323, " + TS_OPTIONS + ", length 91"]
+FIN = [
+    "1443817536.109694 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [F.], seq 2963975615, ack 4173562044, "
+    "win 384, length 0"]
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_length_and_mss(self):
+        self.assertEquals(build_packet(HANDSHAKE[0]).mss, 1460)
+        self.assertEquals(build_packet(HANDSHAKE[2]).mss, None)
+        self.assertEquals(build_packet(RESPONSE[0]).length, 1460)
+        self.assertEquals(build_packet(RESPONSE[2]).length, 91)
+        self.assertEquals(build_packet(RESPONSE[2] + "\n").length, 91)
+        self.assertEquals(build_packet(FIN[0]).length, 0)
+
+
+class MultiSegmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyze(self, lines):
+        for line in lines:
+            self.analyzer.analyse(build_packet(line))
+
+        return self.analyzer.tracked_remotes.get('test')
+
+    def test_response(self):
+        state = self._analyze(HANDSHAKE + REQUEST + RESPONSE)
+        self.assertEquals(state.get_outgoing_count(), 1)
+        self.assertEquals(state.get_incoming_count(), 1)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+        # Timed from the last request segment, to the first and last response segments
+        self.assertAlmostEquals(state.sketches['_transport_time_histo'].max, 9, places=3)
+        self.assertAlmostEquals(state.sketches['_ttlb_histo'].max, 15, places=3)
+        self.assertEquals(state.sketches['_ttlb_histo'].count, 1)
+
+    def test_full_last_segment(self):
+        state = self._analyze(HANDSHAKE + REQUEST + RESPONSE[:2])
+        self.assertEquals(state.sketches['_ttlb_histo'].count, 0)
+
+        # Completed by the FIN, at the time of its last segment
+        self._analyze(FIN)
+        self.assertAlmostEquals(state.sketches['_ttlb_histo'].max, 12, places=3)
+
+    def test_learned_mss(self):
+        # No SYN seen, full segments are the largest ones
+        state = self._analyze(REQUEST[1:] + RESPONSE)
+        self.assertEquals(state.get_incoming_count(), 1)
+        self.assertEquals(state.sketches['_ttlb_histo'].count, 1)
+        self.assertAlmostEquals(state.sketches['_ttlb_histo'].max, 15, places=3)
+
+    def test_timestamped_segments(self):
+        state = self._analyze(HANDSHAKE + REQUEST + TIMESTAMPED_RESPONSE)
+        self.assertEquals(state.get_incoming_count(), 1)
+        self.assertEquals(state.sketches['_transport_time_histo'].count, 1)
+        self.assertEquals(state.sketches['_ttlb_histo'].count, 1)
+        self.assertAlmostEquals(state.sketches['_ttlb_histo'].max, 15, places=3)
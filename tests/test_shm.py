@@ -0,0 +1,128 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import shutil
+import tempfile
+import unittest
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.shm import SharedSnapshot, SnapshotPublisher, SnapshotViewer, SEQUENCE, SEQUENCE_OFFSET
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+
+class MockObserver(object):
+
+    def __init__(self):
+        self.events = []
+
+    def handle_remote_event(self, remote):
+        self.events.append(("event", remote.hostname))
+
+    def handle_remote_evicted(self, remote):
+        self.events.append(("evicted", remote.hostname))
+
+
+class OvertakenSnapshot(SharedSnapshot):
+    """
+    Reader whose first copy is overtaken by a writer publishing @publishes meanwhile.
+    """
+
+    def __init__(self, path, data):
+        SharedSnapshot.__init__(self, path, data)
+        self.writer = None
+        self.publishes = []
+        self.copies = 0
+
+    @staticmethod
+    def open(path):
+        segment = SharedSnapshot.open(path)
+        return OvertakenSnapshot(segment.path, segment.data)
+
+    def _copy(self, buffer_index, length):
+        self.copies += 1
+        head = SharedSnapshot._copy(self, buffer_index, length / 2)
+        while self.publishes:
+            self.writer.publish(self.publishes.pop(0))
+        return head + SharedSnapshot._copy(self, buffer_index, length)[length / 2:]
+
+
+class SharedSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "segment")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_double_buffered(self):
+        writer = SharedSnapshot.create(self.path, 16)
+        reader = SharedSnapshot.open(self.path)
+        self.assertEquals(reader.read(), (0, None))
+
+        self.assertTrue(writer.publish("first"))
+        self.assertEquals(reader.read(), (2, "first"))
+        self.assertTrue(writer.publish("second"))
+        self.assertEquals(reader.read(), (4, "second"))
+        self.assertFalse(writer.publish("x" * 17))
+        self.assertEquals(reader.read(), (4, "second"))
+
+    def test_write_in_progress(self):
+        writer = SharedSnapshot.create(self.path, 16)
+        writer.publish("first")
+        SEQUENCE.pack_into(writer.data, SEQUENCE_OFFSET, 3)  # As when the writer stopped mid-publish
+        self.assertEquals(SharedSnapshot.open(self.path).read(), (3, None))
+
+    def test_overtaken(self):
+        writer = SharedSnapshot.create(self.path, 16)
+        writer.publish("a" * 8)
+        reader = OvertakenSnapshot.open(self.path)
+        reader.writer = writer
+        reader.publishes = ["b" * 4, "c" * 12]
+
+        # The copy of a buffer rewritten meanwhile is discarded, never a mix of two payloads
+        self.assertEquals(reader.read(), (6, "c" * 12))
+        self.assertEquals(reader.copies, 2)
+
+
+class SnapshotPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "segment")
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        with open("healthy_remote_test.dump") as dump:
+            for line in dump:
+                self.analyzer.analyse(build_packet(line))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_attach(self):
+        viewer = SnapshotViewer(self.path)
+        observer = MockObserver()
+        viewer.set_observer(observer)
+        self.assertFalse(viewer.poll())
+
+        publisher = SnapshotPublisher(self.analyzer, self.path, interval=60)
+        publisher.start()
+        publisher.publish()
+        self.assertTrue(viewer.poll())
+        self.assertFalse(viewer.poll())
+
+        remote = viewer.tracked_remotes["test"]
+        self.assertEquals(remote.get_est_count(), 1)
+        self.assertEquals(remote.get_incoming_count(), 2)
+        self.assertEquals(viewer.last_timestamp, self.analyzer.last_timestamp)
+        self.assertEquals(observer.events, [("event", "test")])
+
+        self.analyzer.tracked_remotes.clear()
+        publisher.publish()
+        self.assertTrue(viewer.poll())
+        self.assertEquals(observer.events[-1], ("evicted", "test"))
+
+        publisher.stop()
+        viewer.stop()
+        self.assertFalse(os.path.exists(self.path))
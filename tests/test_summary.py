@@ -0,0 +1,60 @@
+__author__ = 'Thomas Kountis'
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.summary import write_snapshot, SummaryWriter
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+
+
+class SummaryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        MockFileReaderCollector(cls.analyzer, "healthy_remote_test.dump").start()
+
+    @classmethod
+    def tearDownClass(cls):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="trtop-")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot_lines(self):
+        output = StringIO()
+        write_snapshot(output, self.__class__.analyzer.tracked_remotes.values(), "1443817535.993749")
+        entries = [json.loads(line) for line in output.getvalue().splitlines()]
+
+        self.assertEquals(len(entries), 1)
+        self.assertEquals(entries[0]['host'], 'test')
+        self.assertEquals(entries[0]['syn'], 1)
+        self.assertEquals(entries[0]['incoming'], 2)
+        self.assertEquals(entries[0]['capture_ts'], "1443817535.993749")
+
+    def test_rolling(self):
+        writer = SummaryWriter(self.__class__.analyzer, os.path.join(self.directory, "run"),
+                               max_bytes=1, max_files=2, compress=True)
+        for _ in range(4):
+            writer.write()
+
+        self.assertEquals(sorted(os.listdir(self.directory)), ["run.trtop.jsonl.1.gz", "run.trtop.jsonl.2.gz"])
+        with gzip.open(os.path.join(self.directory, "run.trtop.jsonl.1.gz")) as rolled:
+            self.assertEquals(json.loads(rolled.readline())['host'], 'test')
+
+    def test_append(self):
+        writer = SummaryWriter(self.__class__.analyzer, os.path.join(self.directory, "run"))
+        writer.write()
+        writer.write()
+
+        with open(writer.filename) as summary:
+            self.assertEquals(len(summary.readlines()), 2)
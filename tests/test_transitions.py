@@ -0,0 +1,79 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop import flags
+from trtop.analyzer import OutgoingTCPAnalyzer
+from trtop.state import TcpRemoteState, PHASE_NAMES
+from appmetrics import metrics
+from tcpdump.parser import build_packet
+from test_analyzer import MockWhitelist, MockResolver
+
+ECN_HANDSHAKE = [
+    "1443817535.972240 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [SEW], seq 100, win 14600, "
+    "options [mss 1460,sackOK,TS val 2472289776 ecr 0,nop,wscale 7], length 0",
+    "1443817535.981865 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [S.E], seq 500, ack 101, win 4380, "
+    "options [mss 1460,sackOK,TS val 2770592028 ecr 2472289776,wscale 4,eol], length 0",
+    "1443817535.981882 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [.], ack 501, win 115, length 0"]
+EXCHANGE = [
+    "1443817535.982069 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [P], seq 101:201, ack 501, win 115, "
+    "length 100",
+    "1443817535.992069 IP 255.255.255.255.80 > 127.0.0.1.53678: Flags [P.U], seq 501:601, ack 201, win 323, "
+    "urg 1, length 100"]
+CLOSE = [
+    "1443817536.109694 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [FP], seq 201:301, ack 601, win 384, "
+    "length 100"]
+
+
+class EventsTest(unittest.TestCase):
+
+    def test_every_combination(self):
+        self.assertEquals(len(flags.EVENTS), 256)
+        for mask in range(256):
+            self.assertEquals(flags.EVENTS[mask], flags.EVENTS[mask & ~(flags.URG | flags.ECE | flags.CWR)])
+
+    def test_notations(self):
+        self.assertEquals([flags.EVENT_NAMES[flags.event_of(notation)] for notation in
+                           ["S", "SEW", "S.", "S.E", ".", "P", "P.U", "FP", "FP.", "F.", "R", "R.", "SF", "none"]],
+                          ["SYN", "SYN", "SYN-ACK", "SYN-ACK", "ACK", "DATA", "DATA", "FIN-DATA", "FIN-DATA",
+                           "FIN", "RST", "RST", "INVALID", "INVALID"])
+
+    def test_table(self):
+        self.assertEquals(len(TcpRemoteState.TRANSITIONS), len(PHASE_NAMES))
+        for row in TcpRemoteState.TRANSITIONS:
+            self.assertEquals(len(row), len(flags.EVENT_NAMES))
+
+
+class StateMachineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+
+    def tearDown(self):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def _analyze(self, lines):
+        for line in lines:
+            self.analyzer.analyse(build_packet(line))
+
+        return self.analyzer.tracked_remotes.get('test')
+
+    def test_ecn_handshake(self):
+        state = self._analyze(ECN_HANDSHAKE)
+        self.assertEquals(state.get_syn_count(), 1)
+        self.assertEquals(state.get_syn_ack_count(), 1)
+        self.assertEquals(state.get_est_count(), 1)
+        self.assertEquals(state.get_pkt_err_count(), 0)
+
+    def test_push_without_ack(self):
+        state = self._analyze(ECN_HANDSHAKE + EXCHANGE + CLOSE)
+        self.assertEquals(state.get_outgoing_count(), 2)  # The closing segment carries a second request
+        self.assertEquals(state.get_incoming_count(), 1)
+        self.assertEquals(state.get_fin_out_count(), 1)
+        self.assertEquals(state.states, {})
+
+    def test_invalid(self):
+        state = self._analyze(ECN_HANDSHAKE[:1] + [
+            "1443817535.975000 IP 127.0.0.1.53678 > 255.255.255.255.80: Flags [SF], seq 100, win 14600, length 0",
+            "1443817535.976000 IP 127.0.0.1.53679 > 255.255.255.255.80: Flags [none], ack 1, win 14600, length 0"])
+        self.assertEquals(state.get_pkt_err_count(), 1)
+        self.assertEquals(state.states.keys(), [53678])
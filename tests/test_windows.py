@@ -0,0 +1,120 @@
+__author__ = 'Thomas Kountis'
+
+import unittest
+from trtop.windows import LogHistogram, WindowedStats
+from trtop.codec import BinaryWriter, BinaryReader
+from trtop.analyzer import OutgoingTCPAnalyzer
+from appmetrics import metrics
+from test_analyzer import MockWhitelist, MockResolver, MockFileReaderCollector
+
+
+class LogHistogramTest(unittest.TestCase):
+
+    def test_percentile_relative_error(self):
+        histogram = LogHistogram()
+        for value in range(1, 1001):
+            histogram.notify(float(value))
+
+        self.assertEquals(histogram.count, 1000)
+        self.assertAlmostEquals(histogram.percentile(95), 950, delta=950 * (LogHistogram.GROWTH - 1))
+        self.assertAlmostEquals(histogram.mean(), 500.5)
+        self.assertAlmostEquals(histogram.percentile(100), 1000, delta=1000 * (LogHistogram.GROWTH - 1))
+
+    def test_merge(self):
+        first, second = LogHistogram(), LogHistogram()
+        [first.notify(value) for value in [1, 2, 3]]
+        [second.notify(value) for value in [100, 200]]
+        first.merge(second)
+
+        self.assertEquals(first.count, 5)
+        self.assertEquals(first.min, 1)
+        self.assertEquals(first.max, 200)
+
+    def test_empty(self):
+        self.assertEquals(LogHistogram().percentile(95), 0.0)
+
+    def test_write_while_notified(self):
+        histogram = LogHistogram()
+        [histogram.notify(value) for value in [1, 10, 100]]
+        buckets = dict(histogram.buckets)
+        writer = NotifyingWriter(histogram, 1000)
+        histogram.write(writer)
+
+        reader = BinaryReader(writer.getvalue())
+        self.assertEquals(LogHistogram.read(reader).buckets, buckets)
+        self.assertEquals(reader.offset, len(reader.data))
+
+
+class NotifyingWriter(BinaryWriter):
+    """
+    Notifies a histogram of a new value on the first write, as the analyzer does while a checkpoint is dumped.
+    """
+
+    def __init__(self, histogram, value):
+        super(NotifyingWriter, self).__init__()
+        self.histogram = histogram
+        self.pending = value
+
+    def uint(self, value):
+        super(NotifyingWriter, self).uint(value)
+        if self.pending is not None:
+            self.histogram.notify(self.pending)
+            self.pending = None
+
+
+class WindowedStatsTest(unittest.TestCase):
+
+    def test_count_expires(self):
+        window = WindowedStats(10, 10)
+        window.count("syn", 100.5)
+        window.count("syn", 105.5)
+
+        self.assertEquals(window.get_count("syn", 106), 2)
+        self.assertEquals(window.get_count("syn", 111), 1)
+        self.assertEquals(window.get_count("syn", 116), 0)
+        self.assertAlmostEquals(window.get_rate("syn", 106), 0.2)
+
+    def test_slot_recycled(self):
+        window = WindowedStats(10, 10)
+        window.count("syn", 100.5)
+        window.count("syn", 110.5)
+
+        self.assertEquals(window.get_count("syn", 110.5), 1)
+
+    def test_late_sample_dropped(self):
+        window = WindowedStats(10, 10)
+        window.sample("conn", 120.5, 5.0)
+        window.sample("conn", 100.5, 50.0)
+
+        self.assertEquals(window.get_histogram("conn", 120.5).count, 1)
+
+
+class WindowedRemoteTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.analyzer = OutgoingTCPAnalyzer(MockWhitelist(["255.255.255.255"]), MockResolver("test"))
+        MockFileReaderCollector(cls.analyzer, "healthy_remote_test.dump").start()
+
+    @classmethod
+    def tearDownClass(cls):
+        [metrics.delete_metric(metric) for metric in metrics.metrics()]
+
+    def test_window_view(self):
+        remote = self.__class__.analyzer.tracked_remotes.get('test')
+        view = remote.window_view("10s", self.__class__.analyzer.last_timestamp)
+
+        self.assertEquals(view.get_syn_count(), remote.get_syn_count())
+        self.assertEquals(view.get_est_count(), remote.get_est_count())
+        self.assertEquals(view.get_outgoing_count(), remote.get_outgoing_count())
+        self.assertAlmostEquals(view.get_conn_latency_95th(), remote.get_conn_latency_95th(),
+                                delta=remote.get_conn_latency_95th() * (LogHistogram.GROWTH - 1))
+
+    def test_window_expired(self):
+        remote = self.__class__.analyzer.tracked_remotes.get('test')
+        view = remote.window_view("10s", float(self.__class__.analyzer.last_timestamp) + 60)
+
+        self.assertEquals(view.get_syn_count(), 0)
+        self.assertEquals(view.get_transport_rtt_95th(), 0.0)
+        self.assertEquals(remote.window_view("5m", float(self.__class__.analyzer.last_timestamp) + 60)
+                          .get_syn_count(), 1)
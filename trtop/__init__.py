@@ -1 +1,3 @@
 __author__ = 'Thomas Kountis'
+
+from pipeline import build, Pipeline
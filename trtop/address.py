@@ -0,0 +1,60 @@
+import socket
+import struct
+
+__author__ = 'Thomas Kountis'
+
+
+V6 = 1 << 128  # Flags IPv6 addresses, so ::1 and 0.0.0.1 stay distinct
+
+
+def parse(text):
+    """
+    The address @text, IPv4 or IPv6, as an integer which hashes and compares cheaper than its text.
+    Raises ValueError when not an address.
+    """
+    try:
+        if ":" in text:
+            high, low = struct.unpack("!QQ", socket.inet_pton(socket.AF_INET6, text))
+            return V6 | (high << 64) | low
+
+        return struct.unpack("!I", socket.inet_pton(socket.AF_INET, text))[0]
+    except socket.error:
+        raise ValueError("Not an address: {0}".format(text))
+
+
+def is_v6(addr):
+    return addr >= V6
+
+
+def to_text(addr):
+    """
+    The text notation of the integer @addr, eg. "10.0.0.1" or "2001:db8::1".
+    """
+    if is_v6(addr):
+        return socket.inet_ntop(socket.AF_INET6, struct.pack("!QQ", (addr >> 64) & 0xffffffffffffffff,
+                                                            addr & 0xffffffffffffffff))
+
+    return socket.inet_ntoa(struct.pack("!I", addr))
+
+
+def display_name(host):
+    """
+    The displayed name of a remote @host, its text notation when an address and as is otherwise
+    (eg. resolved names or aggregated buckets).
+    """
+    if isinstance(host, (int, long)) and not isinstance(host, bool):
+        return to_text(host)
+
+    return str(host)
+
+
+def subnet(addr, v4_prefix=24, v6_prefix=64):
+    """
+    The network of @addr, eg. "10.0.0.0/24".
+    """
+    if is_v6(addr):
+        host_bits = 128 - v6_prefix
+        return "{0}/{1}".format(to_text(V6 | ((addr - V6) >> host_bits << host_bits)), v6_prefix)
+
+    host_bits = 32 - v4_prefix
+    return "{0}/{1}".format(to_text(addr >> host_bits << host_bits), v4_prefix)
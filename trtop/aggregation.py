@@ -0,0 +1,382 @@
+import os
+import zlib
+import socket
+import struct
+import logging
+import threading
+import SocketServer
+
+from analyzer import BaseAnalyser
+from codec import BinaryWriter, BinaryReader
+from state import SKETCHES, HISTOGRAM_CONN, HISTOGRAM_TRANSPORT, HISTOGRAM_RT_PER_CONN, HISTOGRAM_TTLB
+from windows import LogHistogram
+from address import display_name
+from clock import WALL_CLOCK
+
+__author__ = 'Thomas Kountis'
+
+
+VERSION = 3
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+AGENT_TTL = 60  # Secs without summaries after which an agent is forgotten, eg. restarted under a new id
+
+# (summary counter, TcpRemoteState getter)
+COUNTERS = [("syn", "get_syn_count"), ("syn_ack", "get_syn_ack_count"), ("est", "get_est_count"),
+            ("rst", "get_rst_count"), ("fin_out", "get_fin_out_count"), ("fin_in", "get_fin_in_count"),
+            ("out", "get_outgoing_count"), ("incoming", "get_incoming_count"), ("err", "get_pkt_err_count"),
+            ("retransmits", "get_retransmit_counter"), ("reordered", "get_reordered_count")]
+RATES = [("syn_rate", "get_syn_mean_rate"), ("est_rate", "get_est_mean_rate")]
+
+
+def parse_address(address):
+    """
+    "unix:/path/to/socket" or "host:port".
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class RemoteSummary(object):
+    """
+    Mergeable summary of a remote: cumulative counters, mean rates and histogram sketches.
+    Summaries from different hosts merge by adding them up, and expose the getters of TcpRemoteState
+    so they can be displayed by any reporter.
+    """
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.counters = dict((name, 0) for name, _ in COUNTERS)
+        self.rates = dict((name, 0.0) for name, _ in RATES)
+        self.sketches = dict((name, LogHistogram()) for name in SKETCHES)
+
+    @staticmethod
+    def from_remote(remote):
+        summary = RemoteSummary(display_name(remote.hostname))
+        for name, getter in COUNTERS:
+            summary.counters[name] = getattr(remote, getter)()
+        for name, getter in RATES:
+            summary.rates[name] = getattr(remote, getter)()
+        for name in SKETCHES:
+            summary.sketches[name].merge(remote.sketches[name])
+        return summary
+
+    def merge(self, other):
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, value in other.rates.items():
+            self.rates[name] += value
+        for name, sketch in other.sketches.items():
+            self.sketches[name].merge(sketch)
+
+    def write(self, writer):
+        writer.str(self.hostname)
+        for name, _ in COUNTERS:
+            writer.uint(self.counters[name])
+        for name, _ in RATES:
+            writer.float(self.rates[name])
+        for name in SKETCHES:
+            self.sketches[name].write(writer)
+
+    @staticmethod
+    def read(reader):
+        summary = RemoteSummary(reader.str())
+        for name, _ in COUNTERS:
+            summary.counters[name] = reader.uint()
+        for name, _ in RATES:
+            summary.rates[name] = reader.float()
+        for name in SKETCHES:
+            summary.sketches[name] = LogHistogram.read(reader)
+        return summary
+
+    def get_syn_count(self):
+        return self.counters["syn"]
+
+    def get_syn_mean_rate(self):
+        return self.rates["syn_rate"]
+
+    def get_syn_ack_count(self):
+        return self.counters["syn_ack"]
+
+    def get_est_count(self):
+        return self.counters["est"]
+
+    def get_rst_count(self):
+        return self.counters["rst"]
+
+    def get_fin_out_count(self):
+        return self.counters["fin_out"]
+
+    def get_fin_in_count(self):
+        return self.counters["fin_in"]
+
+    def get_est_mean_rate(self):
+        return self.rates["est_rate"]
+
+    def get_retransmit_counter(self):
+        return self.counters["retransmits"]
+
+    def get_conn_latency_mean(self):
+        return self.sketches[HISTOGRAM_CONN].mean()
+
+    def get_conn_latency_95th(self):
+        return self.sketches[HISTOGRAM_CONN].percentile(95)
+
+    def get_conn_latency_min(self):
+        return self.sketches[HISTOGRAM_CONN].min or 0
+
+    def get_conn_latency_max(self):
+        return self.sketches[HISTOGRAM_CONN].max or 0
+
+    def get_transport_rtt_95th(self):
+        return self.sketches[HISTOGRAM_TRANSPORT].percentile(95)
+
+    def get_transport_ttlb_95th(self):
+        return self.sketches[HISTOGRAM_TTLB].percentile(95)
+
+    def get_incoming_count(self):
+        return self.counters["incoming"]
+
+    def get_outgoing_count(self):
+        return self.counters["out"]
+
+    def get_rt_per_conn_95th(self):
+        sketch = self.sketches[HISTOGRAM_RT_PER_CONN]
+        return sketch.percentile(95) if sketch.count > 0 else '*'
+
+    def get_pkt_err_count(self):
+        return self.counters["err"]
+
+    def get_reordered_count(self):
+        return self.counters["reordered"]
+
+
+def encode_summaries(agent_id, sequence, capture_ts, summaries):
+    writer = BinaryWriter()
+    writer.uint(VERSION)
+    writer.str(agent_id)
+    writer.uint(sequence)
+    writer.value(capture_ts)
+    writer.uint(len(summaries))
+    for summary in summaries:
+        summary.write(writer)
+
+    payload = zlib.compress(writer.getvalue())
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_summaries(payload):
+    reader = BinaryReader(zlib.decompress(payload))
+    version = reader.uint()
+    if version != VERSION:
+        raise ValueError("Unsupported summary version {0}".format(version))
+
+    agent_id = reader.str()
+    sequence = reader.uint()
+    capture_ts = reader.value()
+    summaries = [RemoteSummary.read(reader) for _ in range(reader.uint())]
+    return agent_id, sequence, capture_ts, summaries
+
+
+class SummaryAgent(object):
+    """
+    Ships the summaries of every remote tracked by @analyzer to a SummaryAggregator every @interval secs.
+    Summaries are cumulative, so the bandwidth depends on the number of remotes (bounded with
+    OutgoingTCPAnalyzer max_tracked_remotes) and not on the packet rate, and a lost message is simply
+    superseded by the next one.
+    """
+
+    def __init__(self, analyzer, address, interval=5, agent_id=None):
+        self.analyzer = analyzer
+        self.family, self.address = parse_address(address)
+        self.interval = interval
+        self.agent_id = agent_id or "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.sequence = 0
+        self.socket = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="trtop-agent")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.send()
+
+    def send(self):
+        summaries = [RemoteSummary.from_remote(remote) for remote in self.analyzer.tracked_remotes.values()]
+        self.sequence += 1
+        frame = encode_summaries(self.agent_id, self.sequence, getattr(self.analyzer, 'last_timestamp', None),
+                                 summaries)
+        try:
+            if self.socket is None:
+                self.socket = socket.socket(self.family, socket.SOCK_STREAM)
+                self.socket.connect(self.address)
+            self.socket.sendall(frame)
+            return True
+        except socket.error, e:
+            logging.warning("Unable to ship summaries to aggregator {0}: {1}".format(self.address, e))
+            self._close()
+            return False
+
+    def _close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+
+        self.send()
+        self._close()
+
+
+class SummaryAggregator(BaseAnalyser):
+    """
+    Merges the summaries shipped by any number of SummaryAgent into fleet-wide remotes.
+    Acts as the analyzer of an ordinary reporter (tracked_remotes, set_observer), and as its collector
+    as start() serves agents on the calling thread until stop().
+    Agents silent for @agent_ttl secs are forgotten, so the summaries of a restarted agent are not counted twice,
+    and remotes no agent reports any more are evicted.
+    """
+
+    def __init__(self, address, agent_ttl=AGENT_TTL, clock=WALL_CLOCK):
+        BaseAnalyser.__init__(self)
+        self.family, self.address = parse_address(address)
+        self.agent_ttl = agent_ttl
+        self.clock = clock
+        self.tracked_remotes = {}
+        self.agents = {}
+        self.last_seen = {}
+        self.observer = None
+        self.last_timestamp = None
+        self.server = None
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def set_observer(self, observer):
+        self.observer = observer
+
+    def merge(self, agent_id, capture_ts, summaries):
+        with self.lock:
+            now = self.clock.now()
+            hostnames = self._expire(now)
+            previous = self.agents.get(agent_id, {})
+            self.agents[agent_id] = dict((summary.hostname, summary) for summary in summaries)
+            self.last_seen[agent_id] = now
+            if capture_ts is not None and (self.last_timestamp is None or
+                                           float(capture_ts) > float(self.last_timestamp)):
+                self.last_timestamp = capture_ts
+
+            self._remerge(hostnames | set(previous.keys()) | set(self.agents[agent_id].keys()))
+
+    def expire(self):
+        with self.lock:
+            self._remerge(self._expire(self.clock.now()))
+
+    def _expire(self, now):
+        """
+        Forgets the agents silent for agent_ttl secs before @now, returning the hostnames they reported.
+        """
+        hostnames = set()
+        for agent_id, last_seen in self.last_seen.items():
+            if now - last_seen > self.agent_ttl:
+                logging.info("Agent %s silent for %d secs, forgotten", agent_id, now - last_seen)
+                del self.last_seen[agent_id]
+                hostnames.update(self.agents.pop(agent_id).keys())
+
+        return hostnames
+
+    def _remerge(self, hostnames):
+        for hostname in hostnames:
+            reported = [agent_summaries[hostname] for agent_summaries in self.agents.values()
+                        if hostname in agent_summaries]
+            if not reported:
+                evicted = self.tracked_remotes.pop(hostname, None)
+                if evicted is not None and self.observer is not None:
+                    self.observer.handle_remote_evicted(evicted)
+                continue
+
+            merged = RemoteSummary(hostname)
+            for summary in reported:
+                merged.merge(summary)
+
+            self.tracked_remotes[hostname] = merged
+            if self.observer is not None:
+                self.observer.handle_remote_event(merged)
+
+    def _expire_periodically(self):
+        # Agents may all go silent, with no summaries left to trigger the expiry
+        while not self._stopped.wait(self.agent_ttl / 2.0):
+            self.expire()
+
+    def bind(self):
+        if self.family == socket.AF_UNIX:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.server = _UnixAggregatorServer(self.address, _AggregatorRequestHandler)
+        else:
+            self.server = _TCPAggregatorServer(self.address, _AggregatorRequestHandler)
+            self.address = self.server.server_address
+
+        self.server.aggregator = self
+        logging.info("Aggregator listening on %s", str(self.address))
+
+    def start(self):
+        if self.server is None:
+            self.bind()
+        expiry = threading.Thread(target=self._expire_periodically, name="trtop-agent-expiry")
+        expiry.daemon = True
+        expiry.start()
+        self.server.serve_forever()
+
+    def stop(self):
+        self._stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class _AggregatorRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            header = self.rfile.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+
+            length, = FRAME_HEADER.unpack(header)
+            if length > MAX_FRAME_SIZE:
+                logging.warning("Dropping agent connection, frame of {0} bytes".format(length))
+                return
+
+            payload = self.rfile.read(length)
+            if len(payload) < length:
+                return
+
+            try:
+                agent_id, sequence, capture_ts, summaries = decode_summaries(payload)
+            except Exception, e:
+                logging.exception("Invalid summaries from agent")
+                return
+
+            logging.debug("Summaries #%d from agent %s (%d remotes)", sequence, agent_id, len(summaries))
+            self.server.aggregator.merge(agent_id, capture_ts, summaries)
+
+
+class _TCPAggregatorServer(SocketServer.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixAggregatorServer(SocketServer.ThreadingUnixStreamServer):
+
+    daemon_threads = True
@@ -11,30 +11,78 @@ import sys
 import logging
 import traceback
 from state import *
+from heavyhitters import SpaceSaving, other_bucket
+from clock import WALL_CLOCK
 
 
 class OutgoingTCPAnalyzer(BaseAnalyser):
     """
     TCP Packet analyzing
     Outgoing connections only, initiated after monitoring started!
+
+    When @max_tracked_remotes is set, full TcpRemoteState is only kept for the top remotes by packet
+    count (estimated with a Space-Saving summary), the long tail is folded in the remotes returned
+    by @overflow_bucket (see heavyhitters.py), keeping memory fixed regardless of remote cardinality.
+
+    When a @sampler is set (see sampling.py), only the flows it admits are analyzed.
+    The @clock is advanced with every packet and drives the mean rates of the remotes (see clock.py).
+    Once a recorder is set, every processed packet is recorded to the ring of its connection (see outliers.py).
+    Once a sink is set, every latency sample is appended to it (see samples.py).
+    Sessions idle for @session_timeout secs of capture time are forgotten, checked every SWEEP_INTERVAL secs.
     """
 
-    def __init__(self, whitelist, resolver):
+    HEAVY_HITTERS_CAPACITY_FACTOR = 4
+    SESSION_TIMEOUT = 600  # Secs
+    SWEEP_INTERVAL = 60  # Secs
+
+    def __init__(self, whitelist, resolver, max_tracked_remotes=None, overflow_bucket=other_bucket, sampler=None,
+                 clock=WALL_CLOCK, session_timeout=SESSION_TIMEOUT):
         BaseAnalyser.__init__(self)
         self.tracked_remotes = {}
         self.whitelist = whitelist
         self.resolver = resolver
         self.observer = None
+        self.max_tracked_remotes = max_tracked_remotes
+        self.overflow_bucket = overflow_bucket
+        self.overflow_remotes = set()
+        self.heavy_hitters = SpaceSaving(max_tracked_remotes * OutgoingTCPAnalyzer.HEAVY_HITTERS_CAPACITY_FACTOR) \
+            if max_tracked_remotes else None
+        self._weakest_remote = None
+        self._weakest_estimate = None
+        self.sampler = sampler
+        self.clock = clock
+        self.session_timeout = session_timeout
+        self._next_sweep = None
+        self.recorder = None
+        self.sink = None
+        self.last_timestamp = None
 
     def set_observer(self, observer):
         logging.debug("Observer is now %s", observer)
         self.observer = observer
 
+    def set_recorder(self, recorder):
+        self.recorder = recorder
+        for tcp_remote in self.tracked_remotes.values():
+            tcp_remote.recorder = recorder
+
+    def set_sink(self, sink):
+        self.sink = sink
+        for tcp_remote in self.tracked_remotes.values():
+            tcp_remote.sink = sink
+
     def notify_observer(self, tcp_remote):
         self.observer.handle_remote_event(tcp_remote)
 
+    def notify_observer_evicted(self, tcp_remote):
+        self.observer.handle_remote_evicted(tcp_remote)
+
     def analyse(self, unified_packet):
         logging.debug("Analyzing %s", unified_packet)
+        self.last_timestamp = unified_packet.timestamp
+        self.clock.advance(unified_packet.timestamp)
+        if self.session_timeout is not None:
+            self._sweep(float(unified_packet.timestamp))
 
         try:
             # TODO handle DNS traffic separate functions
@@ -42,12 +90,22 @@ class OutgoingTCPAnalyzer(BaseAnalyser):
             tcp_remote = self.tracked_remotes.get(hostname)
             logging.debug("Packet remote resolved to: %s", str(hostname))
 
-            if tcp_remote is None:
-                if not self.whitelist.allow(unified_packet.remote_ip(), unified_packet.remote_port()):
-                    return
+            if tcp_remote is None and \
+                    not self.whitelist.allow(unified_packet.remote_ip(), unified_packet.remote_port()):
+                return
+
+            # Only whitelisted remotes take counters, other traffic would inflate the error of those tracked
+            if self.heavy_hitters is not None:
+                forgotten = self.heavy_hitters.offer(hostname)
+                if forgotten is not None and forgotten in self.tracked_remotes:
+                    self._weakest_remote = None  # A tracked remote no longer monitored now weighs nothing
 
-                tcp_remote = TcpRemoteState(hostname)
-                self.tracked_remotes[hostname] = tcp_remote
+            if self.sampler is not None and not self.sampler.admit(
+                    unified_packet, tcp_remote is not None and unified_packet.ephemeral_port() in tcp_remote.states):
+                return
+
+            if tcp_remote is None:
+                tcp_remote = self._track_remote(hostname, unified_packet)
 
             if self._handle_action(tcp_remote, unified_packet) and self.observer is not None:
                 self.notify_observer(tcp_remote)
@@ -57,29 +115,84 @@ class OutgoingTCPAnalyzer(BaseAnalyser):
             logging.exception(e, exc_info=True)
             raise e
 
-    def _handle_action(self, tcp_remote, unified_packet):
-        if not tcp_remote.verify_and_track_seq(unified_packet):
+    def _sweep(self, now):
+        if self._next_sweep is None:
+            self._next_sweep = now + OutgoingTCPAnalyzer.SWEEP_INTERVAL
+        elif now >= self._next_sweep:
+            self._next_sweep = now + OutgoingTCPAnalyzer.SWEEP_INTERVAL
+            expired = sum(tcp_remote.expire_sessions(now, self.session_timeout)
+                          for tcp_remote in self.tracked_remotes.values())
+            if expired:
+                logging.info("Expired %d idle sessions", expired)
+
+    def _track_remote(self, hostname, unified_packet):
+        if self.heavy_hitters is not None and \
+                len(self.tracked_remotes) - len(self.overflow_remotes) >= self.max_tracked_remotes:
+            if not self._promote(hostname):
+                return self._overflow_remote(unified_packet.remote_ip(), unified_packet.remote_port(), hostname)
+
+        tcp_remote = TcpRemoteState(hostname, self.clock)
+        tcp_remote.recorder = self.recorder
+        tcp_remote.sink = self.sink
+        self.tracked_remotes[hostname] = tcp_remote
+        if getattr(self.resolver, 'ASYNC', False):
+            self.resolver.resolve_async(unified_packet.remote_ip(), unified_packet.remote_port(),
+                                        lambda addr, name: self._dns_resolved(hostname, name))
+        return tcp_remote
+
+    def _overflow_remote(self, addr, port, hostname):
+        bucket = self.overflow_bucket(addr, port, hostname)
+        tcp_remote = self.tracked_remotes.get(bucket)
+        if tcp_remote is None:
+            tcp_remote = TcpRemoteState(bucket, self.clock)
+            tcp_remote.recorder = self.recorder
+            tcp_remote.sink = self.sink
+            self.tracked_remotes[bucket] = tcp_remote
+            self.overflow_remotes.add(bucket)
+
+        return tcp_remote
+
+    def _promote(self, hostname):
+        """
+        Replaces the weakest fully tracked remote with @hostname, if the latter is heavier.
+        The weakest remote is cached with its estimate, and only re-computed once that estimate changed, so the
+        long tail costs O(1) per packet. Estimates of the other remotes only grow, or drop when they are no longer
+        monitored which invalidates the cache (see analyse), so the cached remote stays the weakest until then.
+        """
+        count = self.heavy_hitters.guaranteed(hostname)
+        if self._weakest_remote is None or \
+                self.heavy_hitters.estimate(self._weakest_remote) != self._weakest_estimate:
+            self._weakest_remote = min((name for name in self.tracked_remotes if name not in self.overflow_remotes),
+                                       key=self.heavy_hitters.estimate)
+            self._weakest_estimate = self.heavy_hitters.estimate(self._weakest_remote)
+
+        if count <= self._weakest_estimate:
             return False
 
-        action = {
-            'S': lambda: tcp_remote.process_syn(unified_packet),
-            'S.': lambda: tcp_remote.process_syn_ack(unified_packet),
-
-            '.': lambda: tcp_remote.process_ack(unified_packet),
+        evicted = self.tracked_remotes.pop(self._weakest_remote)
+        logging.debug("Remote %s evicted by heavier remote %s", str(evicted.hostname), str(hostname))
+        evicted.release()
+        self._weakest_remote = None
+        if self.observer is not None:
+            self.notify_observer_evicted(evicted)
 
-            'R': lambda: tcp_remote.process_rst(unified_packet),
-            'R.': lambda: tcp_remote.process_rst(unified_packet),
-
-            'P': lambda: tcp_remote.process_psh(unified_packet),
-            'P.': lambda: tcp_remote.process_psh(unified_packet),
-
-            'FP.': lambda: tcp_remote.process_psh(unified_packet, fin=True),
-            'F.': lambda: tcp_remote.process_fin(unified_packet),
-            'F': lambda: tcp_remote.process_fin(unified_packet)
-        }.get(unified_packet.flags)
+        return True
 
+    def _handle_action(self, tcp_remote, unified_packet):
         logging.debug("Packet action identifier %s", str(unified_packet.flags))
-        return action() if action is not None else False
+        return tcp_remote.process(unified_packet)
 
     def _dns_resolved(self, host, hostname):
-        self.tracked_remotes[host].hostname = hostname
\ No newline at end of file
+        """
+        Renames the remote tracked as @host once its name is resolved, see resolver.AsyncResolver.
+        The remote keeps being tracked as @host, observers see it replaced by its renamed self.
+        """
+        tcp_remote = self.tracked_remotes.get(host)
+        if tcp_remote is None or not hostname or tcp_remote.hostname == hostname:
+            return
+
+        if self.observer is not None:
+            self.notify_observer_evicted(tcp_remote)
+        tcp_remote.hostname = hostname
+        if self.observer is not None:
+            self.notify_observer(tcp_remote)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import os
+import time
+import zlib
+import logging
+import threading
+
+from codec import BinaryWriter, BinaryReader
+from state import TcpRemoteState, TcpSessionState, SKETCHES
+from windows import LogHistogram
+from clock import WALL_CLOCK, WallClock
+
+__author__ = 'Thomas Kountis'
+
+
+MAGIC = "TRTC"
+VERSION = 7
+
+METERS = ["syn_counter", "syn_ack_counter", "est_counter", "resets_counter", "fin_in_counter", "fin_out_counter",
+          "outgoing_packets", "incoming_packets"]
+COUNTERS = ["pkt_err_counter", "retransmits_counter", "reordered_counter"]
+HISTOGRAMS = ["connection_time", "transport_time", "rt_per_conn_counter", "ttlb_time"]
+EWMAS = ["m1", "m5", "m15", "day"]
+
+
+def dump(analyzer):
+    """
+    Encodes the tracked remotes of @analyzer, with their open sessions, meters, histograms, sketches and
+    sliding windows.
+    The analyzer is not paused, so remotes are copied one at a time and may be a few packets apart.
+    """
+    now = time.time()
+    writer = BinaryWriter()
+    writer.float(now)
+    writer.value(analyzer.last_timestamp)
+
+    remotes = analyzer.tracked_remotes.items()
+    overflow_remotes = getattr(analyzer, 'overflow_remotes', ())
+    writer.uint(len(remotes))
+    for hostname, remote in remotes:
+        writer.value(hostname)  # An address, or a name once resolved
+        writer.value(hostname in overflow_remotes)
+        _dump_remote(writer, remote, now)
+
+    payload = zlib.compress(writer.getvalue())
+    header = BinaryWriter()
+    header.chunks.append(MAGIC)
+    header.uint(VERSION)
+    header.uint(zlib.crc32(payload) & 0xffffffff)
+    return header.getvalue() + payload
+
+
+def load(analyzer, data):
+    """
+    Restores into @analyzer the remotes encoded with dump().
+    Returns the number of restored remotes.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a trtop checkpoint")
+
+    header = BinaryReader(data)
+    header.offset = len(MAGIC)
+    version = header.uint()
+    if version != VERSION:
+        raise ValueError("Unsupported checkpoint version {0}".format(version))
+
+    crc = header.uint()
+    payload = data[header.offset:]
+    if zlib.crc32(payload) & 0xffffffff != crc:
+        raise ValueError("Corrupted checkpoint")
+
+    reader = BinaryReader(zlib.decompress(payload))
+    age = time.time() - reader.float()
+    analyzer.last_timestamp = reader.value()
+    clock = getattr(analyzer, 'clock', WALL_CLOCK)
+    if analyzer.last_timestamp is not None:
+        clock.advance(analyzer.last_timestamp)
+
+    count = reader.uint()
+    for _ in range(count):
+        hostname = reader.value()
+        overflow = reader.value()
+        remote = analyzer.tracked_remotes.get(hostname)
+        if remote is not None:
+            remote.release()
+
+        remote = TcpRemoteState(hostname, clock)
+        remote.recorder = getattr(analyzer, 'recorder', None)
+        remote.sink = getattr(analyzer, 'sink', None)
+        _load_remote(reader, remote, age)
+        analyzer.tracked_remotes[hostname] = remote
+        if overflow:
+            analyzer.overflow_remotes.add(hostname)
+
+    return count
+
+
+def save(analyzer, filename):
+    """
+    Writes a checkpoint of @analyzer, atomically replacing @filename.
+    """
+    data = dump(analyzer)
+    tmp_filename = "{0}.tmp".format(filename)
+    with open(tmp_filename, 'wb') as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+
+    os.rename(tmp_filename, filename)
+    return len(data)
+
+
+def restore(analyzer, filename):
+    with open(filename, 'rb') as checkpoint:
+        return load(analyzer, checkpoint.read())
+
+
+def _dump_remote(writer, remote, now):
+    writer.float(remote.clock.now() - remote.started_on)
+    for name in METERS:
+        meter = getattr(remote, name)
+        writer.uint(meter.count)
+        writer.float(now - meter.started_on)
+        for ewma in EWMAS:
+            writer.float(getattr(meter, ewma).rate)
+
+    for name in COUNTERS:
+        writer.sint(getattr(remote, name).value)
+
+    for name in HISTOGRAMS:
+        reservoir = getattr(remote, name).reservoir
+        values = list(reservoir.values)  # The analyzer keeps adding to it while dumping
+        writer.uint(reservoir.count)
+        writer.uint(len(values))
+        for value in values:
+            writer.float(value)
+
+    for name in SKETCHES:
+        remote.sketches[name].write(writer)
+
+    windows = remote.windows.windows.items()
+    writer.uint(len(windows))
+    for name, window in windows:
+        writer.str(name)
+        _dump_window(writer, window)
+
+    sessions = remote.states.items()
+    writer.uint(len(sessions))
+    for port, session in sessions:
+        writer.uint(port)
+        attributes = [(key, value) for key, value in session.__dict__.items() if _is_primitive(value)]
+        writer.uint(len(attributes))
+        for key, value in attributes:
+            writer.str(key)
+            writer.value(value)
+
+
+def _load_remote(reader, remote, age):
+    # Wall clock time went by since the checkpoint, capture clock time resumes where it was
+    remote.started_on = remote.clock.now() - reader.float() - (age if isinstance(remote.clock, WallClock) else 0)
+    for name in METERS:
+        meter = getattr(remote, name)
+        meter.count = reader.uint()
+        meter.started_on = time.time() - age - reader.float()
+        for ewma in EWMAS:
+            getattr(meter, ewma).rate = reader.float()
+            getattr(meter, ewma).initialized = True
+
+    for name in COUNTERS:
+        getattr(remote, name).value = reader.sint()
+
+    for name in HISTOGRAMS:
+        reservoir = getattr(remote, name).reservoir
+        total = reader.uint()
+        for _ in range(reader.uint()):
+            reservoir.add(reader.float())
+        reservoir.count = max(reservoir.count, total)
+
+    for name in SKETCHES:
+        remote.sketches[name] = LogHistogram.read(reader)
+
+    for _ in range(reader.uint()):
+        name = reader.str()
+        window = remote.windows.windows.get(name)
+        _load_window(reader, window)
+
+    for _ in range(reader.uint()):
+        port = reader.uint()
+        session = TcpSessionState(None)
+        for _ in range(reader.uint()):
+            key = reader.str()
+            setattr(session, key, reader.value())
+        remote.states[port] = session
+
+
+def _dump_window(writer, window):
+    writer.value(window.latest_epoch)
+    writer.uint(window.slots)
+    for index in range(window.slots):
+        writer.value(window.epochs[index])
+        counters = window.counters[index].items()
+        writer.uint(len(counters))
+        for name, count in counters:
+            writer.str(name)
+            writer.uint(count)
+
+        histograms = [(name, histogram) for name, histogram in window.histograms[index].items() if histogram.count]
+        writer.uint(len(histograms))
+        for name, histogram in histograms:
+            writer.str(name)
+            histogram.write(writer)
+
+
+def _load_window(reader, window):
+    latest_epoch = reader.value()
+    slots = reader.uint()
+    for index in range(slots):
+        epoch = reader.value()
+        counters = dict((reader.str(), reader.uint()) for _ in range(reader.uint()))
+        histograms = {}
+        for _ in range(reader.uint()):
+            name = reader.str()
+            histograms[name] = LogHistogram.read(reader)
+
+        if window is not None and slots == window.slots:
+            window.epochs[index] = epoch
+            window.counters[index] = counters
+            window.histograms[index] = histograms
+
+    if window is not None and slots == window.slots:
+        window.latest_epoch = latest_epoch
+
+
+def _is_primitive(value):
+    return value is None or isinstance(value, (bool, int, long, float, basestring))
+
+
+class Checkpointer(object):
+    """
+    Periodically checkpoints the analyzer state to @filename from a background thread.
+    When @restore is set, start() first restores a previously written checkpoint, if any.
+    """
+
+    def __init__(self, analyzer, filename, interval=60, restore=True):
+        self.analyzer = analyzer
+        self.filename = filename
+        self.interval = interval
+        self.restore = restore
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.restore and os.path.exists(self.filename):
+            try:
+                count = restore(self.analyzer, self.filename)
+                logging.info("Restored %d remotes from checkpoint %s", count, self.filename)
+            except Exception, e:
+                logging.exception("Unable to restore checkpoint {0}".format(self.filename))
+
+        self._thread = threading.Thread(target=self._run, name="trtop-checkpointer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        try:
+            size = save(self.analyzer, self.filename)
+            logging.debug("Checkpoint written to %s (%d bytes)", self.filename, size)
+        except Exception, e:
+            logging.exception("Unable to write checkpoint {0}".format(self.filename))
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+
+        self.checkpoint()
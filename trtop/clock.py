@@ -0,0 +1,76 @@
+import time
+
+__author__ = 'Thomas Kountis'
+
+
+class BaseClock(object):
+    """
+    Source of "now" for the analyzer state and the reporters, advanced with the timestamp of every
+    analyzed packet.
+    """
+
+    def now(self):
+        pass
+
+    def advance(self, timestamp):
+        pass
+
+
+class WallClock(BaseClock):
+    """
+    Wall time, for live captures where packets are analyzed as they arrive.
+    """
+
+    def now(self):
+        return time.time()
+
+
+class CaptureClock(BaseClock):
+    """
+    Capture time, the timestamp of the latest packet, so rates are per second of capture however fast
+    it is replayed. Packets are analyzed as fast as possible.
+    """
+
+    def __init__(self):
+        self.timestamp = None
+
+    def now(self):
+        return self.timestamp if self.timestamp is not None else 0.0
+
+    def advance(self, timestamp):
+        timestamp = float(timestamp)
+        if self.timestamp is None or timestamp > self.timestamp:
+            self.timestamp = timestamp
+
+
+class PacedCaptureClock(CaptureClock):
+    """
+    Capture time replayed at @speed times the capture pace. Collectors hold every packet back until it is due,
+    see delay(), so the analyzer never blocks, eg. the runtime loop it runs on.
+    """
+
+    def __init__(self, speed=1.0):
+        CaptureClock.__init__(self)
+        self.speed = float(speed)
+        self._origin = None
+
+    def delay(self, timestamp):
+        """
+        Wall secs until the packet of @timestamp is due, the first packet being due right away.
+        """
+        timestamp = float(timestamp)
+        if self._origin is None:
+            self._origin = (time.time(), timestamp)
+            return 0.0
+
+        return self._origin[0] + (timestamp - self._origin[1]) / self.speed - time.time()
+
+
+WALL_CLOCK = WallClock()
+
+
+def build_clock(speed):
+    """
+    The capture clock replaying at @speed times the capture pace, or as fast as possible when @speed is 0.
+    """
+    return PacedCaptureClock(speed) if speed else CaptureClock()
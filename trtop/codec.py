@@ -0,0 +1,122 @@
+import struct
+
+__author__ = 'Thomas Kountis'
+
+
+TAG_NONE = 0
+TAG_INT = 1
+TAG_FLOAT = 2
+TAG_STR = 3
+TAG_BOOL = 4
+
+
+class BinaryWriter(object):
+    """
+    Minimal big-endian binary encoder shared by the checkpoint, index and summary formats.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def uint(self, value):
+        # Unsigned LEB128 varint, small counters take a single byte
+        value = int(value)
+        out = bytearray()
+        while True:
+            byte = value & 0x7f
+            value >>= 7
+            if value:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                break
+        self.chunks.append(bytes(out))
+
+    def sint(self, value):
+        value = int(value)
+        self.uint((value << 1) if value >= 0 else ((-value << 1) - 1))
+
+    def float(self, value):
+        self.chunks.append(struct.pack("!d", value))
+
+    def str(self, value):
+        data = value.encode("utf-8") if isinstance(value, unicode) else str(value)
+        self.uint(len(data))
+        self.chunks.append(data)
+
+    def value(self, value):
+        """
+        Tagged primitive: None, bool, int, float or str.
+        """
+        if value is None:
+            self.uint(TAG_NONE)
+        elif isinstance(value, bool):
+            self.uint(TAG_BOOL)
+            self.uint(1 if value else 0)
+        elif isinstance(value, (int, long)):
+            self.uint(TAG_INT)
+            self.sint(value)
+        elif isinstance(value, float):
+            self.uint(TAG_FLOAT)
+            self.float(value)
+        elif isinstance(value, basestring):
+            self.uint(TAG_STR)
+            self.str(value)
+        else:
+            raise TypeError("Unsupported value type {0}".format(type(value).__name__))
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+class BinaryReader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def uint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = ord(self.data[self.offset])
+            self.offset += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    def sint(self):
+        value = self.uint()
+        return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+    def float(self):
+        value, = struct.unpack_from("!d", self.data, self.offset)
+        self.offset += 8
+        return value
+
+    def str(self):
+        length = self.uint()
+        value = self.data[self.offset:self.offset + length]
+        if len(value) != length:
+            raise ValueError("Truncated input at offset {0}".format(self.offset))
+        self.offset += length
+        return value
+
+    def value(self):
+        tag = self.uint()
+        if tag == TAG_NONE:
+            return None
+        elif tag == TAG_BOOL:
+            return self.uint() == 1
+        elif tag == TAG_INT:
+            return self.sint()
+        elif tag == TAG_FLOAT:
+            return self.float()
+        elif tag == TAG_STR:
+            return self.str()
+
+        raise ValueError("Unknown value tag {0} at offset {1}".format(tag, self.offset))
+
+    def at_end(self):
+        return self.offset >= len(self.data)
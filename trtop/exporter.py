@@ -0,0 +1,170 @@
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+import SocketServer
+import BaseHTTPServer
+from StringIO import StringIO
+from email.utils import formatdate
+
+from reporter import BaseReporter
+from state import snapshot
+
+__author__ = 'Thomas Kountis'
+
+
+# (snapshot key, metric name, type, help)
+METRICS = [
+    ("syn", "trtop_syn_total", "counter", "Attempted outgoing connections."),
+    ("syn_ack", "trtop_syn_ack_total", "counter", "Connection attempts acknowledged by the remote."),
+    ("est", "trtop_established_total", "counter", "Established connections (3-way handshake)."),
+    ("rst", "trtop_resets_total", "counter", "Reset connections."),
+    ("fin_out", "trtop_fin_out_total", "counter", "Locally initiated connection closes."),
+    ("fin_in", "trtop_fin_in_total", "counter", "Remotely initiated connection closes."),
+    ("out", "trtop_requests_total", "counter", "Outgoing requests."),
+    ("incoming", "trtop_responses_total", "counter", "Incoming responses."),
+    ("err", "trtop_packet_errors_total", "counter", "Invalid packet sequences, eg. due to dropped packets."),
+    ("retransmits", "trtop_retransmits_total", "counter", "Retransmitted segments."),
+    ("reordered", "trtop_reordered_total", "counter", "Out of order packets recovered by the reorder window."),
+    ("conn_latency_mean", "trtop_connection_latency_mean_ms", "gauge", "Mean connection latency."),
+    ("conn_latency_95th", "trtop_connection_latency_95th_ms", "gauge", "95th percentile of connection latency."),
+    ("rtt_95th", "trtop_transport_latency_95th_ms", "gauge", "95th percentile of time to first response byte."),
+    ("ttlb_95th", "trtop_transport_ttlb_95th_ms", "gauge", "95th percentile of time to last response byte."),
+]
+
+CONTENT_TYPE_TEXT = "text/plain; version=0.0.4; charset=utf-8"
+CONTENT_TYPE_JSON = "application/json"
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_text(snapshots):
+    lines = []
+    for key, name, kind, description in METRICS:
+        lines.append("# HELP {0} {1}".format(name, description))
+        lines.append("# TYPE {0} {1}".format(name, kind))
+        for entry in snapshots:
+            lines.append("{0}{{host=\"{1}\"}} {2}".format(name, _escape_label(entry['host']), float(entry[key])))
+
+    return "\n".join(lines) + "\n"
+
+
+class Exposition(object):
+    """
+    A pre-rendered response body, in plain and gzip encodings, with their validators. Each encoding has its own
+    ETag, the gzip one suffixed with "-gz", as caches must not serve one encoding for the other.
+    """
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.md5(body).hexdigest()
+        self.etag = '"{0}"'.format(digest)
+        self.gzipped_etag = '"{0}-gz"'.format(digest)
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as compressed:
+            compressed.write(body)
+        self.gzipped = buf.getvalue()
+
+
+class PrometheusExporterReporter(BaseReporter):
+    """
+    Serves the per-remote statistics over HTTP, in the Prometheus text format on /metrics and as JSON on
+    /metrics.json. A background tick re-renders both expositions from the state layer every @interval secs,
+    so a scrape only copies a pre-computed buffer and never touches the analyzer state.
+    Supports gzip (Accept-Encoding) and conditional requests (If-None-Match).
+    """
+
+    def __init__(self, analyzer, host="127.0.0.1", port=9469, interval=5):
+        BaseReporter.__init__(self)
+        self.analyzer = analyzer
+        self.address = (host, port)
+        self.interval = interval
+        self.expositions = {}
+        self.server = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def tick(self):
+        snapshots = [snapshot(remote) for remote in self.analyzer.tracked_remotes.values()]
+        snapshots.sort(key=lambda entry: entry['host'])
+        # Single assignment, readers see either the previous or the new expositions
+        self.expositions = {
+            "/metrics": Exposition(render_text(snapshots), CONTENT_TYPE_TEXT),
+            "/metrics.json": Exposition(json.dumps(snapshots, sort_keys=True), CONTENT_TYPE_JSON)
+        }
+
+    def _run_ticks(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.tick()
+            except Exception, e:
+                logging.exception("Unable to render the metrics exposition")
+
+    def start(self):
+        self.tick()
+        self.server = _ExporterHTTPServer(self.address, _ExporterRequestHandler, self)
+        self.address = self.server.server_address
+        logging.info("Metrics exporter listening on %s:%d", *self.address)
+
+        for target, name in [(self.server.serve_forever, "trtop-exporter-http"),
+                             (self._run_ticks, "trtop-exporter-tick")]:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class _ExporterHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, exporter):
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+        self.exporter = exporter
+
+
+class _ExporterRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        exposition = self.server.exporter.expositions.get(self.path.split("?")[0])
+        if exposition is None:
+            self.send_error(404)
+            return
+
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        etag = exposition.gzipped_etag if gzipped else exposition.etag
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        body = exposition.gzipped if gzipped else exposition.body
+        self.send_response(200)
+        self.send_header("Content-Type", exposition.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Last-Modified", exposition.last_modified)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Exporter: " + format, *args)
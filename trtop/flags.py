@@ -0,0 +1,79 @@
+__author__ = 'Thomas Kountis'
+
+
+# TCP header flag bits
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+PSH = 0x08
+ACK = 0x10
+URG = 0x20
+ECE = 0x40
+CWR = 0x80
+
+# Letters of the tcpdump "Flags [S.]" notation, any other letter (eg. "none", or "e" of AccECN) sets no bit
+LETTERS = {'F': FIN, 'S': SYN, 'R': RST, 'P': PSH, '.': ACK, 'U': URG, 'E': ECE, 'W': CWR}
+
+# Events of the session state machine (see state.TcpRemoteState.TRANSITIONS), every flag combination being one
+EVENT_SYN = 0
+EVENT_SYN_ACK = 1
+EVENT_ACK = 2
+EVENT_DATA = 3  # PSH, with or without ACK
+EVENT_FIN_DATA = 4  # FIN and PSH together
+EVENT_FIN = 5
+EVENT_RST = 6
+EVENT_INVALID = 7  # SYN with FIN or RST, or no flags at all
+EVENT_NAMES = ["SYN", "SYN-ACK", "ACK", "DATA", "FIN-DATA", "FIN", "RST", "INVALID"]
+
+MAX_CACHED = 1024  # Distinct flag notations, a handful in practice
+
+
+def classify(mask):
+    """
+    The event of the flag bits @mask. URG, ECE and CWR never change the event, eg. an ECN setup SYN is a SYN.
+    """
+    if mask & SYN:
+        if mask & (FIN | RST):
+            return EVENT_INVALID
+        return EVENT_SYN_ACK if mask & ACK else EVENT_SYN
+    if mask & RST:
+        return EVENT_RST
+    if mask & FIN:
+        return EVENT_FIN_DATA if mask & PSH else EVENT_FIN
+    if mask & PSH:
+        return EVENT_DATA
+    if mask & ACK:
+        return EVENT_ACK
+
+    return EVENT_INVALID
+
+
+# Precompiled event of every flag combination
+EVENTS = [classify(mask) for mask in range(256)]
+
+_events = {}
+
+
+def to_mask(flags):
+    """
+    The flag bits of the tcpdump notation @flags, eg. SYN | ACK for "S.".
+    """
+    mask = 0
+    for letter in flags:
+        mask |= LETTERS.get(letter, 0)
+
+    return mask
+
+
+def event_of(flags):
+    """
+    The event of the tcpdump notation @flags, computed once per distinct notation.
+    """
+    event = _events.get(flags)
+    if event is None:
+        if len(_events) >= MAX_CACHED:
+            _events.clear()
+
+        event = _events[flags] = EVENTS[to_mask(flags)]
+
+    return event
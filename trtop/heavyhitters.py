@@ -0,0 +1,116 @@
+__author__ = 'Thomas Kountis'
+
+
+OTHER_BUCKET = "*other*"
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving heavy hitter summary (Metwally, Agrawal, El Abbadi).
+    Monitors at most @capacity keys, each with an over-estimated count. A key that is not monitored
+    replaces the one with the smallest count and inherits it as its error, so memory stays fixed
+    however many distinct keys are offered. Counts are kept in a stream-summary (count -> keys)
+    so every offer is O(1).
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Space-Saving capacity must be positive, got {0}".format(capacity))
+
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.buckets = {}
+        self.min_count = 0
+
+    def offer(self, key):
+        """
+        Count a single occurrence of @key.
+        Returns the key that was replaced to make room for @key, if any.
+        """
+        count = self.counts.get(key)
+        evicted = None
+
+        if count is None:
+            if len(self.counts) < self.capacity:
+                count = 0
+                self.errors[key] = 0
+            else:
+                count = self.min_count
+                evicted = self._pop_min()
+                self.errors[key] = count
+        else:
+            self._unlink(key, count)
+
+        self.counts[key] = count + 1
+        self.buckets.setdefault(count + 1, set()).add(key)
+
+        if not self.min_count or count + 1 < self.min_count:
+            self.min_count = count + 1
+        elif count == self.min_count and count not in self.buckets:
+            self.min_count = count + 1
+
+        return evicted
+
+    def estimate(self, key):
+        """
+        Over-estimated count for @key, 0 if the key is not monitored.
+        """
+        return self.counts.get(key, 0)
+
+    def guaranteed(self, key):
+        """
+        Lower bound of the count for @key, 0 if the key is not monitored.
+        """
+        return self.counts.get(key, 0) - self.errors.get(key, 0)
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda entry: entry[1], reverse=True)[:n]
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _unlink(self, key, count):
+        bucket = self.buckets[count]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[count]
+
+    def _pop_min(self):
+        key = self.buckets[self.min_count].pop()
+        if not self.buckets[self.min_count]:
+            del self.buckets[self.min_count]
+
+        del self.counts[key]
+        del self.errors[key]
+        return key
+
+
+def other_bucket(addr, port, hostname):
+    """
+    Folds the whole long tail into a single aggregated remote.
+    """
+    return OTHER_BUCKET
+
+
+def subnet_bucket(addr, port, hostname):
+    """
+    Folds the long tail into per-/24 (per-/64 for IPv6) aggregated remotes.
+    """
+    from address import subnet
+
+    return subnet(addr)
+
+
+def port_bucket(addr, port, hostname):
+    """
+    Folds the long tail into per-remote-port aggregated remotes.
+    """
+    return "*:{0}".format(port)
+
+
+# Long tail buckets by their name on the command line
+BUCKETS = {"other": other_bucket, "subnet": subnet_bucket, "port": port_bucket}
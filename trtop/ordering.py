@@ -0,0 +1,73 @@
+from bisect import bisect_left, insort
+
+__author__ = 'Thomas Kountis'
+
+
+class IncrementalOrdering(object):
+    """
+    Keeps remotes sorted by a key function, re-positioning only the ones marked dirty since the last update.
+    An update costs O(d log n) for d dirty remotes, and reading a page costs the size of the page.
+    A @volatile key changes with time alone, eg. the mean rate of an idle remote decays, so every update then
+    re-keys every remote and rebuilds the ordering with a single sort, O(n log n).
+    """
+
+    def __init__(self, key, reverse=False, volatile=False):
+        self.key = key
+        self.reverse = reverse
+        self.volatile = volatile
+        self.entries = []
+        self.keys = {}
+        self.dirty = set()
+
+    def mark_dirty(self, hostname):
+        self.dirty.add(hostname)
+
+    def remove(self, hostname):
+        self.dirty.discard(hostname)
+        self._remove_entry(hostname)
+
+    def update(self, remotes):
+        if self.volatile:
+            self.keys = dict((hostname, self.key(remote)) for hostname, remote in remotes.items())
+            self.entries = sorted((key, hostname) for hostname, key in self.keys.items())
+            self.dirty.clear()
+            return
+
+        for hostname in self.dirty:
+            remote = remotes.get(hostname)
+            self._remove_entry(hostname)
+            if remote is not None:
+                key = self.key(remote)
+                self.keys[hostname] = key
+                insort(self.entries, (key, hostname))
+
+        self.dirty.clear()
+
+    def resort(self, key, remotes, volatile=False):
+        """
+        Changes the sort key, re-computing the position of every remote.
+        """
+        self.key = key
+        self.volatile = volatile
+        self.keys = {}
+        self.entries = []
+        self.dirty = set(remotes.keys())
+        self.update(remotes)
+
+    def page(self, offset, size):
+        """
+        Hostnames in positions [@offset, @offset + @size) of the ordering.
+        """
+        if not self.reverse:
+            return [hostname for _, hostname in self.entries[offset:offset + size]]
+
+        end = len(self.entries) - offset
+        return [hostname for _, hostname in reversed(self.entries[max(0, end - size):max(0, end)])]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove_entry(self, hostname):
+        key = self.keys.pop(hostname, None)
+        if key is not None:
+            del self.entries[bisect_left(self.entries, (key, hostname))]
@@ -0,0 +1,165 @@
+import json
+import Queue
+import weakref
+import logging
+import threading
+
+from state import HISTOGRAM_CONN, HISTOGRAM_TRANSPORT
+from address import display_name
+
+__author__ = 'Thomas Kountis'
+
+
+RING_SIZE = 16  # Packets kept per connection
+RECORD_BYTES = 256  # Estimated footprint of a ring slot, with the packet fields it references
+MIN_SAMPLES = 100  # Before a percentile threshold applies
+THRESHOLD_REFRESH = 64  # Samples between re-computations of a percentile threshold
+KINDS = {HISTOGRAM_CONN: "handshake", HISTOGRAM_TRANSPORT: "transport"}
+
+
+class PacketRing(object):
+    """
+    The last @size packets of a connection. Slots are allocated once and overwritten in place.
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self.slots = [[None, None, None, None, None, None] for _ in range(size)]
+        self.next = 0
+        self.count = 0
+
+    def record(self, packet):
+        slot = self.slots[self.next]
+        slot[0] = packet.timestamp
+        slot[1] = packet.is_outgoing()
+        slot[2] = packet.flags
+        slot[3] = packet.sequence
+        slot[4] = packet.ack
+        slot[5] = packet.length
+        self.next = (self.next + 1) % len(self.slots)
+        self.count += 1
+
+    def records(self):
+        """
+        Copies of the recorded packets, oldest first.
+        """
+        size = len(self.slots)
+        kept = min(self.count, size)
+        return [tuple(self.slots[(self.next - kept + index) % size]) for index in range(kept)]
+
+    def clear(self):
+        self.count = 0
+
+
+class OutlierRecorder(object):
+    """
+    Keeps the last RING_SIZE packets of each connection, and when its handshake or transport time is over
+    @threshold ms or over the @percentile of its remote, appends them to @filename as a JSON line.
+
+    Rings come from a pool sized by @budget_mb, a ring returning to the pool as soon as its connection is
+    forgotten, so connections opened while the pool is exhausted are not recorded. Dumps are written by a
+    background thread, and dropped when more than @max_pending are waiting.
+    """
+
+    def __init__(self, analyzer, filename, threshold=None, percentile=None, budget_mb=16, max_pending=1000):
+        if threshold is None and percentile is None:
+            raise ValueError("Either a threshold or a percentile is required")
+
+        self.analyzer = analyzer
+        self.filename = filename
+        self.threshold = threshold
+        self.percentile = percentile
+        self.max_rings = int(budget_mb * 1024 * 1024 / (RING_SIZE * RECORD_BYTES))
+        self.rings = 0
+        self.free_rings = []
+        self.unrecorded = 0
+        self.dumped = 0
+        self.dropped = 0
+        self._owners = {}  # Weak reference to each session -> its ring
+        self._thresholds = weakref.WeakKeyDictionary()  # Sketch -> (threshold, count when computed)
+        self._pending = Queue.Queue(max_pending)
+        self._thread = None
+
+    def start(self):
+        self.analyzer.set_recorder(self)
+        self._thread = threading.Thread(target=self._run, name="trtop-outliers")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.analyzer.set_recorder(None)
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join(1)
+
+    def record(self, session, packet):
+        ring = session.ring
+        if ring is None:
+            ring = self._acquire(session)
+        if ring:
+            ring.record(packet)
+
+    def _acquire(self, session):
+        if self.free_rings:
+            ring = self.free_rings.pop()
+            ring.clear()
+        elif self.rings < self.max_rings:
+            self.rings += 1
+            ring = PacketRing()
+        else:
+            self.unrecorded += 1
+            session.ring = False  # Not recorded, without retrying every packet
+            return None
+
+        session.ring = ring
+        self._owners[weakref.ref(session, self._release)] = ring
+        return ring
+
+    def _release(self, reference):
+        self.free_rings.append(self._owners.pop(reference))
+
+    def check(self, remote, session, kind, duration, packet):
+        """
+        Dumps the packets of @session when its @kind (HISTOGRAM_CONN or HISTOGRAM_TRANSPORT) @duration
+        is an outlier.
+        """
+        ring = session.ring
+        if not ring or duration < self._threshold(remote.sketches[kind]):
+            return
+
+        dump = dict(remote=display_name(remote.hostname), port=packet.ephemeral_port(), kind=KINDS[kind],
+                    duration=duration, timestamp=packet.timestamp,
+                    packets=[dict(timestamp=timestamp, outgoing=outgoing, flags=flags, seq=sequence, ack=ack,
+                                  length=length)
+                             for timestamp, outgoing, flags, sequence, ack, length in ring.records()])
+        ring.clear()
+        try:
+            self._pending.put_nowait(dump)
+            self.dumped += 1
+        except Queue.Full:
+            self.dropped += 1
+
+    def _threshold(self, sketch):
+        if self.percentile is None:
+            return self.threshold
+
+        cached = self._thresholds.get(sketch)
+        if cached is None or sketch.count - cached[1] >= THRESHOLD_REFRESH:
+            value = sketch.percentile(self.percentile) if sketch.count >= MIN_SAMPLES else float("inf")
+            if self.threshold is not None:
+                value = min(value, self.threshold)
+            cached = self._thresholds[sketch] = (value, sketch.count)
+
+        return cached[0]
+
+    def _run(self):
+        with open(self.filename, 'a') as output:
+            while True:
+                dump = self._pending.get()
+                if dump is None:
+                    return
+
+                try:
+                    output.write(json.dumps(dump) + "\n")
+                    output.flush()
+                except Exception, e:
+                    logging.exception("Unable to write outlier to {0}".format(self.filename))
@@ -2,12 +2,16 @@ __author__ = 'Thomas Kountis'
 
 
 from utils import cat
+from address import to_text
 
 MIN_EPHEMERAL_PORT = int(cat("/proc/sys/net/ipv4/ip_local_port_range", default="32788").split("\t")[0])
 TCP_FLAG_ACK = '.'
 
 
 class UnifiedPacket:
+    """
+    A TCP packet, src and dst addresses being integers (see address.py), only turned into text for display.
+    """
 
     def __init__(self):
         self.src = None
@@ -19,6 +23,7 @@ class UnifiedPacket:
         self.ack = None
         self.sequence = None
         self.length = None
+        self.mss = None  # MSS option of SYN and SYN-ACK packets
 
     def is_outgoing(self):
         return self.src_port >= MIN_EPHEMERAL_PORT
@@ -53,6 +58,6 @@ class UnifiedPacket:
     def __str__(self):
         return "{0} {1} {2}:{3} > {4}:{5} [{6}] (ephemeral: {7}, remote_ip: {8}, " \
                "remote_port: {9}, ack: {10}, seq: {11}) (len: {12})" \
-            .format(self.timestamp, "out" if self.is_outgoing() else "in", self.src, self.src_port,
-                    self.dst, self.dst_port, self.flags, self.ephemeral_port(),
-                    self.remote_ip(), self.remote_port(), self.ack, self.sequence, self.length)
+            .format(self.timestamp, "out" if self.is_outgoing() else "in", to_text(self.src), self.src_port,
+                    to_text(self.dst), self.dst_port, self.flags, self.ephemeral_port(),
+                    to_text(self.remote_ip()), self.remote_port(), self.ack, self.sequence, self.length)
@@ -0,0 +1,312 @@
+import os
+import mmap
+import zlib
+import socket
+import struct
+import logging
+
+from codec import BinaryWriter, BinaryReader
+from packet import MIN_EPHEMERAL_PORT
+
+__author__ = 'Thomas Kountis'
+
+
+GLOBAL_HEADER_LENGTH = 24
+RECORD_HEADER_LENGTH = 16
+MAGICS = {"\xd4\xc3\xb2\xa1": "<", "\xa1\xb2\xc3\xd4": ">",  # Microsecond timestamps
+          "\x4d\x3c\xb2\xa1": "<", "\xa1\xb2\x3c\x4d": ">"}  # Nanosecond timestamps
+
+# Link types: offset of the network header, and offset of the ethertype (None when told by the IP version)
+LINK_TYPES = {0: (4, None),  # BSD loopback
+              1: (14, 12),  # Ethernet
+              101: (0, None),  # Raw IP
+              113: (16, 14)}  # Linux cooked
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = 0x8100
+PROTOCOL_TCP = 6
+
+INDEX_SUFFIX = ".trtopidx"
+INDEX_MAGIC = "TRTI"
+INDEX_VERSION = 1
+BLOCK_GAP = 64 * 1024  # Bytes between records of a remote still read as a single block
+
+
+class PcapFormat(object):
+    """
+    Byte order and link type of a pcap file, from its global header.
+    """
+
+    def __init__(self, header):
+        if len(header) < GLOBAL_HEADER_LENGTH or header[:4] not in MAGICS:
+            raise ValueError("Not a pcap capture (pcapng is not supported)")
+
+        self.byte_order = MAGICS[header[:4]]
+        self.link_type = struct.unpack_from(self.byte_order + "I", header, 20)[0]
+        if self.link_type not in LINK_TYPES:
+            raise ValueError("Unsupported link type {0}".format(self.link_type))
+
+        self.record_header = struct.Struct(self.byte_order + "IIII")
+        self.network_offset, self.ethertype_offset = LINK_TYPES[self.link_type]
+
+    def remote(self, data, offset, length):
+        """
+        The remote endpoint, "addr:port", of the TCP packet of @length bytes at @offset of @data, the same
+        side as UnifiedPacket.remote_ip() and remote_port(), or None when not TCP over IPv4 or IPv6
+        (without extension headers).
+        """
+        network = offset + self.network_offset
+        if self.ethertype_offset is not None:
+            ethertype_offset = offset + self.ethertype_offset
+            ethertype = struct.unpack_from("!H", data, ethertype_offset)[0]
+            if ethertype == ETHERTYPE_VLAN and self.link_type == 1:
+                ethertype = struct.unpack_from("!H", data, ethertype_offset + 4)[0]
+                network += 4
+            if ethertype != ETHERTYPE_IPV4 and ethertype != ETHERTYPE_IPV6:
+                return None
+
+        end = offset + length
+        if network + 20 > end:
+            return None
+
+        version = ord(data[network]) >> 4
+        if version == 4 and ord(data[network + 9]) == PROTOCOL_TCP:
+            transport = network + (ord(data[network]) & 0x0f) * 4
+            src, dst = data[network + 12:network + 16], data[network + 16:network + 20]
+            family = socket.AF_INET
+        elif version == 6 and network + 40 <= end and ord(data[network + 6]) == PROTOCOL_TCP:
+            transport = network + 40
+            src, dst = data[network + 8:network + 24], data[network + 24:network + 40]
+            family = socket.AF_INET6
+        else:
+            return None
+
+        if transport + 4 > end:
+            return None
+
+        src_port, dst_port = struct.unpack_from("!HH", data, transport)
+        if src_port < MIN_EPHEMERAL_PORT:
+            return "{0}:{1}".format(socket.inet_ntop(family, src), src_port)
+
+        return "{0}:{1}".format(socket.inet_ntop(family, dst), dst_port)
+
+
+def walk(data, pcap_format, start=GLOBAL_HEADER_LENGTH, end=None):
+    """
+    The (offset, length, remote) of every record of @data in [@start, @end), length including the record
+    header. A truncated last record ends the walk.
+    """
+    end = len(data) if end is None else min(end, len(data))
+    record_header = pcap_format.record_header
+    offset = start
+    while offset + RECORD_HEADER_LENGTH <= end:
+        captured_length = record_header.unpack_from(data, offset)[2]
+        length = RECORD_HEADER_LENGTH + captured_length
+        if offset + length > len(data):
+            return
+
+        yield offset, length, pcap_format.remote(data, offset + RECORD_HEADER_LENGTH, captured_length)
+        offset += length
+
+
+class CaptureIndex(object):
+    """
+    Byte ranges of the records of each remote endpoint of a capture. Records of a remote closer than
+    BLOCK_GAP bytes are kept in a single range, so a busy remote takes a few large sequential reads.
+    """
+
+    def __init__(self, size=0, mtime=0):
+        self.size = size
+        self.mtime = mtime
+        self.ranges = {}
+
+    def add(self, remote, offset, length):
+        ranges = self.ranges.get(remote)
+        if ranges is None:
+            self.ranges[remote] = [[offset, offset + length]]
+        elif offset - ranges[-1][1] <= BLOCK_GAP:
+            ranges[-1][1] = offset + length
+        else:
+            ranges.append([offset, offset + length])
+
+    def select(self, remotes):
+        """
+        The sorted, merged ranges of @remotes, each either "addr:port" or "addr" for every port of addr.
+        """
+        selected = sorted(block for remote, ranges in self.ranges.items() if _matches(remote, remotes)
+                          for block in ranges)
+        merged = []
+        for start, end in selected:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        return merged
+
+    def dumps(self):
+        writer = BinaryWriter()
+        writer.uint(self.size)
+        writer.float(self.mtime)
+        writer.uint(len(self.ranges))
+        for remote, ranges in self.ranges.items():
+            writer.str(remote)
+            writer.uint(len(ranges))
+            previous = 0
+            for start, end in ranges:
+                # Delta encoded, offsets only grow
+                writer.uint(start - previous)
+                writer.uint(end - start)
+                previous = end
+
+        payload = zlib.compress(writer.getvalue())
+        header = BinaryWriter()
+        header.chunks.append(INDEX_MAGIC)
+        header.uint(INDEX_VERSION)
+        header.uint(zlib.crc32(payload) & 0xffffffff)
+        return header.getvalue() + payload
+
+    @staticmethod
+    def loads(data):
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("Not a trtop capture index")
+
+        header = BinaryReader(data)
+        header.offset = len(INDEX_MAGIC)
+        version = header.uint()
+        if version != INDEX_VERSION:
+            raise ValueError("Unsupported capture index version {0}".format(version))
+
+        crc = header.uint()
+        payload = data[header.offset:]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            raise ValueError("Corrupted capture index")
+
+        reader = BinaryReader(zlib.decompress(payload))
+        index = CaptureIndex(reader.uint(), reader.float())
+        for _ in range(reader.uint()):
+            remote = reader.str()
+            ranges = index.ranges[remote] = []
+            previous = 0
+            for _ in range(reader.uint()):
+                start = previous + reader.uint()
+                previous = start + reader.uint()
+                ranges.append([start, previous])
+
+        return index
+
+
+def _matches(remote, remotes):
+    return remote in remotes or remote.rpartition(":")[0] in remotes
+
+
+def index_file_name(capture_file_name):
+    return capture_file_name + INDEX_SUFFIX
+
+
+def load_index(capture_file_name):
+    """
+    The sidecar index of @capture_file_name, or None when missing or out of date with the capture.
+    """
+    try:
+        with open(index_file_name(capture_file_name), 'rb') as sidecar:
+            index = CaptureIndex.loads(sidecar.read())
+    except IOError:
+        return None
+
+    stat = os.stat(capture_file_name)
+    if index.size != stat.st_size or index.mtime != stat.st_mtime:
+        logging.warning("Index of %s is out of date with the capture", capture_file_name)
+        return None
+
+    return index
+
+
+class _MappedCapture(object):
+    """
+    File object over a memory mapped capture, read() returning whole records only.
+    @records is called once the global header is read, returning the (start, end) offsets of the records to read,
+    in order.
+    """
+
+    def __init__(self, file_name, records):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pcap_format = PcapFormat(self.data[:GLOBAL_HEADER_LENGTH])
+        self._records = records
+        self._header_sent = False
+
+    def read(self, size):
+        if not self._header_sent:
+            self._header_sent = True
+            self._pending = self._records()
+            return self.data[:GLOBAL_HEADER_LENGTH]
+
+        # Adjacent records are copied out of the mapping as a single slice
+        slices = []
+        total = 0
+        for start, end in self._pending:
+            if slices and slices[-1][1] == start:
+                slices[-1][1] = end
+            else:
+                slices.append([start, end])
+            total += end - start
+            if total >= size:
+                break
+
+        return "".join(self.data[start:end] for start, end in slices)
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+
+class IndexingCapture(_MappedCapture):
+    """
+    Reads a capture as is while indexing its records, the index being saved next to the capture once
+    the whole capture is read.
+    """
+
+    def __init__(self, file_name):
+        _MappedCapture.__init__(self, file_name, self._indexed_records)
+        stat = os.fstat(self._file.fileno())
+        self.index = CaptureIndex(stat.st_size, stat.st_mtime)
+        self._complete = False
+
+    def _indexed_records(self):
+        add = self.index.add
+        for offset, length, remote in walk(self.data, self.pcap_format):
+            if remote is not None:
+                add(remote, offset, length)
+            yield offset, offset + length
+
+        self._complete = True
+
+    def close(self):
+        _MappedCapture.close(self)
+        if not self._complete:
+            return
+
+        tmp_file_name = index_file_name(self.file_name) + ".tmp"
+        with open(tmp_file_name, 'wb') as output:
+            output.write(self.index.dumps())
+        os.rename(tmp_file_name, index_file_name(self.file_name))
+        logging.info("Indexed %d remotes of %s", len(self.index.ranges), self.file_name)
+
+
+class RestrictedCapture(_MappedCapture):
+    """
+    Reads only the records of @remotes out of a capture, seeking straight to their blocks in @index.
+    """
+
+    def __init__(self, file_name, index, remotes):
+        _MappedCapture.__init__(self, file_name, self._selected_records)
+        self.index = index
+        self.remotes = set(remotes)
+
+    def _selected_records(self):
+        for start, end in self.index.select(self.remotes):
+            for offset, length, remote in walk(self.data, self.pcap_format, start, end):
+                if remote is not None and _matches(remote, self.remotes):
+                    yield offset, offset + length
@@ -0,0 +1,113 @@
+import logging
+import threading
+
+__author__ = 'Thomas Kountis'
+
+
+class Pipeline(object):
+    """
+    A collector feeding an analyzer, observed by a reporter, along with background services
+    (eg. checkpoint.Checkpointer) exposing start() and stop().
+    start() takes over the calling thread until the collector is done or stopped, while run() drives
+    the pipeline from a runtime.Runtime until it is stopped.
+    """
+
+    def __init__(self, collector, analyzer, reporter, services=()):
+        self.collector = collector
+        self.analyzer = analyzer
+        self.reporter = reporter
+        self.services = list(services)
+
+    def start(self):
+        logging.info("New TRTOP session with: {0}".format(
+            str((self.collector.__class__, self.analyzer.__class__, self.reporter.__class__))))
+        for service in self.services:
+            service.start()
+        self.reporter.start()
+        self.collector.start()
+
+    def run(self, runtime):
+        """
+        Collectors exposing attach(runtime) are read from the @runtime loop, others take over a thread of
+        their own. The reporter is ticked every TICK_INTERVAL secs. Returns once @runtime is stopped,
+        the pipeline being stopped as well.
+        """
+        logging.info("New TRTOP session with: {0}".format(
+            str((self.collector.__class__, self.analyzer.__class__, self.reporter.__class__))))
+        for service in self.services:
+            service.start()
+        self.reporter.start()
+        try:
+            if hasattr(self.collector, 'attach'):
+                self.collector.attach(runtime)
+                tick_interval = getattr(self.reporter, 'TICK_INTERVAL', None)
+                if tick_interval:
+                    runtime.every(tick_interval, self.reporter.tick)
+            else:
+                thread = threading.Thread(target=self.collector.start, name="trtop-collector")
+                thread.daemon = True
+                thread.start()
+
+            runtime.run()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.collector.stop()
+        self.reporter.stop()
+        for service in self.services:
+            service.stop()
+
+
+def _instance(component, analyzer):
+    """
+    @component as given, or built with @analyzer when it is a class or a factory function.
+    """
+    if isinstance(component, type) or not hasattr(component, 'start'):
+        return component(analyzer)
+
+    return component
+
+
+def build(collector=None, analyzer=None, reporters=(), services=(), whitelist=None, resolver=None,
+          input_filename=None, clock=None):
+    """
+    Builds a Pipeline for embedding trtop, eg.
+
+        pipeline = trtop.build(input_filename="sample.pcap",
+                               reporters=[lambda analyzer: PrometheusExporterReporter(analyzer, port=9469)])
+        pipeline.start()
+
+    @collector, each of @reporters and @services are either instances or callables (eg. classes) taking the
+    analyzer. The analyzer defaults to an OutgoingTCPAnalyzer with @whitelist, @resolver and @clock, and the
+    collector to a TCPDumpFileCollector reading @input_filename. Without reporters the pipeline is headless,
+    statistics being read from analyzer.tracked_remotes.
+    Nothing but the given or default components is imported, curses in particular only with the curses reporter.
+    """
+    if analyzer is None:
+        from analyzer import OutgoingTCPAnalyzer
+        from clock import WALL_CLOCK, CaptureClock
+
+        if whitelist is None:
+            from whitelisting import DefaultWhitelist
+            whitelist = DefaultWhitelist()
+        if resolver is None:
+            from resolver import DefaultDNSResolver
+            resolver = DefaultDNSResolver()
+        if clock is None:
+            clock = CaptureClock() if input_filename else WALL_CLOCK
+
+        analyzer = OutgoingTCPAnalyzer(whitelist, resolver, clock=clock)
+
+    if collector is None:
+        if not input_filename:
+            raise ValueError("Either a collector or an input filename is required")
+
+        from tcpdump.offlinecollector import TCPDumpFileCollector
+        collector = TCPDumpFileCollector(analyzer, input_filename)
+    else:
+        collector = _instance(collector, analyzer)
+
+    from reporter import ReporterGroup
+    reporter = ReporterGroup(analyzer, [_instance(reporter, analyzer) for reporter in reporters])
+    return Pipeline(collector, analyzer, reporter, [_instance(service, analyzer) for service in services])
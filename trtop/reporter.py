@@ -3,15 +3,58 @@ __author__ = 'Thomas Kountis'
 
 class BaseReporter(object):
 
+    TICK_INTERVAL = None  # Secs between tick() calls by a runtime.Runtime, if any
+
     def handle_remote_event(self, host):
         pass
 
+    def handle_remote_evicted(self, host):
+        pass
+
+    def tick(self):
+        pass
+
     def start(self):
         pass
 
     def stop(self):
         pass
 
+
+class ReporterGroup(BaseReporter):
+    """
+    Fans the events of @analyzer out to several @reporters, as an analyzer has a single observer.
+    """
+
+    def __init__(self, analyzer, reporters):
+        BaseReporter.__init__(self)
+        self.analyzer = analyzer
+        self.reporters = reporters
+        intervals = [reporter.TICK_INTERVAL for reporter in reporters if reporter.TICK_INTERVAL]
+        self.TICK_INTERVAL = min(intervals) if intervals else None
+
+    def handle_remote_event(self, host):
+        for reporter in self.reporters:
+            reporter.handle_remote_event(host)
+
+    def handle_remote_evicted(self, host):
+        for reporter in self.reporters:
+            reporter.handle_remote_evicted(host)
+
+    def tick(self):
+        for reporter in self.reporters:
+            if reporter.TICK_INTERVAL:
+                reporter.tick()
+
+    def start(self):
+        for reporter in self.reporters:
+            reporter.start()
+        self.analyzer.set_observer(self)
+
+    def stop(self):
+        for reporter in self.reporters:
+            reporter.stop()
+
 from resolver import DefaultDNSResolver
 from whitelisting import DefaultWhitelist
 
@@ -38,23 +81,64 @@ class CLIEventAppendReporter(BaseReporter):
         self.collector.stop()
 
 
-import curses
-import time
-import locale
+from clock import WALL_CLOCK
+from ordering import IncrementalOrdering
+from windows import Windows
+from summary import write_snapshot
+from sampling import ScaledRemoteView
+from address import display_name
 
-locale.setlocale(locale.LC_ALL,"")
+curses = None
+
+
+def _import_curses():
+    """
+    curses, and the locale it draws with, are only set up once a curses reporter is created,
+    so headless users of this module don't pay for them.
+    """
+    global curses
+    if curses is None:
+        import locale
+        import curses as _curses
+        locale.setlocale(locale.LC_ALL, "")
+        curses = _curses
 
 
 class CLICursesOutgoingTCPReporter(BaseReporter):
     """
     Curses based reporter for the @analyzer.OutgoingTCPAnalyzer
-    Refreshing time based, and controlled with the REFRESH_RATE class property.
+    Refreshing time based, and controlled with the REFRESH_RATE class property, in seconds of the analyzer
+    clock (see clock.py), so a replayed capture refreshes at its own pace.
+
+    Remotes are kept in an incrementally maintained ordering and only the visible page is drawn.
+    Keys: up/down (j/k) scroll, page up/down scroll a page, 's' cycles the sort column, 'r' reverses the order,
+    'w' cycles between the all-time statistics and the sliding windows of Windows.NAMES.
+
+    When the analyzer samples flows (see sampling.py), counters are scaled up by the sampling scale
+    and the current sampling rate is shown in the status line.
     """
 
     REFRESH_RATE = 1  # SECS
+    TICK_INTERVAL = REFRESH_RATE
     CURSES_ROW_X_OFFSET = 2
     CONNECTION_QOS = 100
-    NUM_OF_COLS = 18
+    NUM_OF_COLS = 20
+    HEADER_ROWS = 5
+    FOOTER_ROWS = 4
+
+    # Name, getter, and whether the all-time value changes with time alone (windowed values always do)
+    SORT_COLUMNS = [
+        ("Est Rate", lambda remote: remote.get_est_mean_rate(), True),
+        ("Syn", lambda remote: remote.get_syn_count(), False),
+        ("Rst", lambda remote: remote.get_rst_count(), False),
+        ("Lat", lambda remote: remote.get_conn_latency_95th(), False),
+        ("Out", lambda remote: remote.get_outgoing_count(), False),
+        ("Rtt", lambda remote: remote.get_transport_rtt_95th(), False),
+        ("Ttlb", lambda remote: remote.get_transport_ttlb_95th(), False),
+        ("Rtx", lambda remote: remote.get_retransmit_counter(), False),
+        ("Err", lambda remote: remote.get_pkt_err_count(), False),
+        ("Host", lambda remote: display_name(remote.hostname), False)
+    ]
 
     def __init__(self, analyzer, summary_filename):
         BaseReporter.__init__(self)
@@ -62,16 +146,26 @@ class CLICursesOutgoingTCPReporter(BaseReporter):
 
         self.analyzer = analyzer
         self.tcpstates = {}
+        self.sort_column = 0
+        self.window = None
+        self.ordering = IncrementalOrdering(self._sort_key(), volatile=self._sort_volatile())
+        self.scroll = 0
+        self.totals = dict(syn_count=0, syn_rate=0, est_count=0, est_rate=0, rst_count=0)
+        self.contributions = {}
         self.screen = self._init_screen()
-        self.last_refreshed = time.time()
+        self.clock = getattr(analyzer, 'clock', WALL_CLOCK)
+        self.last_refreshed = None
         self.config_subtitle = "analyzer: {0}".format(analyzer.__class__.__name__)
 
     def _init_screen(self):
+        _import_curses()
         screen = curses.initscr()
         curses.noecho()
         curses.cbreak()
         curses.start_color()
         curses.init_pair(1, curses.COLOR_RED, curses.COLOR_WHITE)
+        screen.keypad(1)
+        screen.nodelay(1)
         screen.border(0)
         return screen
 
@@ -99,29 +193,109 @@ class CLICursesOutgoingTCPReporter(BaseReporter):
 
     def handle_remote_event(self, remote):
         self.tcpstates[remote.hostname] = remote
-        # if time.time() - self.last_refreshed > CLICursesOutgoingTCPReporter.REFRESH_RATE:
+        self.ordering.mark_dirty(remote.hostname)
+        if self.last_refreshed is None or \
+                self.clock.now() - self.last_refreshed >= CLICursesOutgoingTCPReporter.REFRESH_RATE:
+            self.refresh()
+
+    def handle_remote_evicted(self, remote):
+        self.tcpstates.pop(remote.hostname, None)
+        self.ordering.remove(remote.hostname)
+        self._track_totals(remote.hostname, None)
+
+    def tick(self):
+        # Keeps the screen responsive to keys when no packets come in, eg. at the end of a capture
         self.refresh()
 
     def refresh(self):
+        self._handle_keys()
+        for hostname in self.ordering.dirty:
+            self._track_totals(hostname, self.tcpstates.get(hostname))
+        self.ordering.update(self.tcpstates)
+
         self.screen.clear()
         self.screen.border(0)
 
         row = self._print_header()
 
-        ordered_tcpstates = sorted(self.tcpstates.items(), key=lambda entry: entry[1].get_est_mean_rate())
-        totals = {}
-        for _, tcpstate in ordered_tcpstates:
-            syn_count, syn_rate, est_count, est_rate, rst_count, row = \
-                self._print_remote(tcpstate, row)
-            totals['syn_count'] = totals.get('syn_count', 0) + syn_count
-            totals['syn_rate'] = totals.get('syn_rate', 0) + syn_rate
-            totals['est_count'] = totals.get('est_count', 0) + est_count
-            totals['est_rate'] = totals.get('est_rate', 0) + est_rate
-            totals['rst_count'] = totals.get('rst_count', 0) + rst_count
-
-        row = self._print_totals(totals, row)
+        page_size = self._page_size()
+        self.scroll = max(0, min(self.scroll, len(self.ordering) - page_size))
+        scale = self._scale()
+        for hostname in self.ordering.page(self.scroll, page_size):
+            remote = self._view(self.tcpstates[hostname])
+            row = self._print_remote(ScaledRemoteView(remote, scale) if scale != 1 else remote, row)
+
+        self._print_totals(self.totals, row, scale)
         self.screen.refresh()
-        self.last_refreshed = time.time()
+        self.last_refreshed = self.clock.now()
+
+    def _page_size(self):
+        height, _ = self.screen.getmaxyx()
+        return max(0, height - CLICursesOutgoingTCPReporter.HEADER_ROWS - CLICursesOutgoingTCPReporter.FOOTER_ROWS)
+
+    def _handle_keys(self):
+        key = self.screen.getch()
+        while key != -1:
+            if key in (curses.KEY_DOWN, ord('j')):
+                self.scroll += 1
+            elif key in (curses.KEY_UP, ord('k')):
+                self.scroll = max(0, self.scroll - 1)
+            elif key in (curses.KEY_NPAGE, ord(' ')):
+                self.scroll += self._page_size()
+            elif key == curses.KEY_PPAGE:
+                self.scroll = max(0, self.scroll - self._page_size())
+            elif key == ord('s'):
+                self.sort_column = (self.sort_column + 1) % len(CLICursesOutgoingTCPReporter.SORT_COLUMNS)
+                self.ordering.resort(self._sort_key(), self.tcpstates, self._sort_volatile())
+            elif key == ord('r'):
+                self.ordering.reverse = not self.ordering.reverse
+            elif key == ord('w'):
+                windows = [None] + Windows.NAMES
+                self.window = windows[(windows.index(self.window) + 1) % len(windows)]
+                self.ordering.resort(self._sort_key(), self.tcpstates, self._sort_volatile())
+                for hostname, remote in self.tcpstates.items():
+                    self._track_totals(hostname, remote)
+
+            key = self.screen.getch()
+
+    def _view(self, remote):
+        """
+        The remote as displayed, either its all-time statistics or the ones of the selected sliding window.
+        """
+        if self.window is None or not hasattr(remote, 'window_view'):
+            return remote
+
+        return remote.window_view(self.window, getattr(self.analyzer, 'last_timestamp', None))
+
+    def _scale(self):
+        sampler = getattr(self.analyzer, 'sampler', None)
+        return sampler.scale() if sampler is not None else 1
+
+    def _sort_key(self):
+        getter = CLICursesOutgoingTCPReporter.SORT_COLUMNS[self.sort_column][1]
+        return lambda remote: getter(self._view(remote))
+
+    def _sort_volatile(self):
+        name, _, decays = CLICursesOutgoingTCPReporter.SORT_COLUMNS[self.sort_column]
+        return decays or (self.window is not None and name != "Host")
+
+    def _track_totals(self, hostname, remote):
+        """
+        Keeps the totals up to date by replacing the previous contribution of @hostname with its current one.
+        """
+        previous = self.contributions.pop(hostname, None)
+        if previous is not None:
+            for name, value in previous.items():
+                self.totals[name] -= value
+
+        if remote is not None:
+            remote = self._view(remote)
+            contribution = dict(syn_count=remote.get_syn_count(), syn_rate=remote.get_syn_mean_rate(),
+                                est_count=remote.get_est_count(), est_rate=remote.get_est_mean_rate(),
+                                rst_count=remote.get_rst_count())
+            for name, value in contribution.items():
+                self.totals[name] += value
+            self.contributions[hostname] = contribution
 
     def _print_header(self):
         row = 0
@@ -131,7 +305,18 @@ class CLICursesOutgoingTCPReporter(BaseReporter):
         row = 1
         self._print_line(row, 2, "Connections", color=curses.A_BOLD)
         self._print_line(row, 14, "Transport", color=curses.A_BOLD)
-        self._print_line(row, 17, "Pcap", color=curses.A_BOLD)
+        self._print_line(row, 18, "Pcap", color=curses.A_BOLD)
+
+        row = 2
+        self._print_line(row, 0, "[{0}] {1} {2} {3}-{4}/{5}".format(
+            self.window or "all", CLICursesOutgoingTCPReporter.SORT_COLUMNS[self.sort_column][0],
+            "^" if self.ordering.reverse else "v", min(self.scroll + 1, len(self.ordering)),
+            min(self.scroll + self._page_size(), len(self.ordering)), len(self.ordering)))
+        sampler = getattr(self.analyzer, 'sampler', None)
+        if sampler is not None:
+            self._print_line(row, 6, "sampling {0:.0f}% (x{1:.2f}, lag {2:.1f}s)".format(
+                sampler.rate * 100, sampler.scale(), sampler.lag),
+                color=curses.color_pair(1) if sampler.rate < 1 else curses.color_pair(0))
 
         row = 3
         self._print_line(row, 0, "Host", color=curses.A_UNDERLINE)
@@ -148,19 +333,23 @@ class CLICursesOutgoingTCPReporter(BaseReporter):
         self._print_line(row, 14, "Out", color=curses.A_UNDERLINE)
         self._print_line(row, 15, "In", color=curses.A_UNDERLINE)
         self._print_line(row, 16, "Rtt", color=curses.A_UNDERLINE)
+        self._print_line(row, 17, "Ttlb", color=curses.A_UNDERLINE)
 
-        self._print_line(row, 17, "Err", color=curses.A_UNDERLINE)
+        self._print_line(row, 18, "Rtx", color=curses.A_UNDERLINE)
+        self._print_line(row, 19, "Err", color=curses.A_UNDERLINE)
 
         row = 4
         self._print_line(row, 2, "")
         return row + 1
 
-    def _print_totals(self, totals, row):
+    def _print_totals(self, totals, row, scale=1):
         row += 1
         self._print_line(row, 0, 'Totals:', color=curses.A_BOLD)
-        self._print_line(row, 2, "{0} ({1:.2f})".format(totals['syn_count'], totals['syn_rate']), color=curses.A_BOLD)
-        self._print_line(row, 6, "{0} ({1:.2f})".format(totals['est_count'], totals['est_rate']), color=curses.A_BOLD)
-        self._print_line(row, 8, str(totals['rst_count']), color=curses.A_BOLD)
+        self._print_line(row, 2, "{0:.0f} ({1:.2f})".format(totals['syn_count'] * scale, totals['syn_rate'] * scale),
+                         color=curses.A_BOLD)
+        self._print_line(row, 6, "{0:.0f} ({1:.2f})".format(totals['est_count'] * scale, totals['est_rate'] * scale),
+                         color=curses.A_BOLD)
+        self._print_line(row, 8, "{0:.0f}".format(totals['rst_count'] * scale), color=curses.A_BOLD)
 
         row += 1
         self._print_line(row, 0, "")
@@ -181,9 +370,10 @@ class CLICursesOutgoingTCPReporter(BaseReporter):
         fin_out_ratio = ((float(fin_out_count) / float(syn_count))) * 100 if syn_count else 0
         conn_mean_lat = remote.get_conn_latency_mean()
         rtt_95th = remote.get_transport_rtt_95th()
+        ttlb_95th = remote.get_transport_ttlb_95th()
         qos_95th = remote.get_rt_per_conn_95th()
 
-        self._print_line(row, 0, str(remote.hostname))
+        self._print_line(row, 0, display_name(remote.hostname))
         self._print_line(row, 2, "{0} ({1:.2f})".format(syn_count, syn_rate))
         self._print_line(row, 4, "{0} ({1:.0f}%)".format(remote.get_syn_ack_count(), syn_acc_ratio),
                          self._lt_ratio_color(syn_acc_ratio, 90))
@@ -203,23 +393,27 @@ class CLICursesOutgoingTCPReporter(BaseReporter):
         self._print_line(row, 15, "{0}".format(remote.get_incoming_count()))
         self._print_line(row, 16, "{0:.2f}".format(rtt_95th),
                          self._gt_ratio_color(rtt_95th, 100))
+        self._print_line(row, 17, "{0:.2f}".format(ttlb_95th),
+                         self._gt_ratio_color(ttlb_95th, 100))
 
-        self._print_line(row, 17, "{0}".format(remote.get_pkt_err_count()))
+        self._print_line(row, 18, "{0}".format(remote.get_retransmit_counter()))
+        self._print_line(row, 19, "{0}".format(remote.get_pkt_err_count()))
 
-        return syn_count, syn_rate, est_count, est_rate, rst_count, row + 1
-
-    def _store_window(self):
-        contents = []
-        height, _ = self.screen.getmaxyx()
-        for i in range(0, height):
-            contents.append(self.screen.instr(i, 0))
+        return row + 1
 
+    def _store_summary(self):
+        # Every remote, not only those visible on screen, straight from the state layer
         with open('{0}.trtop'.format(self.summary_filename), 'w+b') as output:
-            output.write('\n'.join(contents))
+            write_snapshot(output, self.tcpstates.values(), getattr(self.analyzer, 'last_timestamp', None))
 
     def start(self):
+        # Remotes already tracked eg. restored from a checkpoint
+        for remote in getattr(self.analyzer, 'tracked_remotes', {}).values():
+            self.tcpstates[remote.hostname] = remote
+            self.ordering.mark_dirty(remote.hostname)
+
         self.analyzer.set_observer(self)
 
     def stop(self):
-        self._store_window()
+        self._store_summary()
         curses.endwin()
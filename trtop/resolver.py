@@ -32,3 +32,52 @@ class NoResolver(BaseResolver):
 
     def resolve_async(self, addr, port, callback):
         callback(addr, addr)
+
+
+class ReverseDNSResolver(BaseResolver):
+    """
+    Blocking reverse DNS lookups, the address itself when it has no name.
+    """
+
+    def __init__(self):
+        BaseResolver.__init__(self)
+
+    def resolve(self, addr, port):
+        import socket
+        from address import to_text
+
+        try:
+            return socket.gethostbyaddr(to_text(addr))[0]
+        except (socket.error, socket.herror, socket.gaierror):
+            return addr
+
+
+class AsyncResolver(BaseResolver):
+    """
+    Resolves with the blocking @resolver on the worker threads of a runtime.Runtime, off the analysis path.
+    resolve() never blocks and returns the address, which remotes are tracked by, while resolve_async()
+    calls back on the runtime thread once the name is known. Names are cached, failures included.
+    """
+
+    ASYNC = True
+
+    def __init__(self, resolver, runtime):
+        BaseResolver.__init__(self)
+        self.resolver = resolver
+        self.runtime = runtime
+        self.names = {}
+
+    def resolve(self, addr, port):
+        return addr
+
+    def resolve_async(self, addr, port, callback):
+        if addr in self.names:
+            callback(addr, self.names[addr])
+            return
+
+        self.runtime.run_in_executor(self.resolver.resolve, (addr, port),
+                                     lambda name: self._resolved(addr, name or addr, callback))
+
+    def _resolved(self, addr, name, callback):
+        self.names[addr] = name
+        callback(addr, name)
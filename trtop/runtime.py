@@ -0,0 +1,153 @@
+import os
+import time
+import errno
+import fcntl
+import heapq
+import Queue
+import select
+import logging
+import threading
+from collections import deque
+from functools import partial
+
+__author__ = 'Thomas Kountis'
+
+
+class Runtime(object):
+    """
+    Single threaded event loop driving a pipeline: collectors register readable file descriptors and
+    consume them in batches, reporters register periodic tasks, and blocking calls (eg. DNS lookups) run on
+    a small pool of @workers threads with their results delivered back on the loop thread.
+    Everything but run_in_executor() callables runs on the thread of run(), so the analyzer and the
+    reporters need no locking. stop() can be called from any thread or a signal handler.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._readers = {}
+        self._timers = []
+        self._timer_sequence = 0
+        self._ready = deque()
+        self._stopped = False
+        self._executor = Queue.Queue()
+        self._threads = []
+        self._wakeup_reader, self._wakeup_writer = os.pipe()
+        for fd in (self._wakeup_reader, self._wakeup_writer):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def add_reader(self, fd, callback):
+        self._readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def call_later(self, delay, callback):
+        self._timer_sequence += 1
+        heapq.heappush(self._timers, (time.time() + delay, self._timer_sequence, callback))
+
+    def every(self, interval, callback):
+        """
+        Calls @callback every @interval secs, until the runtime stops.
+        """
+        def _tick():
+            try:
+                callback()
+            finally:
+                self.call_later(interval, _tick)
+
+        self.call_later(interval, _tick)
+
+    def call_soon_threadsafe(self, callback):
+        self._ready.append(callback)
+        self._wakeup()
+
+    def run_in_executor(self, func, args=(), callback=None):
+        """
+        Runs @func(*@args) on a worker thread, then @callback(result) on the loop thread.
+        The result is None when @func raised.
+        """
+        if not self._threads:
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name="trtop-worker-{0}".format(index))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        self._executor.put((func, args, callback))
+
+    def _work(self):
+        while True:
+            task = self._executor.get()
+            if task is None:
+                return
+
+            func, args, callback = task
+            try:
+                result = func(*args)
+            except Exception, e:
+                logging.exception("Task {0} failed".format(func))
+                result = None
+
+            if callback is not None:
+                self.call_soon_threadsafe(partial(callback, result))
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_writer, "x")
+        except OSError, e:
+            if e.errno != errno.EAGAIN:  # Already awake
+                raise
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup()
+
+    def run(self):
+        """
+        Runs until stop(), exceptions raised by callbacks propagate to the caller.
+        """
+        try:
+            while not self._stopped:
+                self._run_once()
+        finally:
+            for _ in self._threads:
+                self._executor.put(None)
+            for thread in self._threads:
+                thread.join(1)
+            os.close(self._wakeup_reader)
+            os.close(self._wakeup_writer)
+
+    def _run_once(self):
+        timeout = None
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, self._timers[0][0] - time.time())
+
+        try:
+            readable, _, _ = select.select(self._readers.keys() + [self._wakeup_reader], [], [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:  # Signal, eg. SIGINT calling stop()
+                return
+            raise
+
+        for fd in readable:
+            if fd == self._wakeup_reader:
+                self._drain_wakeup()
+            elif fd in self._readers and not self._stopped:
+                self._readers[fd]()
+
+        while self._ready and not self._stopped:
+            self._ready.popleft()()
+
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now and not self._stopped:
+            heapq.heappop(self._timers)[2]()
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_reader, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import array
+import Queue
+import logging
+import threading
+
+from state import HISTOGRAM_CONN, HISTOGRAM_TRANSPORT, HISTOGRAM_TTLB
+from address import display_name
+
+__author__ = 'Thomas Kountis'
+
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+# (column, array typecode, NumPy dtype), one file per column of each segment
+COLUMNS = [("ts", 'd', "f8"), ("remote", 'I', "u4"), ("port", 'H', "u2"), ("kind", 'B', "u1"),
+           ("duration", 'd', "f8")]
+RECORD_BYTES = sum(array.array(typecode).itemsize for _, typecode, _ in COLUMNS)
+KINDS = [HISTOGRAM_CONN, HISTOGRAM_TRANSPORT, HISTOGRAM_TTLB]
+KIND_NAMES = ["handshake", "ttfb", "ttlb"]
+BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+
+def column_file_name(segment_dir, column):
+    return os.path.join(segment_dir, column + ".col")
+
+
+class SampleSink(object):
+    """
+    Appends every handshake, time to first byte and time to last byte sample, with its capture timestamp,
+    remote and ephemeral port, to fixed width columns under @directory.
+
+    Samples are buffered in memory and handed over to a background thread every @buffer_mb worth of records,
+    a batch being dropped when more than @max_pending are waiting. Records go to numbered segment directories,
+    a new one started once a segment holds @segment_mb, each described by its manifest.json, see load().
+    """
+
+    def __init__(self, analyzer, directory, segment_mb=256, buffer_mb=4, max_pending=8):
+        self.analyzer = analyzer
+        self.directory = directory
+        self.segment_rows = max(1, segment_mb * 1024 * 1024 / RECORD_BYTES)
+        self.buffer_rows = max(1, min(buffer_mb * 1024 * 1024 / RECORD_BYTES, self.segment_rows))
+        self.remotes = {}  # Hostname -> id, the remote column referencing manifest "remotes"
+        self.remote_names = []
+        self.dropped = 0
+        self._columns = self._new_columns()
+        self._pending = Queue.Queue(max_pending)
+        self._thread = None
+        self._segment = 0
+        self._segment_rows = 0
+
+    @staticmethod
+    def _new_columns():
+        return [array.array(typecode) for _, typecode, _ in COLUMNS]
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._segment = len([name for name in os.listdir(self.directory) if name.isdigit()])
+
+        self.analyzer.set_sink(self)
+        self._thread = threading.Thread(target=self._run, name="trtop-samples")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.analyzer.set_sink(None)
+        if self._thread is not None:
+            self.flush()
+            self._pending.put(None)
+            self._thread.join(5)
+
+    def sample(self, remote, port, kind, timestamp, duration):
+        """
+        Called by @remote (a TcpRemoteState) with each @kind (one of KINDS) @duration in ms.
+        """
+        remote_id = self.remotes.get(remote.hostname)
+        if remote_id is None:
+            remote_id = self.remotes[remote.hostname] = len(self.remote_names)
+            self.remote_names.append(display_name(remote.hostname))
+
+        ts, remotes, ports, kinds, durations = self._columns
+        ts.append(float(timestamp))
+        remotes.append(remote_id)
+        ports.append(port)
+        kinds.append(KINDS.index(kind))
+        durations.append(duration)
+        if len(ts) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        columns = self._columns
+        if not len(columns[0]):
+            return
+
+        self._columns = self._new_columns()
+        try:
+            self._pending.put_nowait((columns, list(self.remote_names)))
+        except Queue.Full:
+            self.dropped += len(columns[0])
+
+    def _run(self):
+        while True:
+            batch = self._pending.get()
+            if batch is None:
+                return
+
+            try:
+                self._write(*batch)
+            except Exception, e:
+                logging.exception("Unable to write samples to {0}".format(self.directory))
+
+    def _write(self, columns, remote_names):
+        offset = 0
+        rows = len(columns[0])
+        while offset < rows:
+            if self._segment_rows >= self.segment_rows:
+                self._segment += 1
+                self._segment_rows = 0
+
+            count = min(rows - offset, self.segment_rows - self._segment_rows)
+            segment_dir = os.path.join(self.directory, "{0:06d}".format(self._segment))
+            if not os.path.isdir(segment_dir):
+                os.makedirs(segment_dir)
+
+            for (name, _, _), column in zip(COLUMNS, columns):
+                with open(column_file_name(segment_dir, name), 'ab') as output:
+                    column[offset:offset + count].tofile(output)
+
+            self._segment_rows += count
+            offset += count
+            self._write_manifest(segment_dir, remote_names)
+
+    def _write_manifest(self, segment_dir, remote_names):
+        manifest = dict(version=FORMAT_VERSION, rows=self._segment_rows,
+                        columns=[[name, BYTE_ORDER + dtype] for name, _, dtype in COLUMNS],
+                        kinds=KIND_NAMES, remotes=remote_names)
+        tmp_file_name = os.path.join(segment_dir, MANIFEST + ".tmp")
+        with open(tmp_file_name, 'w') as output:
+            json.dump(manifest, output)
+        os.rename(tmp_file_name, os.path.join(segment_dir, MANIFEST))
+
+
+def segments(directory):
+    """
+    The (segment directory, manifest) of every segment written under @directory, in order.
+    """
+    found = []
+    for name in sorted(os.listdir(directory)):
+        manifest_file_name = os.path.join(directory, name, MANIFEST)
+        if name.isdigit() and os.path.exists(manifest_file_name):
+            with open(manifest_file_name) as manifest:
+                found.append((os.path.join(directory, name), json.load(manifest)))
+
+    return found
+
+
+def read(segment_dir, manifest):
+    """
+    The columns of a segment as a dict of arrays, without NumPy.
+    """
+    typecodes = dict((name, typecode) for name, typecode, _ in COLUMNS)
+    columns = {}
+    for name, dtype in manifest['columns']:
+        column = columns[name] = array.array(typecodes[name])
+        with open(column_file_name(segment_dir, name), 'rb') as data:
+            column.fromfile(data, manifest['rows'])
+        if dtype[0] != BYTE_ORDER:
+            column.byteswap()
+
+    return columns
+
+
+def load(directory):
+    """
+    The columns of every segment under @directory, each a dict of read-only NumPy arrays mapped onto the
+    column files, so nothing is copied until used. Needs NumPy.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Loading samples needs NumPy, see read() otherwise")
+
+    loaded = []
+    for segment_dir, manifest in segments(directory):
+        columns = {}
+        for name, dtype in manifest['columns']:
+            # Column files may run ahead of a manifest being rewritten, only its rows are mapped
+            columns[name] = numpy.memmap(column_file_name(segment_dir, name), dtype=numpy.dtype(dtype), mode='r',
+                                         shape=(manifest['rows'],))
+        loaded.append(columns)
+
+    return loaded
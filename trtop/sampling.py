@@ -0,0 +1,122 @@
+import time
+import zlib
+import logging
+from flags import event_of, EVENT_SYN
+
+__author__ = 'Thomas Kountis'
+
+
+HASH_RANGE = float(1 << 32)
+
+
+def flow_hash(packet):
+    """
+    Stable hash of the 4-tuple of @packet, the same for both directions of a connection.
+    """
+    return zlib.crc32("{0}:{1}>{2}:{3}".format(packet.local_ip(), packet.ephemeral_port(),
+                                               packet.remote_ip(), packet.remote_port())) & 0xffffffff
+
+
+class AdaptiveFlowSampler(object):
+    """
+    Load shedding by whole flows: a flow is admitted when its 4-tuple hash falls under the current sampling
+    rate, and packets of flows already tracked are always admitted, so sampled connections are complete
+    and their per-connection state stays consistent.
+
+    The rate adapts from the pipeline lag, how far the capture clock has fallen behind the wall clock since
+    the first packet, checked every @interval secs: while the lag exceeds @max_lag secs and keeps growing
+    the rate is halved (down to @min_rate), otherwise it recovers by @step.
+    Counters of admitted flows are scaled up by scale(), the ratio of seen to admitted flows.
+    """
+
+    CHECK_EVERY = 256  # Packets between clock reads
+
+    def __init__(self, max_lag=2.0, min_rate=0.01, step=0.05, interval=1.0):
+        self.max_lag = max_lag
+        self.min_rate = min_rate
+        self.step = step
+        self.interval = interval
+        self.rate = 1.0
+        self.seen_flows = 0
+        self.admitted_flows = 0
+        self.lag = 0.0
+        self._threshold = HASH_RANGE
+        self._packets = 0
+        self._origin = None
+        self._last_check = None
+
+    def admit(self, packet, tracked):
+        """
+        Whether @packet should be analyzed, @tracked being whether its connection is already tracked.
+        """
+        self._packets += 1
+        if self._packets % AdaptiveFlowSampler.CHECK_EVERY == 1:
+            self._check_lag(float(packet.timestamp))
+
+        if tracked:
+            return True
+
+        admitted = flow_hash(packet) < self._threshold
+        if event_of(packet.flags) == EVENT_SYN:  # Also the ECN setup SYN, [SEW]
+            self.seen_flows += 1
+            if admitted:
+                self.admitted_flows += 1
+
+        return admitted
+
+    def _check_lag(self, timestamp):
+        now = time.time()
+        if self._origin is None:
+            self._origin = (now, timestamp)
+            self._last_check = now
+            return
+
+        if now - self._last_check < self.interval:
+            return
+
+        self._last_check = now
+        lag = (now - self._origin[0]) - (timestamp - self._origin[1])
+        if lag > self.max_lag and lag >= self.lag:
+            self._set_rate(max(self.min_rate, self.rate / 2))
+        elif lag <= self.max_lag:
+            self._set_rate(min(1.0, self.rate + self.step))
+        self.lag = lag
+
+    def _set_rate(self, rate):
+        if rate != self.rate:
+            logging.info("Flow sampling rate %.2f (lag %.2f secs)", rate, self.lag)
+        self.rate = rate
+        self._threshold = rate * HASH_RANGE
+
+    def scale(self):
+        if not self.admitted_flows:
+            return 1.0 / self.rate
+
+        return float(self.seen_flows) / self.admitted_flows
+
+
+class ScaledRemoteView(object):
+    """
+    Read-only view of a remote with its counters and rates scaled by @scale, estimating the totals of
+    every flow out of the sampled ones. Latencies and percentiles are left as sampled.
+    """
+
+    SCALED = ["get_syn_count", "get_syn_mean_rate", "get_syn_ack_count", "get_est_count", "get_rst_count",
+              "get_fin_out_count", "get_fin_in_count", "get_est_mean_rate", "get_retransmit_counter",
+              "get_incoming_count", "get_outgoing_count", "get_pkt_err_count", "get_reordered_count"]
+
+    def __init__(self, remote, scale):
+        self.remote = remote
+        self.hostname = remote.hostname
+        self.scale = scale
+
+    def __getattr__(self, name):
+        getter = getattr(self.remote, name)
+        if name not in ScaledRemoteView.SCALED:
+            return getter
+
+        return lambda: self._scaled(getter())
+
+    def _scaled(self, value):
+        scaled = value * self.scale
+        return int(round(scaled)) if isinstance(value, (int, long)) else scaled
@@ -0,0 +1,255 @@
+import os
+import mmap
+import struct
+import logging
+import tempfile
+import threading
+
+from analyzer import BaseAnalyser
+from aggregation import RemoteSummary, FRAME_HEADER, encode_summaries, decode_summaries
+
+__author__ = 'Thomas Kountis'
+
+
+SHM_DIR = "/dev/shm"
+DEFAULT_NAME = "trtop"
+MAGIC = "TRTS"
+VERSION = 1
+# magic, version, sequence, active buffer, buffer capacity, length of buffer 0, length of buffer 1
+# Native sizes and alignment, segments being only shared between processes of the same host
+HEADER = struct.Struct("4sIQIIII")
+# The sequence is written and read as a single aligned 8 byte word, never seen half written
+SEQUENCE = struct.Struct("Q")
+SEQUENCE_OFFSET = 8
+ACTIVE_OFFSET = 16
+LENGTHS_OFFSET = 24
+READ_RETRIES = 64
+
+
+def segment_path(name):
+    """
+    The file of the segment @name, in /dev/shm when available, or @name itself when a path.
+    """
+    if os.sep in name:
+        return name
+
+    directory = SHM_DIR if os.path.isdir(SHM_DIR) else tempfile.gettempdir()
+    return os.path.join(directory, "{0}-{1}".format(DEFAULT_NAME, name))
+
+
+class SharedSnapshot(object):
+    """
+    Memory mapped file holding the latest of a series of payloads, written by a single process and read by any
+    number of others, without locks.
+
+    Payloads alternate between two buffers, so the latest complete one stays readable while the next is written.
+    The sequence in the header is odd while a buffer is being written and even otherwise, like a seqlock:
+    a reader only copies the active buffer while the sequence is even, and retries unless the sequence is still
+    the same once copied.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        magic, version, _, _, self.capacity, _, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a trtop snapshot segment")
+        if version != VERSION:
+            raise ValueError("Unsupported snapshot segment version {0}".format(version))
+
+    @staticmethod
+    def create(path, capacity):
+        """
+        A new segment at @path, with buffers of @capacity bytes, replacing any previous one.
+        The file is only renamed into place once initialized, so readers never see it partially written.
+        """
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w+b') as segment:
+            segment.truncate(HEADER.size + 2 * capacity)
+            segment.write(HEADER.pack(MAGIC, VERSION, 0, 0, capacity, 0, 0))
+            segment.flush()
+            data = mmap.mmap(segment.fileno(), 0)
+        os.rename(tmp_path, path)
+        return SharedSnapshot(path, data)
+
+    @staticmethod
+    def open(path):
+        with open(path, 'rb') as segment:
+            data = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        return SharedSnapshot(path, data)
+
+    def _offset(self, buffer_index):
+        return HEADER.size + buffer_index * self.capacity
+
+    def publish(self, payload):
+        """
+        Returns False when @payload does not fit in a buffer, the previous payload being kept.
+        """
+        if len(payload) > self.capacity:
+            return False
+
+        data = self.data
+        sequence = SEQUENCE.unpack_from(data, SEQUENCE_OFFSET)[0]
+        target = 1 - struct.unpack_from("I", data, ACTIVE_OFFSET)[0]
+        SEQUENCE.pack_into(data, SEQUENCE_OFFSET, sequence + 1)
+        offset = self._offset(target)
+        data[offset:offset + len(payload)] = payload
+        struct.pack_into("I", data, LENGTHS_OFFSET + 4 * target, len(payload))
+        struct.pack_into("I", data, ACTIVE_OFFSET, target)
+        SEQUENCE.pack_into(data, SEQUENCE_OFFSET, sequence + 2)
+        return True
+
+    def read(self):
+        """
+        The (sequence, payload) of the latest complete payload, the payload being None when nothing was published
+        yet or when the writer kept overtaking this reader.
+        """
+        data = self.data
+        for _ in range(READ_RETRIES):
+            sequence = SEQUENCE.unpack_from(data, SEQUENCE_OFFSET)[0]
+            if sequence < 2:
+                return sequence, None
+            if sequence & 1:
+                continue  # Being written
+
+            active = struct.unpack_from("I", data, ACTIVE_OFFSET)[0]
+            length = min(struct.unpack_from("I", data, LENGTHS_OFFSET + 4 * active)[0], self.capacity)
+            payload = self._copy(active, length)
+            if SEQUENCE.unpack_from(data, SEQUENCE_OFFSET)[0] == sequence:
+                return sequence, payload
+
+        return sequence, None
+
+    def _copy(self, buffer_index, length):
+        offset = self._offset(buffer_index)
+        return self.data[offset:offset + length]
+
+    def close(self):
+        self.data.close()
+
+
+class SnapshotPublisher(object):
+    """
+    Publishes the summaries of every remote tracked by @analyzer (see aggregation.RemoteSummary) to the shared
+    segment @name every @interval secs, for any number of `trtop --attach` viewers. The analyzer is only read,
+    so a slow viewer never slows packet processing down. Each of the two buffers holds @capacity_mb.
+    """
+
+    def __init__(self, analyzer, name=DEFAULT_NAME, interval=1, capacity_mb=8):
+        self.analyzer = analyzer
+        self.path = segment_path(name)
+        self.interval = interval
+        self.capacity = capacity_mb * 1024 * 1024
+        self.sequence = 0
+        self.oversized = 0
+        self.segment = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.segment = SharedSnapshot.create(self.path, self.capacity)
+        self._thread = threading.Thread(target=self._run, name="trtop-publisher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.publish()
+
+    def publish(self):
+        try:
+            summaries = [RemoteSummary.from_remote(remote) for remote in self.analyzer.tracked_remotes.values()]
+            self.sequence += 1
+            frame = encode_summaries(DEFAULT_NAME, self.sequence, getattr(self.analyzer, 'last_timestamp', None),
+                                     summaries)
+            if not self.segment.publish(frame[FRAME_HEADER.size:]):
+                self.oversized += 1
+                logging.warning("Snapshot of {0} bytes does not fit {1}".format(len(frame), self.path))
+        except Exception, e:
+            logging.exception("Unable to publish snapshot to {0}".format(self.path))
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+            self.publish()
+
+        if self.segment is not None:
+            self.segment.close()
+            os.remove(self.path)
+            self.segment = None
+
+
+class SnapshotViewer(BaseAnalyser):
+    """
+    Reads the snapshots published to the shared segment @name every @interval secs. Acts as both the analyzer
+    of an ordinary reporter (tracked_remotes, set_observer) and its collector, see aggregation.SummaryAggregator.
+    A segment replaced by a restarted publisher is reopened, and until one shows up nothing is displayed.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, interval=1):
+        BaseAnalyser.__init__(self)
+        self.path = segment_path(name)
+        self.interval = interval
+        self.tracked_remotes = {}
+        self.observer = None
+        self.last_timestamp = None
+        self.sequence = None
+        self.segment = None
+        self._inode = None
+        self._stopped = threading.Event()
+
+    def set_observer(self, observer):
+        self.observer = observer
+
+    def attach(self, runtime):
+        runtime.every(self.interval, self.poll)
+
+    def start(self):
+        while not self._stopped.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        self._stopped.set()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def _reopen(self):
+        try:
+            inode = os.stat(self.path).st_ino
+            if self.segment is None or inode != self._inode:
+                if self.segment is not None:
+                    self.segment.close()
+                self.segment, self._inode, self.sequence = SharedSnapshot.open(self.path), inode, None
+        except (OSError, IOError, ValueError), e:
+            logging.debug("No snapshot segment at {0}: {1}".format(self.path, e))
+
+        return self.segment
+
+    def poll(self):
+        """
+        Returns whether a new snapshot was read.
+        """
+        segment = self._reopen()
+        if segment is None:
+            return False
+
+        sequence, payload = segment.read()
+        if payload is None or sequence == self.sequence:
+            return False
+
+        self.sequence = sequence
+        _, _, self.last_timestamp, summaries = decode_summaries(payload)
+        remotes = dict((summary.hostname, summary) for summary in summaries)
+        for hostname in set(self.tracked_remotes.keys()) - set(remotes.keys()):
+            evicted = self.tracked_remotes.pop(hostname)
+            if self.observer is not None:
+                self.observer.handle_remote_evicted(evicted)
+
+        for hostname, summary in remotes.items():
+            self.tracked_remotes[hostname] = summary
+            if self.observer is not None:
+                self.observer.handle_remote_event(summary)
+
+        return True
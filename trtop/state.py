@@ -1,12 +1,18 @@
-from appmetrics import metrics
+from windows import Windows, LogHistogram
+from clock import WALL_CLOCK
+from address import display_name, to_text
+from flags import event_of, EVENT_SYN, EVENT_SYN_ACK
 import logging
 
 __author__ = 'Thomas Kountis'
 
-TCP_FLAG_SYN = 'S'
-TCP_FLAG_SYN_ACK = 'S.'
-TCP_FLAG_ACK = '.'
-TCP_FLAG_PSH_ACK = 'P.'
+# Phases of a session, the rows of TcpRemoteState.TRANSITIONS
+PHASE_CLOSED = 0  # No session
+PHASE_SYN = 1
+PHASE_SYN_ACK = 2
+PHASE_ESTABLISHED = 3
+PHASE_REQUEST = 4  # Outgoing data seen, the response is expected next
+PHASE_NAMES = ["CLOSED", "SYN", "SYN-ACK", "ESTABLISHED", "REQUEST"]
 
 COUNTER_SYN = "_syn_counter"
 COUNTER_SYN_ACK = "_syn_ack_counter"
@@ -18,71 +24,246 @@ COUNTER_PKT_OUT = "_packet_out_counter"
 COUNTER_PKT_IN = "_packet_in_counter"
 COUNTER_PKT_ERR = "_pkt_err_counter"
 COUNTER_RTRS = "_retransmits_counter"
+COUNTER_REORDERED = "_reordered_counter"
 HISTOGRAM_CONN = "_conn_time_histo"
 HISTOGRAM_TRANSPORT = "_transport_time_histo"
 HISTOGRAM_RT_PER_CONN = "_rt_per_conn_histo"
+HISTOGRAM_TTLB = "_ttlb_histo"
+
+REORDER_WINDOW_PACKETS = 4
+REORDER_WINDOW_SECS = 0.05
+SEQ_MODULO = 1 << 32
+RECENT_SEGMENTS = 8  # Data segments remembered per session, to tell retransmits from late originals
+MAX_OPTION_BYTES = 40  # Of the TCP header, full segments carry the MSS less their options (eg. 12 of timestamps)
+
+SKETCHES = [HISTOGRAM_CONN, HISTOGRAM_TRANSPORT, HISTOGRAM_RT_PER_CONN, HISTOGRAM_TTLB]
+METRICS = [COUNTER_SYN, COUNTER_SYN_ACK, COUNTER_EST, COUNTER_RST, COUNTER_FIN_IN, COUNTER_FIN_OUT, COUNTER_PKT_OUT,
+           COUNTER_PKT_IN, COUNTER_PKT_ERR, COUNTER_RTRS, COUNTER_REORDERED, HISTOGRAM_CONN, HISTOGRAM_TRANSPORT,
+           HISTOGRAM_RT_PER_CONN, HISTOGRAM_TTLB]
+
+
+def _seq_before(a, b):
+    """
+    Whether sequence number @a comes before @b, modulo SEQ_MODULO.
+    """
+    return 0 < (b - a) % SEQ_MODULO < SEQ_MODULO / 2
 
 
 class TcpSessionState:
 
-    def __init__(self, remote_addr, syn_ts=None, local_seq=0):
+    def __init__(self, remote_addr, syn_ts=None, local_seq=0, last_ts=None):
         self.remote_addr = remote_addr
         self.syn_ts = syn_ts
+        self.last_ts = last_ts or syn_ts  # Latest packet, see TcpRemoteState.expire_sessions()
         self.est_ts = 0
-        self.last_known_flag = TCP_FLAG_SYN if syn_ts else None
+        self.phase = PHASE_SYN if syn_ts else PHASE_ESTABLISHED
         self.datagram_out_ts = None
         self.datagram_out_seq = None
         self.rt_packet_count = 0
         self.local_sequence = local_seq
         self.remote_sequence = 0
-
-    def is_untracked_conn(self):
-        return self.last_known_flag is None
-
-    def is_established(self):
-        return self.last_known_flag is not TCP_FLAG_SYN and \
-               self.last_known_flag is not TCP_FLAG_SYN_ACK
+        self.pending = None  # Out of order packets, held until the ones they acknowledge show up
+        self.ring = None  # Latest packets, see outliers.OutlierRecorder
+        self.segments = None  # Ring of the RECENT_SEGMENTS latest (outgoing, start, end) data segments
+        self.next_segment = 0
+        self.retransmitted = False  # Since the last request, its latency is then ambiguous (Karn's algorithm)
+        self.mss = None  # Of incoming segments, as advertised by the SYN
+        self.full_segment = None  # Length of the largest incoming data segment seen, ie. of full segments
+        self.responded = False  # To the latest request, so the next outgoing data is a new request
+        self.response_ts = None  # First segment of a response still in progress
+        self.response_last_ts = None
 
     def __str__(self):
         return "{0} {1} - rt: {2} loc_seq: {3}, rem_seq: {4}"\
-            .format(self.remote_addr, self.last_known_flag, self.rt_packet_count,
+            .format(to_text(self.remote_addr), PHASE_NAMES[self.phase], self.rt_packet_count,
                     self.local_sequence, self.remote_sequence)
 
 
 class TcpRemoteState(object):
 
-        def __init__(self, hostname):
+        def __init__(self, hostname, clock=WALL_CLOCK):
+            from appmetrics import metrics  # Imported with the first remote, see pipeline.build()
+
             self.hostname = hostname
-            self.syn_counter = metrics.new_meter(str(hostname) + COUNTER_SYN)
-            self.syn_ack_counter = metrics.new_meter(str(hostname) + COUNTER_SYN_ACK)
-            self.est_counter = metrics.new_meter(str(hostname) + COUNTER_EST)
-            self.resets_counter = metrics.new_meter(str(hostname) + COUNTER_RST)
-            self.fin_in_counter = metrics.new_meter(str(hostname) + COUNTER_FIN_IN)
-            self.fin_out_counter = metrics.new_meter(str(hostname) + COUNTER_FIN_OUT)
-            self.connection_time = metrics.new_histogram(str(hostname) + HISTOGRAM_CONN)
-            self.outgoing_packets = metrics.new_meter(str(hostname) + COUNTER_PKT_OUT)
-            self.incoming_packets = metrics.new_meter(str(hostname) + COUNTER_PKT_IN)
-            self.transport_time = metrics.new_histogram(str(hostname) + HISTOGRAM_TRANSPORT)
-            self.rt_per_conn_counter = metrics.new_histogram(str(hostname) + HISTOGRAM_RT_PER_CONN)
-            self.pkt_err_counter = metrics.new_counter(str(hostname) + COUNTER_PKT_ERR)
-            self.retransmits_counter = metrics.new_counter(str(hostname) + COUNTER_RTRS)
+            self.metrics_prefix = display_name(hostname)  # The hostname may be renamed once resolved
+            self.clock = clock
+            self.started_on = clock.now()  # Mean rates are over the time elapsed since, see clock.py
+            self.syn_counter = metrics.new_meter(self.metrics_prefix + COUNTER_SYN)
+            self.syn_ack_counter = metrics.new_meter(self.metrics_prefix + COUNTER_SYN_ACK)
+            self.est_counter = metrics.new_meter(self.metrics_prefix + COUNTER_EST)
+            self.resets_counter = metrics.new_meter(self.metrics_prefix + COUNTER_RST)
+            self.fin_in_counter = metrics.new_meter(self.metrics_prefix + COUNTER_FIN_IN)
+            self.fin_out_counter = metrics.new_meter(self.metrics_prefix + COUNTER_FIN_OUT)
+            self.connection_time = metrics.new_histogram(self.metrics_prefix + HISTOGRAM_CONN)
+            self.outgoing_packets = metrics.new_meter(self.metrics_prefix + COUNTER_PKT_OUT)
+            self.incoming_packets = metrics.new_meter(self.metrics_prefix + COUNTER_PKT_IN)
+            self.transport_time = metrics.new_histogram(self.metrics_prefix + HISTOGRAM_TRANSPORT)
+            self.rt_per_conn_counter = metrics.new_histogram(self.metrics_prefix + HISTOGRAM_RT_PER_CONN)
+            self.ttlb_time = metrics.new_histogram(self.metrics_prefix + HISTOGRAM_TTLB)
+            self.pkt_err_counter = metrics.new_counter(self.metrics_prefix + COUNTER_PKT_ERR)
+            self.retransmits_counter = metrics.new_counter(self.metrics_prefix + COUNTER_RTRS)
+            self.reordered_counter = metrics.new_counter(self.metrics_prefix + COUNTER_REORDERED)
+            self.windows = Windows()
+            # Mergeable counterparts of the histograms, see aggregation.py
+            self.sketches = dict((name, LogHistogram()) for name in SKETCHES)
             self.states = {}
-
-        def verify_and_track_seq(self, packet):
+            self.recorder = None  # See outliers.OutlierRecorder
+            self.sink = None  # See samples.SampleSink
+
+        def release(self):
+            """
+            Unregisters the metrics of this remote, after which the same hostname can be tracked again.
+            """
+            from appmetrics import metrics
+
+            for metric in METRICS:
+                metrics.delete_metric(self.metrics_prefix + metric)
+
+            self.states.clear()
+
+        def process(self, packet):
+            """
+            Runs @packet, and any held packets it unblocked, through the session state machine: the handler of
+            TRANSITIONS[phase of the session][event of the flags] is called with the session, looked up once.
+            Returns whether any statistics changed.
+            """
             state = self.states.get(packet.ephemeral_port())
+            event = event_of(packet.flags)
             if state is None:
-                return True
+                return self._transition(None, self.TRANSITIONS[PHASE_CLOSED][event], packet)
 
-            curr_seq = state.remote_sequence if packet.is_outgoing() else state.local_sequence
-            if curr_seq + 1 == packet.ack or curr_seq == packet.ack:
+            handled = False
+            for ready in self.verify_and_track_seq(packet, state, event):
+                if ready is not packet:
+                    # Replayed held packet, the session may have been closed by the ones before it
+                    state = self.states.get(ready.ephemeral_port())
+                    event = event_of(ready.flags)
+                handler = self.TRANSITIONS[state.phase if state is not None else PHASE_CLOSED][event]
+                handled = self._transition(state, handler, ready) or handled
+
+            return handled
+
+        def _transition(self, state, handler, packet):
+            if self.recorder is None:
+                return handler(self, state, packet)
+
+            # Recorded before processing, outliers are checked while processing, or once opened by a SYN
+            if state is not None:
+                self.recorder.record(state, packet)
+                return handler(self, state, packet)
+
+            handled = handler(self, state, packet)
+            state = self.states.get(packet.ephemeral_port())
+            if state is not None:
+                self.recorder.record(state, packet)
+            return handled
+
+        def verify_and_track_seq(self, packet, state, event):
+            """
+            Returns the packets ready to be processed, in sequence order: @packet of the session @state, followed
+            by any held packets it unblocked. A packet acknowledging data not seen yet (eg. reordered by a
+            multi-queue NIC) is held in the session reorder window, bounded by REORDER_WINDOW_PACKETS and
+            REORDER_WINDOW_SECS of capture time, and an empty list is returned. Packets that cannot be placed kill
+            the session. Retransmitted packets are counted and dropped, see _is_retransmit().
+            """
+            state.last_ts = packet.timestamp
+
+            if self._is_retransmit(state, packet, event):
+                state.retransmitted = True
+                self.retransmits_counter.notify(1)
+                self.windows.count(COUNTER_RTRS, packet.timestamp)
+                logging.debug("Retransmitted packet {0} during state {1}".format(packet, state))
+                return []
+
+            if state.pending and float(packet.timestamp) - float(state.pending[0].timestamp) > REORDER_WINDOW_SECS:
+                return self._invalidate(state, packet, "reorder window expired")
+
+            if self._is_in_sequence(state, packet):
                 self._track_sequence(state, packet)
-                return True
+                ready = [packet]
+                while state.pending:
+                    replayed = [held for held in state.pending if self._is_in_sequence(state, held)]
+                    if not replayed:
+                        break
+
+                    for held in replayed:
+                        state.pending.remove(held)
+                        self._track_sequence(state, held)
+                        self.reordered_counter.notify(1)
+                        self.windows.count(COUNTER_REORDERED, held.timestamp)
+                        ready.append(held)
+
+                return ready
+
+            if self._is_ahead(state, packet) and len(state.pending or ()) < REORDER_WINDOW_PACKETS:
+                if state.pending is None:
+                    state.pending = []
+                state.pending.append(packet)
+                logging.debug("Holding out of order packet {0} during state {1}".format(packet, state))
+                return []
+
+            return self._invalidate(state, packet, "SEQ verification failed")
+
+        def expire_sessions(self, now, timeout):
+            """
+            Forgets the sessions without packets for @timeout secs of capture time before @now, eg. connections
+            whose closing packets were never captured, which would otherwise be kept forever.
+            Returns the number of expired sessions.
+            """
+            expired = [port for port, state in self.states.items()
+                       if now - float(state.last_ts or 0) > timeout]
+            for port in expired:
+                logging.debug("Expiring idle session {0} during state {1}".format(port, self.states[port]))
+                del self.states[port]
+
+            return len(expired)
+
+        def _invalidate(self, state, packet, reason):
+            self._count_error(packet)
+            logging.debug("{0} for packet {1} during state {2}".format(reason, packet, state))
+            del self.states[packet.ephemeral_port()]
+            return []
 
+        def _count_error(self, packet):
             self.pkt_err_counter.notify(1)
-            logging.debug("SEQ verification failed for packet {0} during state {1}".format(packet, state))
-            del self.states[packet.ephemeral_port()]
+            self.windows.count(COUNTER_PKT_ERR, packet.timestamp)
+
+        @staticmethod
+        def _is_retransmit(state, packet, event):
+            """
+            Whether @packet repeats a SYN, a SYN-ACK, or data overlapping one of the RECENT_SEGMENTS latest data
+            segments of its direction. Data below the highest sequence that overlaps none of them is a late
+            original, eg. reordered, and is not a retransmit.
+            """
+            if event == EVENT_SYN:
+                return state.phase == PHASE_SYN and packet.sequence == state.local_sequence
+            if event == EVENT_SYN_ACK:
+                return state.phase != PHASE_SYN and packet.sequence == state.remote_sequence
+            if not packet.length or not state.segments:
+                return False
+
+            outgoing = packet.is_outgoing()
+            end = packet.sequence
+            start = end - packet.length
+            for segment in state.segments:
+                if segment[0] == outgoing and _seq_before(start, segment[2]) and _seq_before(segment[1], end):
+                    return True
+
             return False
 
+        @staticmethod
+        def _is_in_sequence(state, packet):
+            curr_seq = state.remote_sequence if packet.is_outgoing() else state.local_sequence
+            return curr_seq + 1 == packet.ack or curr_seq == packet.ack
+
+        @staticmethod
+        def _is_ahead(state, packet):
+            curr_seq = state.remote_sequence if packet.is_outgoing() else state.local_sequence
+            if not curr_seq:
+                return True  # Remote sequence not seen yet, eg. ACK captured before the SYN-ACK
+
+            return 0 < (packet.ack - curr_seq) % SEQ_MODULO < SEQ_MODULO / 2
+
         def _track_sequence(self, state, packet):
             if packet.is_ack_only():  # ACK only packet - No SEQ included.
                 return
@@ -92,135 +273,222 @@ class TcpRemoteState(object):
             else:
                 state.remote_sequence = packet.sequence
 
-        def process_syn(self, packet):
-            state = self.states.get(packet.ephemeral_port())
-            if state is None:
-                self.states[packet.ephemeral_port()] = TcpSessionState(packet.remote_ip(), packet.timestamp, packet.sequence)
-                self.syn_counter.notify(1)
-                return True
-            else:
-                self.pkt_err_counter.notify(1)
-                #TODO handle re-transmits upto 20secs /sysctl/ -- net.ipv4.tcp_syn_retries
-                warning("--ERROR({0})-- incorrect state {1} for new bit {2} identified for a given packet {3}."
-                        .format("handle_syn", state, TCP_FLAG_SYN, packet))
+            if packet.length:
+                if state.segments is None:
+                    state.segments = [(None, 0, 0)] * RECENT_SEGMENTS
+                state.segments[state.next_segment] = (packet.is_outgoing(), packet.sequence - packet.length,
+                                                      packet.sequence)
+                state.next_segment = (state.next_segment + 1) % RECENT_SEGMENTS
+
+        # Handlers of the TRANSITIONS, called with the session of the packet, None in PHASE_CLOSED
+
+        def _ignore(self, state, packet):
             return False
 
-        def process_syn_ack(self, packet):
-            state = self.states.get(packet.ephemeral_port())
-            if state is None:
-                # Ignore packet if not seen SYN before hand / old connection!
-                return False
-            elif TCP_FLAG_SYN == state.last_known_flag:
-                state.last_known_flag = TCP_FLAG_SYN_ACK
-                self.syn_ack_counter.notify(1)
-                return True
-            else:
-                self.pkt_err_counter.notify(1)
-                warning("--ERROR({0})-- incorrect state {1} for new bit {2} identified for a given packet {3}."
-                        .format("handle_syn_ack", state, TCP_FLAG_SYN_ACK, packet))
+        def _unexpected(self, state, packet):
+            self._count_error(packet)
+            warning("--ERROR--: incorrect state {0} for flags {1} identified for a given packet {2}."
+                    .format(state, packet.flags, packet))
             return False
 
-        def process_ack(self, packet):
-            # TODO handle ACK with Data packets (no PUSH flag) len > 0
-            state = self.states.get(packet.ephemeral_port())
-            if state is None:
-                # Ignore
-                return False
-            elif TCP_FLAG_SYN_ACK == state.last_known_flag:
-                state.last_known_flag = TCP_FLAG_ACK
-                state.est_ts = packet.timestamp
-                duration = ((float(packet.timestamp) * 1e6) - (float(state.syn_ts) * 1e6)) / 1000  # us to ms
-                self.connection_time.notify(duration)
-                self.est_counter.notify(1)
-                return True
-            else:
-                # Ignore ACKs (only) following states other than SYN
-                # Sequence is tracked anyway, they offer no other useful information
-                return False
+        def _open(self, state, packet):
+            state = TcpSessionState(packet.remote_ip(), packet.timestamp, packet.sequence)
+            state.mss = packet.mss  # The largest segment the remote may send
+            self.states[packet.ephemeral_port()] = state
+            self.syn_counter.notify(1)
+            self.windows.count(COUNTER_SYN, packet.timestamp)
+            return True
 
-        def process_psh(self, packet, fin=False):
-            state = self.states.get(packet.ephemeral_port())
+        def _syn_ack(self, state, packet):
+            state.phase = PHASE_SYN_ACK
+            self.syn_ack_counter.notify(1)
+            self.windows.count(COUNTER_SYN_ACK, packet.timestamp)
+            return True
 
-            incoming = not packet.is_outgoing()
-            if incoming and state is not None:
-                if TCP_FLAG_PSH_ACK == state.last_known_flag:  # Expect request before response
-                    # If length > 1400 then its more than one segment, so wait for next before finalizing duration
-                    # TODO figure a dynamic way of identifying the 1400 value, looks like MSS - 60 or sysctl value?
-                    if packet.length >= 1400:
-                        return False
+        def _establish(self, state, packet):
+            state.phase = PHASE_ESTABLISHED
+            state.est_ts = packet.timestamp
+            if not state.retransmitted:
+                duration = self._duration(state.syn_ts, packet.timestamp)
+                self.connection_time.notify(duration)
+                self.sketches[HISTOGRAM_CONN].notify(duration)
+                self.windows.sample(HISTOGRAM_CONN, packet.timestamp, duration)
+                if self.recorder is not None:
+                    self.recorder.check(self, state, HISTOGRAM_CONN, duration, packet)
+                if self.sink is not None:
+                    self.sink.sample(self, packet.ephemeral_port(), HISTOGRAM_CONN, packet.timestamp, duration)
+            state.retransmitted = False
+            self.est_counter.notify(1)
+            self.windows.count(COUNTER_EST, packet.timestamp)
+            return True
 
-                    outgoing_ts = state.datagram_out_ts
-                    duration = ((float(packet.timestamp) * 1e6) - (float(outgoing_ts) * 1e6)) / 1000  # us to ms
-                    state.rt_packet_count += 1
+        def _ack(self, state, packet):
+            if packet.length:
+                # Data without PUSH, eg. the leading segments of a multi-segment request or response
+                return self._data(state, packet)
 
-                    self.transport_time.notify(duration)
-                    self.incoming_packets.notify(1)
-                else:
-                    self.pkt_err_counter.notify(1)
-
-            elif packet.is_outgoing():
-                # Start tracking connection from first identified outgoing PUSH.
-                # TODO have that as a flag for trtop (track existing)
-                if state is None:
-                    self.states[packet.ephemeral_port()] = \
-                        TcpSessionState(packet.remote_ip(), local_seq=packet.sequence)
-                    state = self.states.get(packet.ephemeral_port())
-
-                if state.is_untracked_conn() or state.is_established():
-                    # TODO Should save the flag as seen in the packet, not hard-coded TCP_FLAG_PSH_ACK
-                    state.last_known_flag = TCP_FLAG_PSH_ACK
-                    state.datagram_out_ts = packet.timestamp
-
-                    if packet.length >= 1400:
-                        return False
-
-                    self.outgoing_packets.notify(1)
-                else:
-                    self.pkt_err_counter.notify(1)
-            else:
-                self.pkt_err_counter.notify(1)
-                warning("--ERROR({0})-- incorrect state {1} -- outgoing {2}."
-                        .format("handle_psh", state, packet.is_outgoing()))
+            # ACKs only carry the sequence, already tracked
+            return False
 
-            if fin and state:
-                self._track_rt_per_connection(packet.ephemeral_port())
-                del self.states[packet.ephemeral_port()]
-                self.fin_out_counter.notify(1) if packet.is_outgoing() else self.fin_in_counter.notify(1)
+        def _pick_up(self, state, packet):
+            """
+            Data of a connection opened before the capture, tracked from its first outgoing segment.
+            """
+            if not packet.is_outgoing():
+                self._count_error(packet)
+                warning("--ERROR--: incoming data {0} of an untracked connection.".format(packet))
+                return True
 
+            # TODO have that as a flag for trtop (track existing)
+            state = TcpSessionState(packet.remote_ip(), local_seq=packet.sequence, last_ts=packet.timestamp)
+            self.states[packet.ephemeral_port()] = state
+            self._track_request(state, packet)
             return True
 
-        def process_rst(self, packet):
+        def _pick_up_and_close(self, state, packet):
+            self._pick_up(state, packet)
             state = self.states.get(packet.ephemeral_port())
-            if state is None:
-                # Ignore
-                return False
+            if state is not None:
+                self._close(state, packet)
+            return True
+
+        def _early_data(self, state, packet):
+            # Data before the handshake completed
+            self._count_error(packet)
+            return True
+
+        def _data(self, state, packet):
+            if packet.is_outgoing():
+                self._track_request(state, packet)
+            elif state.phase == PHASE_REQUEST:  # Expect request before response
+                self._track_response(state, packet)
             else:
-                del self.states[packet.ephemeral_port()]
-                self.resets_counter.notify(1)
-                return True
+                self._count_error(packet)
+            return True
 
-        def process_fin(self, packet):
-            state = self.states.get(packet.ephemeral_port())
-            if state is None:
-                # Ignore
-                return False
+        def _early_data_and_close(self, state, packet):
+            self._early_data(state, packet)
+            return self._close(state, packet)
 
+        def _data_and_close(self, state, packet):
+            self._data(state, packet)
+            return self._close(state, packet)
+
+        def _close(self, state, packet):
             # TODO deleting will make followup FIN exchanges to not be monitored - feature not a bug.
-            self._track_rt_per_connection(packet.ephemeral_port())
+            self._finish_response(state, packet)
+            self._track_rt_per_connection(state)
             del self.states[packet.ephemeral_port()]
             self.fin_out_counter.notify(1) if packet.is_outgoing() else self.fin_in_counter.notify(1)
+            self.windows.count(COUNTER_FIN_OUT if packet.is_outgoing() else COUNTER_FIN_IN, packet.timestamp)
+            return True
+
+        def _reset(self, state, packet):
+            del self.states[packet.ephemeral_port()]
+            self.resets_counter.notify(1)
+            self.windows.count(COUNTER_RST, packet.timestamp)
             return True
 
-        def _track_rt_per_connection(self, local_port):
-            pkt_count = self.states[local_port].rt_packet_count
+        # Handler of each event (see flags.py) in each phase, replaceable by subclasses
+        # SYN, SYN-ACK, ACK, DATA, FIN-DATA, FIN, RST, INVALID
+        TRANSITIONS = [
+            # PHASE_CLOSED, SYN-ACKs, ACKs and FINs of connections opened before the capture are ignored
+            [_open, _ignore, _ignore, _pick_up, _pick_up_and_close, _ignore, _ignore, _ignore],
+            # PHASE_SYN, SYN retransmits never get here (see _is_retransmit()), this is a new connection on a
+            # port in use
+            [_unexpected, _syn_ack, _ignore, _early_data, _early_data_and_close, _close, _reset, _unexpected],
+            # PHASE_SYN_ACK
+            [_unexpected, _unexpected, _establish, _early_data, _early_data_and_close, _close, _reset, _unexpected],
+            # PHASE_ESTABLISHED
+            [_unexpected, _unexpected, _ack, _data, _data_and_close, _close, _reset, _unexpected],
+            # PHASE_REQUEST
+            [_unexpected, _unexpected, _ack, _data, _data_and_close, _close, _reset, _unexpected],
+        ]
+
+        def _track_request(self, state, packet):
+            """
+            Outgoing data segment of @packet. The first segment after a response, or after the handshake, starts a
+            new request, closing the response to the previous one. Latencies are timed from the last segment.
+            """
+            new_request = state.phase != PHASE_REQUEST or state.responded
+            self._finish_response(state, packet)
+            state.phase = PHASE_REQUEST
+            state.datagram_out_ts = packet.timestamp
+            if not new_request:
+                return
+
+            state.responded = False
+            state.retransmitted = False
+            self.outgoing_packets.notify(1)
+            self.windows.count(COUNTER_PKT_OUT, packet.timestamp)
+
+        def _track_response(self, state, packet):
+            """
+            Incoming data segment of @packet. The first segment of a response is sampled as its transport (time to
+            first byte), and the first segment shorter than the full segments of the session completes it, see
+            _finish_response(). Full segments are the largest ones seen, as TCP options take a part of the MSS.
+            """
+            if state.response_ts is None:
+                state.response_ts = packet.timestamp
+                state.responded = True
+                state.rt_packet_count += 1
+                if not state.retransmitted:
+                    duration = self._duration(state.datagram_out_ts, packet.timestamp)
+                    self.transport_time.notify(duration)
+                    self.sketches[HISTOGRAM_TRANSPORT].notify(duration)
+                    self.windows.sample(HISTOGRAM_TRANSPORT, packet.timestamp, duration)
+                    if self.recorder is not None:
+                        self.recorder.check(self, state, HISTOGRAM_TRANSPORT, duration, packet)
+                    if self.sink is not None:
+                        self.sink.sample(self, packet.ephemeral_port(), HISTOGRAM_TRANSPORT, packet.timestamp, duration)
+                self.incoming_packets.notify(1)
+                self.windows.count(COUNTER_PKT_IN, packet.timestamp)
+
+            state.response_last_ts = packet.timestamp
+            full_segment = state.full_segment
+            if full_segment is None and state.mss is not None:
+                full_segment = state.mss - MAX_OPTION_BYTES  # Until a full segment is seen
+            if state.full_segment is None or packet.length > state.full_segment:
+                state.full_segment = packet.length
+            if full_segment is not None and packet.length < full_segment:
+                self._finish_response(state, packet)
+
+        def _finish_response(self, state, packet):
+            """
+            Samples the time to last byte of the response in progress in @state, if any, on the arrival of @packet.
+            A response ending on a full segment is only known to be complete once the next request or the FIN shows up.
+            """
+            if state.response_ts is None:
+                return
+
+            if not state.retransmitted:
+                duration = self._duration(state.datagram_out_ts, state.response_last_ts)
+                self.ttlb_time.notify(duration)
+                self.sketches[HISTOGRAM_TTLB].notify(duration)
+                self.windows.sample(HISTOGRAM_TTLB, state.response_last_ts, duration)
+                if self.sink is not None:
+                    self.sink.sample(self, packet.ephemeral_port(), HISTOGRAM_TTLB, state.response_last_ts, duration)
+            state.response_ts = None
+
+        @staticmethod
+        def _duration(start_ts, end_ts):
+            return ((float(end_ts) * 1e6) - (float(start_ts) * 1e6)) / 1000  # us to ms
+
+        def _track_rt_per_connection(self, state):
+            pkt_count = state.rt_packet_count
             if pkt_count > 0:
                 self.rt_per_conn_counter.notify(pkt_count)
+                self.sketches[HISTOGRAM_RT_PER_CONN].notify(pkt_count)
 
         def get_syn_count(self):
             return self.syn_counter.get()['count']
 
+        def _mean_rate(self, meter):
+            elapsed = self.clock.now() - self.started_on
+            return meter.count / elapsed if elapsed > 0 else 0.0
+
         def get_syn_mean_rate(self):
-            return self.syn_counter.get()['mean']
+            return self._mean_rate(self.syn_counter)
 
         def get_syn_ack_count(self):
             return self.syn_ack_counter.get()['count']
@@ -238,7 +506,7 @@ class TcpRemoteState(object):
             return self.fin_in_counter.get()['count']
 
         def get_est_mean_rate(self):
-            return self.est_counter.get()['mean']
+            return self._mean_rate(self.est_counter)
 
         def get_retransmit_counter(self):
             return self.retransmits_counter.get()['value']
@@ -258,6 +526,9 @@ class TcpRemoteState(object):
         def get_transport_rtt_95th(self):
             return self.transport_time.get()['percentile'][3][1]
 
+        def get_transport_ttlb_95th(self):
+            return self.ttlb_time.get()['percentile'][3][1]
+
         def get_incoming_count(self):
             return self.incoming_packets.get()['count']
 
@@ -271,6 +542,16 @@ class TcpRemoteState(object):
         def get_pkt_err_count(self):
             return self.pkt_err_counter.get()['value']
 
+        def get_reordered_count(self):
+            return self.reordered_counter.get()['value']
+
+        def window_view(self, window, now):
+            """
+            A view of this remote exposing the same getters, computed over the sliding @window (see Windows.NAMES)
+            ending at capture time @now.
+            """
+            return WindowedRemoteView(self, self.windows.get(window), now)
+
         def __str__(self):
             return "Host: {0} attempts: {1}, established: {2}, resets: {3}, success: {4:.2f}% | " \
                    "rate: {5:.2f}/s, mean_time: {6:.2f}ms, 99th_time: {7:.2f}ms, " \
@@ -284,5 +565,109 @@ class TcpRemoteState(object):
                         self.get_conn_latency_min(), self.get_conn_latency_max())
 
 
+class WindowedRemoteView(object):
+    """
+    Read-only view of a TcpRemoteState over one of its sliding windows.
+    Counts and percentiles come from the window, rates are per second over the window span.
+    """
+
+    def __init__(self, remote, window, now):
+        self.remote = remote
+        self.hostname = remote.hostname
+        self.window = window
+        self.now = float(now) if now is not None else 0.0
+
+    def _count(self, name):
+        return self.window.get_count(name, self.now)
+
+    def get_syn_count(self):
+        return self._count(COUNTER_SYN)
+
+    def get_syn_mean_rate(self):
+        return self.window.get_rate(COUNTER_SYN, self.now)
+
+    def get_syn_ack_count(self):
+        return self._count(COUNTER_SYN_ACK)
+
+    def get_est_count(self):
+        return self._count(COUNTER_EST)
+
+    def get_rst_count(self):
+        return self._count(COUNTER_RST)
+
+    def get_fin_out_count(self):
+        return self._count(COUNTER_FIN_OUT)
+
+    def get_fin_in_count(self):
+        return self._count(COUNTER_FIN_IN)
+
+    def get_est_mean_rate(self):
+        return self.window.get_rate(COUNTER_EST, self.now)
+
+    def get_retransmit_counter(self):
+        return self._count(COUNTER_RTRS)
+
+    def get_conn_latency_mean(self):
+        return self.window.get_histogram(HISTOGRAM_CONN, self.now).mean()
+
+    def get_conn_latency_95th(self):
+        return self.window.get_histogram(HISTOGRAM_CONN, self.now).percentile(95)
+
+    def get_conn_latency_min(self):
+        return self.window.get_histogram(HISTOGRAM_CONN, self.now).min or 0
+
+    def get_conn_latency_max(self):
+        return self.window.get_histogram(HISTOGRAM_CONN, self.now).max or 0
+
+    def get_transport_rtt_95th(self):
+        return self.window.get_histogram(HISTOGRAM_TRANSPORT, self.now).percentile(95)
+
+    def get_transport_ttlb_95th(self):
+        return self.window.get_histogram(HISTOGRAM_TTLB, self.now).percentile(95)
+
+    def get_incoming_count(self):
+        return self._count(COUNTER_PKT_IN)
+
+    def get_outgoing_count(self):
+        return self._count(COUNTER_PKT_OUT)
+
+    def get_rt_per_conn_95th(self):
+        return self.remote.get_rt_per_conn_95th()
+
+    def get_pkt_err_count(self):
+        return self._count(COUNTER_PKT_ERR)
+
+    def get_reordered_count(self):
+        return self._count(COUNTER_REORDERED)
+
+
+def snapshot(remote):
+    """
+    Plain dict of the statistics of @remote, a TcpRemoteState or any object exposing the same getters.
+    """
+    return dict(
+        host=display_name(remote.hostname),
+        syn=remote.get_syn_count(),
+        syn_rate=remote.get_syn_mean_rate(),
+        syn_ack=remote.get_syn_ack_count(),
+        est=remote.get_est_count(),
+        est_rate=remote.get_est_mean_rate(),
+        rst=remote.get_rst_count(),
+        fin_out=remote.get_fin_out_count(),
+        fin_in=remote.get_fin_in_count(),
+        qos_95th=remote.get_rt_per_conn_95th(),
+        conn_latency_mean=remote.get_conn_latency_mean(),
+        conn_latency_95th=remote.get_conn_latency_95th(),
+        conn_latency_min=remote.get_conn_latency_min(),
+        conn_latency_max=remote.get_conn_latency_max(),
+        out=remote.get_outgoing_count(),
+        incoming=remote.get_incoming_count(),
+        rtt_95th=remote.get_transport_rtt_95th(),
+        ttlb_95th=remote.get_transport_ttlb_95th(),
+        err=remote.get_pkt_err_count(),
+        reordered=remote.get_reordered_count(),
+        retransmits=remote.get_retransmit_counter())
+
+
 def warning(msg):
     logging.warning(msg)
@@ -0,0 +1,97 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+import threading
+
+from state import snapshot
+
+__author__ = 'Thomas Kountis'
+
+
+def write_snapshot(output, remotes, capture_ts=None):
+    """
+    Appends one JSON line per remote to the @output file object.
+    Returns the number of bytes written.
+    """
+    now = time.time()
+    written = 0
+    for remote in remotes:
+        entry = snapshot(remote)
+        entry['ts'] = now
+        entry['capture_ts'] = capture_ts
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        output.write(line)
+        written += len(line)
+
+    return written
+
+
+class SummaryWriter(object):
+    """
+    Periodically appends per-remote snapshots of the analyzer state, as JSON lines, to
+    <@filename_prefix>.trtop.jsonl from a background thread.
+    Once the file grows beyond @max_bytes it is rolled to .1, .2, ... (gzip compressed with @compress),
+    keeping at most @max_files rolled files so disk usage stays capped.
+    """
+
+    def __init__(self, analyzer, filename_prefix, interval=10, max_bytes=64 * 1024 * 1024, max_files=4,
+                 compress=False):
+        self.analyzer = analyzer
+        self.filename = "{0}.trtop.jsonl".format(filename_prefix)
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.compress = compress
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="trtop-summary")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            with open(self.filename, 'a') as output:
+                write_snapshot(output, self.analyzer.tracked_remotes.values(),
+                               getattr(self.analyzer, 'last_timestamp', None))
+                size = output.tell()
+
+            if size > self.max_bytes:
+                self._roll()
+        except Exception, e:
+            logging.exception("Unable to write summary {0}".format(self.filename))
+
+    def _rolled_filename(self, index):
+        return "{0}.{1}{2}".format(self.filename, index, ".gz" if self.compress else "")
+
+    def _roll(self):
+        oldest = self._rolled_filename(self.max_files)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+
+        for index in range(self.max_files - 1, 0, -1):
+            if os.path.exists(self._rolled_filename(index)):
+                os.rename(self._rolled_filename(index), self._rolled_filename(index + 1))
+
+        if self.compress:
+            with open(self.filename, 'rb') as source:
+                with gzip.open(self._rolled_filename(1), 'wb') as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+            os.remove(self.filename)
+        else:
+            os.rename(self.filename, self._rolled_filename(1))
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+
+        self.write()
@@ -1 +1,14 @@
+import importlib
+
 __author__ = 'Thomas Kountis'
+
+
+# "trtop." when imported as a package (see pipeline.build), empty when trtop/ itself is on the path (the CLI)
+PARENT = __name__[:-len("tcpdump")]
+
+
+def parent_module(name):
+    """
+    The trtop module @name, however this package was imported.
+    """
+    return importlib.import_module(PARENT + name)
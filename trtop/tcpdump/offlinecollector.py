@@ -1,23 +1,107 @@
 import threading
 import subprocess
 import os
+import errno
+import fcntl
+import time
 import signal
 import logging
+from collections import deque
 
-from collector import BaseCollector
-from parser import is_valid_line, build_packet
+from . import parent_module
+from parser import parse_line
+
+BaseCollector = parent_module("collector").BaseCollector
+pcap = parent_module("pcap")
 
 __author__ = 'Thomas Kountis'
 
 
+COMPRESSIONS = [("\x1f\x8b", "gzip"), ("BZh", "bz2"), ("\xfd7zXZ\x00", "xz")]  # Magic bytes
+DECOMPRESS_READ_SIZE = 1024 * 1024
+
+
+def detect_compression(file_name):
+    """
+    The compression of @file_name as named in COMPRESSIONS, by its magic bytes, or None when not compressed.
+    """
+    with open(file_name, 'rb') as capture:
+        head = capture.read(max(len(magic) for magic, _ in COMPRESSIONS))
+
+    for magic, compression in COMPRESSIONS:
+        if head.startswith(magic):
+            return compression
+
+    return None
+
+
+def open_decompressed(file_name, compression):
+    """
+    File object reading @file_name decompressed as a stream. xz needs the lzma module (backports.lzma on
+    Python 2), or falls back to the xz command.
+    """
+    if compression == "gzip":
+        import gzip
+        return gzip.GzipFile(file_name, 'rb')
+    if compression == "bz2":
+        import bz2
+        return bz2.BZ2File(file_name, 'rb', buffering=DECOMPRESS_READ_SIZE)
+    if compression == "xz":
+        try:
+            from backports import lzma
+        except ImportError:
+            try:
+                import lzma
+            except ImportError:
+                lzma = None
+        if lzma is not None:
+            return lzma.LZMAFile(file_name, 'rb')
+
+        return subprocess.Popen(["xz", "-dc", file_name], stdout=subprocess.PIPE,
+                                bufsize=DECOMPRESS_READ_SIZE).stdout
+
+    raise ValueError("Unknown compression {0}".format(compression))
+
+
 class TCPDumpFileCollector(BaseCollector):
+    """
+    Reads a pcap file through tcpdump. Compressed captures (gzip, bz2 or xz) are decompressed as a stream
+    by a feeder thread writing to the stdin of tcpdump, so decompression overlaps the analysis and needs
+    no scratch space.
+
+    With @build_index the records of every remote are indexed while the capture is read, see pcap.py, and
+    given the @remotes to restrict to, only their records are read out of the indexed capture.
+
+    When the analyzer replays the capture at its pace (see clock.PacedCaptureClock), packets are held back until
+    they are due: attached to a runtime, reading pauses and the remaining packets are rescheduled, so the loop
+    keeps serving the reporters meanwhile.
+    """
 
-    def __init__(self, analyzer, input_file_name):
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, analyzer, input_file_name, build_index=False, remotes=None):
         BaseCollector.__init__(self, analyzer)
         self.analyser = analyzer
         self.cap_reader_process = None
         self.input_file_name = input_file_name
+        self.compression = detect_compression(input_file_name)
+        self.build_index = build_index
+        self.remotes = remotes
+        self.index = None
+        if (build_index or remotes) and self.compression:
+            raise ValueError("Indexing needs an uncompressed capture, {0} is {1}".format(input_file_name,
+                                                                                        self.compression))
+        if remotes:
+            self.index = pcap.load_index(input_file_name)
+            if self.index is None:
+                raise ValueError("No up to date index of {0}, build it with a first run".format(input_file_name))
         self._running = threading.Event()
+        self._runtime = None
+        self._partial_line = ""
+        self._feeder = None
+        self._pending = deque()  # Packets read but not due yet, when paced
+        self._reading = False
+        self._ended = False
 
     def start(self):
         logging.debug("Collector started!")
@@ -25,24 +109,151 @@ class TCPDumpFileCollector(BaseCollector):
         self._running.set()
         self._collect() # takes-over main thread
 
-    def _start_cap_reader(self):
-        tcpdump_r_cmd = ["/usr/sbin/tcpdump", "-nn", "-tt", "-SU", "-r {0}".format(self.input_file_name), "2>/dev/null"]
+    def attach(self, runtime):
+        """
+        Reads the tcpdump output from the @runtime loop instead of taking over the main thread.
+        Every read hands a batch of lines to the analyzer, and reading stops at the end of the capture.
+        """
+        logging.debug("Collector attached!")
+        self._start_cap_reader()
+        self._running.set()
+        self._runtime = runtime
+        fd = self.cap_reader_process.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        runtime.add_reader(fd, self._read_batch)
+        self._reading = True
 
-        self.cap_reader_process = subprocess.Popen(" ".join(tcpdump_r_cmd), stdout=subprocess.PIPE,
+    def _paced_clock(self):
+        clock = getattr(self.analyser, 'clock', None)
+        return clock if hasattr(clock, 'delay') else None  # See clock.PacedCaptureClock
+
+    def _read_batch(self):
+        fd = self.cap_reader_process.stdout.fileno()
+        try:
+            chunk = os.read(fd, TCPDumpFileCollector.READ_SIZE)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        lines = (self._partial_line + chunk).split("\n")
+        self._partial_line = lines.pop() if chunk else ""
+        if not chunk:
+            logging.info("End of capture %s", self.input_file_name)
+            self._runtime.remove_reader(fd)
+            self._reading = False
+            self._ended = True
+
+        if self._paced_clock() is not None:
+            self._pending.extend(packet for packet in (parse_line(line) for line in lines) if packet is not None)
+            self._replay()
+            return
+
+        analyse = self.analyser.analyse
+        for line in lines:
+            packet = parse_line(line)
+            if packet is not None:
+                analyse(packet)
+
+    def _replay(self):
+        """
+        Analyzes the pending packets that are due. Reading pauses until the next one is, and is resumed once all
+        pending packets were analyzed.
+        """
+        if not self._running.is_set():
+            return
+
+        clock = self._paced_clock()
+        fd = self.cap_reader_process.stdout.fileno()
+        while self._pending:
+            delay = clock.delay(self._pending[0].timestamp)
+            if delay > 0:
+                if self._reading:
+                    self._runtime.remove_reader(fd)
+                    self._reading = False
+                self._runtime.call_later(delay, self._replay)
+                return
+
+            self.analyser.analyse(self._pending.popleft())
+
+        if not self._reading and not self._ended:
+            self._runtime.add_reader(fd, self._read_batch)
+            self._reading = True
+
+    def _is_fed(self):
+        return bool(self.compression or self.build_index or self.remotes)
+
+    def _open_source(self):
+        if self.remotes:
+            logging.info("Reading remotes %s of capture %s", ", ".join(self.remotes), self.input_file_name)
+            return pcap.RestrictedCapture(self.input_file_name, self.index, self.remotes)
+        if self.build_index:
+            logging.info("Indexing capture %s", self.input_file_name)
+            return pcap.IndexingCapture(self.input_file_name)
+
+        logging.info("Decompressing %s capture %s", self.compression, self.input_file_name)
+        return open_decompressed(self.input_file_name, self.compression)
+
+    def _cap_reader_input(self):
+        return "-" if self._is_fed() else self.input_file_name
+
+    def _cap_reader_cmd(self):
+        return ["/usr/sbin/tcpdump", "-nn", "-tt", "-SU", "-r {0}".format(self._cap_reader_input()), "2>/dev/null"]
+
+    def _start_cap_reader(self):
+        self.cap_reader_process = subprocess.Popen(" ".join(self._cap_reader_cmd()), stdout=subprocess.PIPE,
+                                                   stdin=subprocess.PIPE if self._is_fed() else None,
                                                    shell=True, preexec_fn=os.setsid)
+        if self._is_fed():
+            self._feeder = threading.Thread(target=self._feed, args=(self._open_source(),
+                                                                     self.cap_reader_process.stdin),
+                                            name="trtop-feeder")
+            self._feeder.daemon = True
+            self._feeder.start()
+
+    def _feed(self, source, sink):
+        try:
+            for chunk in iter(lambda: source.read(DECOMPRESS_READ_SIZE), ''):
+                sink.write(chunk)
+        except IOError, e:
+            if e.errno != errno.EPIPE:  # Otherwise tcpdump stopped reading, eg. stop()
+                logging.exception("Feeding {0} failed".format(self.input_file_name))
+        finally:
+            source.close()
+            try:
+                sink.close()
+            except IOError, e:
+                logging.debug("tcpdump already exited: %s", e)
 
     def stop(self):
         logging.debug("Collector stopping...")
         self._running.clear()
-        os.killpg(self.cap_reader_process.pid, signal.SIGTERM)
-        subprocess.Popen.kill(self.cap_reader_process)
+        if self.cap_reader_process is None:
+            return
+
+        if self._runtime is not None:
+            self._runtime.remove_reader(self.cap_reader_process.stdout.fileno())
+        try:
+            os.killpg(self.cap_reader_process.pid, signal.SIGTERM)
+            subprocess.Popen.kill(self.cap_reader_process)
+        except OSError, e:
+            logging.debug("tcpdump already exited: %s", e)
+        self.cap_reader_process.wait()
+        if self._feeder is not None:
+            self._feeder.join(1)
         logging.debug("Collector stopped!")
 
     def _collect(self):
+        clock = self._paced_clock()
         while self._running.is_set():
             for line in iter(lambda: self.cap_reader_process.stdout.readline(), ''):
                 if not self._running.is_set():
                     break
 
-                if is_valid_line(line):
-                    self.analyser.analyse(build_packet(line))
\ No newline at end of file
+                packet = parse_line(line)
+                if packet is not None:
+                    if clock is not None:
+                        delay = clock.delay(packet.timestamp)
+                        if delay > 0:
+                            time.sleep(delay)  # The collector owns this thread
+                    self.analyser.analyse(packet)
\ No newline at end of file
@@ -1,56 +1,59 @@
-__author__ = 'Thomas Kountis'
-
-
-TIMESTAMP_IDX = 0
-SRC_IDX = 2
-DST_IDX = 4
-FLAGS_IDX = 6
-
-MIN_LINE_PARTS_LENGTH = 9
-
-
-def is_valid_line(line):
-    parts = line.split(" ")
-    return len(parts) >= MIN_LINE_PARTS_LENGTH and parts[1] == "IP" and parts[5] == "Flags"
+import re
 
+from . import parent_module
 
-def _extract_sequence(line):
-    index_of_seq = line.find(' seq ')
-    seq = line[index_of_seq + 5: line.index(',', index_of_seq)] if index_of_seq > 0 else "0"
-    seq = seq.split(":")[1] if seq.find(":") > 0 else seq
-    return int(seq)
+UnifiedPacket = parent_module("packet").UnifiedPacket
+parse = parent_module("address").parse
 
-
-def _extract_ts_val(line):
-    index_of_ts = line.find('TS val') + 7
-    return line[index_of_ts: line.index(' ', index_of_ts)]
+__author__ = 'Thomas Kountis'
 
 
-def _extract_length(line):
-    index_of_len = line.find('length') + 7
-    index_of_len_end = line.find(':', index_of_len)
-    index_of_len_end = index_of_len_end if index_of_len_end > 0 else line.find('', index_of_len) + 1
-    return int(line[index_of_len:index_of_len_end])
+# A TCP line of `tcpdump -n`, over IPv4 or IPv6 (IP6 2001:db8::1.53678 > ...), eg.
+# 1443817535.982069 IP 127.0.0.1.53678 > 10.0.0.2.80: Flags [P.], seq 4173560242:4173561044, ack 2963972604,
+#   win 115, options [nop,nop,TS val 2472289786 ecr 2770592028], length 802
+# Anchored on the timestamp, so other lines (ARP, UDP..) are rejected at their first mismatching token.
+TCP_LINE = re.compile(r"(\S+) IP6? (\S+)\.(\d+) > (\S+)\.(\d+): Flags \[([^\]]*)\]"
+                      r"(?:, seq (?:\d+:)?(\d+))?"
+                      r"(?:, ack (\d+))?"
+                      r"(?:[^\[\n]*options \[[^\]]*?mss (\d+))?"
+                      r"(?:.*? length (\d+))?")
+
+
+def parse_line(line):
+    """
+    The UnifiedPacket of a tcpdump TCP @line, in a single pass, or None for any other line.
+    Addresses are integers, see address.py.
+    Without seq, ack or length their fields are 0, and the end of the "seq start:end" range is the sequence.
+    """
+    match = TCP_LINE.match(line)
+    if match is None:
+        return None
+
+    timestamp, src, src_port, dst, dst_port, flags, sequence, ack, mss, length = match.groups()
+    packet = UnifiedPacket()
+    try:
+        packet.src = parse(src)
+        packet.dst = parse(dst)
+    except ValueError:
+        return None  # Names instead of addresses, without -n
+    packet.src_port = int(src_port)
+    packet.dst_port = int(dst_port)
+    packet.flags = flags
+    packet.timestamp = timestamp
+    packet.ack = int(ack) if ack else 0
+    packet.sequence = int(sequence) if sequence else 0
+    packet.length = int(length) if length else 0
+    packet.mss = int(mss) if mss else None
+    return packet
 
 
-def _extract_ack(line):
-    index_of_ack = line.find(' ack ')
-    return int(line[index_of_ack + 5: line.index(',', index_of_ack)]) if index_of_ack > 0 else 0
+def is_valid_line(line):
+    return TCP_LINE.match(line) is not None
 
 
 def build_packet(line):
-    parts = line.split(" ")
+    packet = parse_line(line)
+    if packet is None:
+        raise ValueError("Not a tcpdump TCP line: {0}".format(line.rstrip()))
 
-    from packet import UnifiedPacket
-    packet = UnifiedPacket()
-    packet.src = parts[SRC_IDX].rpartition(".")[0]
-    packet.src_port = int(parts[SRC_IDX].rpartition(".")[2])
-    packet.dst = parts[DST_IDX].rpartition(".")[0]
-    packet.dst_port = int(parts[DST_IDX].rpartition(".")[2][:-1])
-    packet.flags = parts[FLAGS_IDX].replace("[", "").replace("]", "").replace(",", "")
-    packet.timestamp = parts[TIMESTAMP_IDX]
-    packet.ack = _extract_ack(line)
-    packet.sequence = _extract_sequence(line)
-    packet.length = _extract_length(line)
     return packet
-
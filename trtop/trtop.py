@@ -1,16 +1,11 @@
-import argparse
-import imp
 import time
 import signal
 import logging
-import os
+import importlib
 
 from functools import partial
-from whitelisting import DefaultWhitelist
-from analyzer import OutgoingTCPAnalyzer
-from resolver import DefaultDNSResolver
-from reporter import CLICursesOutgoingTCPReporter
-from tcpdump.offlinecollector import TCPDumpFileCollector
+from pipeline import Pipeline
+from heavyhitters import OTHER_BUCKET, BUCKETS
 
 
 __author__ = 'Thomas Kountis'
@@ -20,72 +15,248 @@ __author__ = 'Thomas Kountis'
 
 
 DEFAULT_SNAPSHOT_PERIOD = 2  # Minutes
+DEFAULT_CHECKPOINT_INTERVAL = 60  # Secs
+
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='TCP Remote TOP')
+    parser.add_argument('-o', '--out',
+                        help='Filename prefix for the generated report file(s). (default: time.time())')
+    parser.add_argument('-i', '--input',
+                        help='Filename of pcap file to analyze, optionally gzip, bz2 or xz compressed. Offline mode.')
+    parser.add_argument('-if', '--interface',
+                        help='The network interface to attach to. (default: first found ethernet IF)')
+    parser.add_argument('-bpf', '--bpf_filter',
+                        help='The BSD Packet Filter for libpcap to filter out unwanted traffic.')
+    parser.add_argument('-bi', '--build_index', action='store_true',
+                        help='Index the records of every remote of the input capture, in a .trtopidx file next to it.')
+    parser.add_argument('-rr', '--restrict_remotes',
+                        help='Comma separated remotes, "addr:port" or "addr", to read out of an indexed input '
+                             'capture, skipping the records of every other remote.')
+
+    parser.add_argument('-rs', '--replay_speed', type=float, default=0,
+                        help='Offline mode replay speed, relative to the capture pace, '
+                             'eg. 10 replays 10 times faster. Rates and refreshes follow the capture timestamps '
+                             'at any speed. '
+                             '(default: 0, as fast as possible)')
+
+    parser.add_argument('-am', '--analyzer_module',
+                        help='The analyzer builder module, a module available in the path '
+                             'containing a function "build()" that creates and returns an '
+                             'instance of analyzer.BaseAnalyzer (default: OutgoingTCPAnalyzer)')
+
+    parser.add_argument('-cm', '--collector_module',
+                        help='The collector builder module, a module available in the path '
+                             'containing a function "build()" that creates and returns an '
+                             'instance of collector.BaseCollector '
+                             '(default: TCPDumpExecCollector)')
+
+    parser.add_argument('-rm', '--reporter_module',
+                        help='The reporter builder module, a module available in the path '
+                             'containing a function "build()" that creates and returns an '
+                             'instance of reporter.BaseReporter '
+                             '(default: CLICursesOutgoingTCPReporter)')
+
+    parser.add_argument('-wm', '--whitelist_module',
+                        help='The whitelist builder module, a module available in the path '
+                             'containing a function "build()" that creates and returns an '
+                             'instance of whitelist.BaseWhitelist (default: DefaultWhitelist)')
+
+    parser.add_argument('-tm', '--resolver_module',
+                        help='The resolver builder module, a module available in the path '
+                             'containing a function "build()" that creates and returns an '
+                             'instance of resolver.BaseResolver (default: DefaultDNSResolver)')
+
+    parser.add_argument('-dns', '--resolve_dns', action='store_true',
+                        help='Name remotes with reverse DNS lookups, run in the background. (default: addresses)')
+
+    parser.add_argument('-k', '--top_remotes', type=int,
+                        help='Keep full statistics only for the top K remotes by traffic, folding the rest into an '
+                             'aggregated "{0}" remote. (default: track every remote)'.format(OTHER_BUCKET))
+
+    parser.add_argument('-kb', '--top_remotes_bucket', choices=sorted(BUCKETS), default="other",
+                        help='How the remotes beyond the top K are folded: into a single remote, one per remote port, '
+                             'or one per /24 (/64 for IPv6) subnet. (default: other)')
+
+    parser.add_argument('-st', '--session_timeout', type=int, default=600,
+                        help='Seconds of capture time after which idle connections are forgotten. (default: 600)')
+
+    parser.add_argument('-as', '--adaptive_sampling', action='store_true',
+                        help='Shed load by sampling whole flows when the analysis falls behind the capture, '
+                             'counters are scaled up by the sampling rate. (default: analyze every flow)')
+    parser.add_argument('-ml', '--max_lag', type=float, default=2.0,
+                        help='Seconds the analysis may fall behind the capture before flows are sampled. (default: 2)')
+
+    parser.add_argument('-cp', '--checkpoint',
+                        help='Filename of the analyzer state checkpoint. Restored on start-up if '
+                             'present, and periodically re-written while running.')
+    parser.add_argument('-ci', '--checkpoint_interval', type=int, default=DEFAULT_CHECKPOINT_INTERVAL,
+                        help='Seconds between checkpoints. (default: {0})'.format(DEFAULT_CHECKPOINT_INTERVAL))
+
+    parser.add_argument('-si', '--summary_interval', type=int,
+                        help='Seconds between per-remote summaries appended as JSON lines to <out>.trtop.jsonl. '
+                             '(default: no periodic summary)')
+    parser.add_argument('-sm', '--summary_max_mb', type=int, default=64,
+                        help='Size in MB after which the summary file is rolled, at most 4 rolled files are kept. '
+                             '(default: 64)')
+    parser.add_argument('-sz', '--summary_compress', action='store_true', help='Gzip rolled summary files.')
+
+    parser.add_argument('-od', '--outlier_dump',
+                        help='Append the last packets of connections with outlier handshake or transport times to '
+                             'this file, as JSON lines. Requires --outlier_threshold or --outlier_percentile.')
+    parser.add_argument('-ot', '--outlier_threshold', type=float,
+                        help='Handshake or transport time in ms over which a connection is an outlier.')
+    parser.add_argument('-op', '--outlier_percentile', type=float,
+                        help='Percentile of its remote over which a connection is an outlier, eg. 99.9.')
+    parser.add_argument('-ob', '--outlier_budget_mb', type=int, default=16,
+                        help='Memory in MB for the per-connection packet rings. (default: 16)')
+
+    parser.add_argument('-ld', '--latency_samples',
+                        help='Append every handshake and request/response latency sample to binary columns in this '
+                             'directory, see samples.py. (default: disabled)')
+    parser.add_argument('-lm', '--latency_samples_mb', type=int, default=256,
+                        help='Size in MB of each segment of latency samples. (default: 256)')
+
+    parser.add_argument('-mp', '--metrics_port', type=int,
+                        help='Serve Prometheus (/metrics) and JSON (/metrics.json) statistics on this local port. '
+                             '(default: disabled)')
+
+    parser.add_argument('-ag', '--agent',
+                        help='Ship per-remote summaries to the aggregator listening on this address, '
+                             'either "host:port" or "unix:/path". (default: disabled)')
+    parser.add_argument('-ai', '--agent_interval', type=int, default=5,
+                        help='Seconds between summaries shipped to the aggregator. (default: 5)')
+    parser.add_argument('-ga', '--aggregate',
+                        help='Aggregator mode, merge and report the summaries shipped by trtop agents '
+                             'to this address, either "host:port" or "unix:/path", '
+                             'instead of analyzing a capture.')
+
+    parser.add_argument('-pu', '--publish', nargs='?', const="trtop",
+                        help='Publish the statistics to a shared memory segment of this name (default: trtop), '
+                             'for any number of --attach viewers.')
+    parser.add_argument('-pi', '--publish_interval', type=float, default=1,
+                        help='Seconds between published statistics. (default: 1)')
+    parser.add_argument('-at', '--attach', nargs='?', const="trtop",
+                        help='Viewer mode, display the statistics published with --publish to the shared memory '
+                             'segment of this name (default: trtop), instead of analyzing a capture.')
+
+    #TODO add whitelist option csv
+    #TODO add no-resolve option, use ip
+    #TODO add support for --mode
+    parser.add_argument('-m', '--mode', choices=["continuous", "snapshot"],
+                        help='The collection mode, continuous or snapshot. '
+                             'In continuous mode trtop will collect statistics until user interruption. '
+                             'In snapshot mode trtop will collect statistics for {0} minutes and exit with a report.'
+                        .format(DEFAULT_SNAPSHOT_PERIOD))
+
+    return parser
+
+
+def parse_args(argv=None):
+    return build_parser().parse_args(argv)
+
 
-parser = argparse.ArgumentParser(description='TCP Remote TOP')
-parser.add_argument('-o', '--out', help='Filename prefix for the generated report file(s). (default: time.time())')
-parser.add_argument('-i', '--input', help='Filename of pcap file to analyze. Offline mode.')
-parser.add_argument('-if', '--interface', help='The network interface to attach to. (default: first found ethernet IF)')
-parser.add_argument('-bpf', '--bpf_filter', help='The BSD Packet Filter for libpcap to filter out unwanted traffic.')
-
-parser.add_argument('-am', '--analyzer_module', help='The analyzer builder module, a module available in the path '
-                                                     'containing a function "build()" that creates and returns an '
-                                                     'instance of analyzer.BaseAnalyzer (default: OutgoingTCPAnalyzer)')
-
-parser.add_argument('-cm', '--collector_module', help='The collector builder module, a module available in the path '
-                                                      'containing a function "build()" that creates and returns an '
-                                                      'instance of collector.BaseCollector '
-                                                      '(default: TCPDumpExecCollector)')
-
-parser.add_argument('-rm', '--reporter_module', help='The reporter builder module, a module available in the path '
-                                                     'containing a function "build()" that creates and returns an '
-                                                     'instance of reporter.BaseReporter '
-                                                     '(default: CLICursesOutgoingTCPReporter)')
-
-parser.add_argument('-wm', '--whitelist_module', help='The whitelist builder module, a module available in the path '
-                                                      'containing a function "build()" that creates and returns an '
-                                                      'instance of whitelist.BaseWhitelist (default: DefaultWhitelist)')
-
-parser.add_argument('-tm', '--resolver_module', help='The resolver builder module, a module available in the path '
-                                                     'containing a function "build()" that creates and returns an '
-                                                     'instance of resolver.BaseResolver (default: DefaultDNSResolver)')
-
-#TODO add whitelist option csv
-#TODO add no-resolve option, use ip
-#TODO add support for --mode
-parser.add_argument('-m', '--mode', choices=["continuous", "snapshot"],
-                    help='The collection mode, continuous or snapshot. '
-                         'In continuous mode trtop will collect statistics until user interruption. '
-                         'In snapshot mode trtop will collect statistics for {0} minutes and exit with a report.'
-                    .format(DEFAULT_SNAPSHOT_PERIOD))
-
-args = parser.parse_args()
 loaded_modules = []
 
 
 def build_or_default(name, default):
     if name:
         logging.info("Loading module {0}...".format(name))
-        fp, pathname, description = imp.find_module(name)
-        loaded_module = imp.load_module(name, fp, pathname, description)
+        loaded_module = importlib.import_module(name)
         loaded_modules.append(loaded_module)
         return loaded_module.build()
     else:
         return default()
 
-report_filename_prefix = args.out if args.out else "{0}".format(str(int(time.time())))
-dump_input_filename = args.input if args.input else None
-interface = args.interface
-bpf_filter = args.bpf_filter
 
-default_whitelist = build_or_default(args.whitelist_module, lambda: DefaultWhitelist())
-default_resolver = build_or_default(args.resolver_module, lambda: DefaultDNSResolver())
-default_analyzer = build_or_default(args.analyzer_module,
-                                    lambda: OutgoingTCPAnalyzer(default_whitelist, default_resolver))
-default_collector = build_or_default(args.collector_module,
-                                         lambda: TCPDumpFileCollector(default_analyzer, dump_input_filename))
+def build_from_args(args, runtime=None):
+    """
+    The Pipeline described by the command line @args, only importing the components it uses.
+    DNS names are resolved on the workers of @runtime.
+    """
+    from analyzer import OutgoingTCPAnalyzer
+    from whitelisting import DefaultWhitelist
+    from resolver import DefaultDNSResolver
+    from clock import WALL_CLOCK, build_clock
+
+    report_filename_prefix = args.out if args.out else "{0}".format(str(int(time.time())))
+    dump_input_filename = args.input if args.input else None
+
+    default_whitelist = build_or_default(args.whitelist_module, lambda: DefaultWhitelist())
+    default_resolver = build_or_default(args.resolver_module, lambda: DefaultDNSResolver())
+    if args.resolve_dns:
+        from resolver import AsyncResolver, ReverseDNSResolver
+        default_resolver = AsyncResolver(ReverseDNSResolver(), runtime)
+    default_clock = build_clock(args.replay_speed) if dump_input_filename else WALL_CLOCK
+    if args.aggregate:
+        from aggregation import SummaryAggregator
+
+        # The aggregator both feeds the reporter and serves the agents on the main thread
+        default_analyzer = default_collector = SummaryAggregator(args.aggregate)
+    elif args.attach:
+        from shm import SnapshotViewer
+
+        # The viewer both feeds the reporter and polls the shared segment from the runtime
+        default_analyzer = default_collector = SnapshotViewer(args.attach, args.publish_interval)
+    else:
+        sampler = None
+        if args.adaptive_sampling:
+            from sampling import AdaptiveFlowSampler
+            sampler = AdaptiveFlowSampler(args.max_lag)
+
+        overflow_bucket = BUCKETS[args.top_remotes_bucket]
+        default_analyzer = build_or_default(args.analyzer_module,
+                                            lambda: OutgoingTCPAnalyzer(default_whitelist, default_resolver,
+                                                                        max_tracked_remotes=args.top_remotes,
+                                                                        overflow_bucket=overflow_bucket,
+                                                                        sampler=sampler, clock=default_clock,
+                                                                        session_timeout=args.session_timeout))
+        default_collector = build_or_default(args.collector_module,
+                                             lambda: _offline_collector(default_analyzer, dump_input_filename,
+                                                                        args.build_index, args.restrict_remotes))
+
+    default_reporter = build_or_default(args.reporter_module,
+                                        lambda: _curses_reporter(default_analyzer, report_filename_prefix))
 
-default_reporter = build_or_default(args.reporter_module,
-                                    lambda: CLICursesOutgoingTCPReporter(default_analyzer, report_filename_prefix))
+    default_services = []
+    if args.checkpoint:
+        from checkpoint import Checkpointer
+        default_services.append(Checkpointer(default_analyzer, args.checkpoint, args.checkpoint_interval))
+    if args.summary_interval:
+        from summary import SummaryWriter
+        default_services.append(SummaryWriter(default_analyzer, report_filename_prefix, args.summary_interval,
+                                              args.summary_max_mb * 1024 * 1024, compress=args.summary_compress))
+    if args.agent:
+        from aggregation import SummaryAgent
+        default_services.append(SummaryAgent(default_analyzer, args.agent, args.agent_interval))
+    if args.outlier_dump:
+        from outliers import OutlierRecorder
+        default_services.append(OutlierRecorder(default_analyzer, args.outlier_dump, args.outlier_threshold,
+                                                args.outlier_percentile, args.outlier_budget_mb))
+    if args.latency_samples:
+        from samples import SampleSink
+        default_services.append(SampleSink(default_analyzer, args.latency_samples, args.latency_samples_mb))
+    if args.publish:
+        from shm import SnapshotPublisher
+        default_services.append(SnapshotPublisher(default_analyzer, args.publish, args.publish_interval))
+    if args.metrics_port:
+        from exporter import PrometheusExporterReporter
+        default_services.append(PrometheusExporterReporter(default_analyzer, port=args.metrics_port))
+
+    return Pipeline(default_collector, default_analyzer, default_reporter, default_services)
+
+
+def _offline_collector(analyzer, input_filename, build_index=False, restrict_remotes=None):
+    from tcpdump.offlinecollector import TCPDumpFileCollector
+    remotes = [remote.strip() for remote in restrict_remotes.split(",")] if restrict_remotes else None
+    return TCPDumpFileCollector(analyzer, input_filename, build_index=build_index, remotes=remotes)
+
+
+def _curses_reporter(analyzer, summary_filename):
+    from reporter import CLICursesOutgoingTCPReporter
+    return CLICursesOutgoingTCPReporter(analyzer, summary_filename)
 
 
 def _clean_up_modules():
@@ -95,25 +266,42 @@ def _clean_up_modules():
         logging.info("CLEANED!")
 
 
-def _stop_trtop(collector, analyzer, reporter):
-    logging.info("TRTOP session finished!")
-    collector.stop()
-    reporter.stop()
-    _clean_up_modules()
-    os._exit(0) # TODO without force it hangs here, investigate if the main thread is still blocked
+def _signal_handler(runtime, signal, frame):
+    logging.info("Caught SIGINT, exiting...")
+    runtime.stop()
 
 
-def _signal_handler(collector, analyzer, reporter, signal, frame):
-    logging.info("Caught SIGINT, exiting...")
-    _stop_trtop(collector, analyzer, reporter)
+def run(pipeline, runtime=None):
+    """
+    Runs @pipeline until SIGINT.
+    """
+    from runtime import Runtime
+
+    runtime = runtime or Runtime()
+    signal.signal(signal.SIGINT, partial(_signal_handler, runtime))
+    try:
+        pipeline.run(runtime)
+    finally:
+        logging.info("TRTOP session finished!")
+        _clean_up_modules()
+
+
+def main(collector, analyzer, reporter, services=()):
+    """
+    Services are background components (eg. checkpoint.Checkpointer) exposing start() and stop(),
+    started before the reporter and stopped after it.
+    """
+    run(Pipeline(collector, analyzer, reporter, services))
 
 
-def main(collector, analyzer, reporter):
-    logging.info("New TRTOP session with: {0}".format(str((collector.__class__, analyzer.__class__, reporter.__class__))))
-    signal.signal(signal.SIGINT, partial(_signal_handler, collector, analyzer, reporter))
+def cli(argv=None):
+    """
+    Command line entry point, @argv defaults to sys.argv.
+    """
+    from runtime import Runtime
 
-    reporter.start()
-    collector.start()
+    runtime = Runtime()
+    run(build_from_args(parse_args(argv), runtime), runtime)
 
 if __name__ == "__main__":
-    main(default_collector, default_analyzer, default_reporter)
+    cli()
@@ -1,3 +1,5 @@
+from address import parse
+
 __author__ = 'Thomas Kountis'
 
 
@@ -20,10 +22,13 @@ class DefaultWhitelist(BaseWhitelist):
 
 
 class StaticListWhitelist(BaseWhitelist):
+    """
+    Allows the @allowed addresses, given as text and matched against the integer addresses of packets.
+    """
 
     def __init__(self, allowed):
         BaseWhitelist.__init__(self)
-        self.allowed = allowed
+        self.allowed = set(parse(host) for host in allowed)
 
     def allow(self, host, port):
         return host in self.allowed
@@ -0,0 +1,202 @@
+import math
+
+__author__ = 'Thomas Kountis'
+
+
+class LogHistogram(object):
+    """
+    Histogram over logarithmically spaced buckets, with a relative error of (GROWTH - 1) / 2 per value.
+    Buckets are sparse and bounded by [MIN_VALUE, MAX_VALUE], so memory stays fixed however many values
+    are added, and two histograms merge by adding their bucket counts.
+    """
+
+    GROWTH = 1.05
+    MIN_VALUE = 0.001  # ms
+    MAX_VALUE = 3600000.0  # ms
+
+    _LOG_GROWTH = math.log(GROWTH)
+    _MIN_BUCKET = int(math.floor(math.log(MIN_VALUE) / _LOG_GROWTH))
+    _MAX_BUCKET = int(math.ceil(math.log(MAX_VALUE) / _LOG_GROWTH))
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket_of(value):
+        if value <= LogHistogram.MIN_VALUE:
+            return LogHistogram._MIN_BUCKET
+
+        return min(int(math.floor(math.log(value) / LogHistogram._LOG_GROWTH)), LogHistogram._MAX_BUCKET)
+
+    @staticmethod
+    def value_of(bucket):
+        """
+        Representative value of @bucket, the middle of its bounds.
+        """
+        return (LogHistogram.GROWTH ** bucket) * (1 + LogHistogram.GROWTH) / 2
+
+    def notify(self, value):
+        bucket = LogHistogram.bucket_of(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+        self.count += other.count
+        self.sum += other.sum
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def clear(self):
+        self.buckets.clear()
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def write(self, writer):
+        """
+        Encodes this histogram with a codec.BinaryWriter.
+        """
+        buckets = list(self.buckets.items())  # The analyzer keeps adding to it while dumping
+        writer.uint(len(buckets))
+        for bucket, count in buckets:
+            writer.sint(bucket)
+            writer.uint(count)
+        writer.uint(self.count)
+        writer.float(self.sum)
+        writer.value(self.min)
+        writer.value(self.max)
+
+    @staticmethod
+    def read(reader):
+        """
+        Decodes a histogram encoded with write() from a codec.BinaryReader.
+        """
+        histogram = LogHistogram()
+        for _ in range(reader.uint()):
+            bucket = reader.sint()
+            histogram.buckets[bucket] = reader.uint()
+        histogram.count = reader.uint()
+        histogram.sum = reader.float()
+        histogram.min = reader.value()
+        histogram.max = reader.value()
+        return histogram
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(max(LogHistogram.value_of(bucket), self.min), self.max)
+
+        return self.max
+
+
+class WindowedStats(object):
+    """
+    Counters and histograms over the last @span seconds of capture time, kept in a ring of @slots buckets.
+    Updates are O(1): the bucket a timestamp falls in is recycled lazily when the ring wraps around,
+    and reads merge the buckets that are still within the window of the given time.
+    """
+
+    def __init__(self, span, slots):
+        self.span = span
+        self.slots = slots
+        self.width = float(span) / slots
+        self.epochs = [None] * slots
+        self.counters = [{} for _ in range(slots)]
+        self.histograms = [{} for _ in range(slots)]
+        self.latest_epoch = None
+
+    def _slot(self, timestamp):
+        epoch = int(timestamp / self.width)
+        if self.latest_epoch is not None and epoch <= self.latest_epoch - self.slots:
+            return None  # Older than the window
+
+        self.latest_epoch = epoch if self.latest_epoch is None else max(epoch, self.latest_epoch)
+        index = epoch % self.slots
+        if self.epochs[index] != epoch:
+            self.epochs[index] = epoch
+            self.counters[index].clear()
+            for histogram in self.histograms[index].values():
+                histogram.clear()
+
+        return index
+
+    def _live_slots(self, now):
+        first_epoch = int(now / self.width) - self.slots
+        return [index for index in range(self.slots)
+                if self.epochs[index] is not None and self.epochs[index] > first_epoch]
+
+    def count(self, name, timestamp, value=1):
+        index = self._slot(timestamp)
+        if index is not None:
+            counters = self.counters[index]
+            counters[name] = counters.get(name, 0) + value
+
+    def sample(self, name, timestamp, value):
+        index = self._slot(timestamp)
+        if index is not None:
+            histogram = self.histograms[index].get(name)
+            if histogram is None:
+                histogram = self.histograms[index][name] = LogHistogram()
+            histogram.notify(value)
+
+    def get_count(self, name, now):
+        return sum(self.counters[index].get(name, 0) for index in self._live_slots(now))
+
+    def get_rate(self, name, now):
+        return self.get_count(name, now) / float(self.span)
+
+    def get_histogram(self, name, now):
+        merged = LogHistogram()
+        for index in self._live_slots(now):
+            histogram = self.histograms[index].get(name)
+            if histogram is not None:
+                merged.merge(histogram)
+
+        return merged
+
+
+class Windows(object):
+    """
+    The set of sliding windows kept per remote, named as in WINDOWS.
+    """
+
+    WINDOWS = [("10s", 10, 10), ("1m", 60, 12), ("5m", 300, 30)]
+    NAMES = [name for name, _, _ in WINDOWS]
+
+    def __init__(self):
+        self.windows = dict((name, WindowedStats(span, slots)) for name, span, slots in Windows.WINDOWS)
+        self._all = self.windows.values()
+
+    def count(self, name, timestamp, value=1):
+        timestamp = float(timestamp)
+        for window in self._all:
+            window.count(name, timestamp, value)
+
+    def sample(self, name, timestamp, value):
+        timestamp = float(timestamp)
+        for window in self._all:
+            window.sample(name, timestamp, value)
+
+    def get(self, window):
+        return self.windows[window]